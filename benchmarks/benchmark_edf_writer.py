@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2022, Frederik D. Weber
+
+Speed benchmark of the EDF writer of the zmax_edf_merge_converter for compact
+recordings (--compact): the serial writer through pyedflib (--write_workers 1)
+against the preallocated, memory-mapped writer with several threads
+(--write_workers N). A synthetic recording with many channels is written to a
+temporary folder (or --output_dir, e.g. on the storage of the archive) and
+all outputs are checked to be the same file.
+
+python benchmarks/benchmark_edf_writer.py
+python benchmarks/benchmark_edf_writer.py --hours 10 --channels 24 --workers 1 2 4 8 -1
+python benchmarks/benchmark_edf_writer.py --output_dir "D:\\fast\\scratch" --repeats 5
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+def get_repository_path():
+	return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_recording(zmax_edf_merge_converter, n_channels, n_samples, sfreq=256.0, seed=0):
+	import numpy
+	rng = numpy.random.default_rng(seed)
+	recording = zmax_edf_merge_converter.CompactRecording(sfreq, datetime.datetime(2022, 5, 1, 22, 0, 0, tzinfo=datetime.timezone.utc))
+	for iCh in range(n_channels):
+		data = rng.integers(-32768, 32768, n_samples, dtype=numpy.int16)
+		recording.add_channel('CH%02d' % iCh, data, 'uV', -3000.0, 3000.0, -32768, 32767)
+	return recording
+
+def time_writer(zmax_edf_merge_converter, recording, filepath, workers, repeats):
+	durations = []
+	for iRepeat in range(repeats):
+		if os.path.exists(filepath):
+			os.remove(filepath)
+		t_start = time.perf_counter()
+		zmax_edf_merge_converter.write_compact_to_edf(recording, filepath, workers=workers)
+		durations.append(time.perf_counter() - t_start)
+	return durations, zmax_edf_merge_converter.get_file_hash(filepath, hash_function=hashlib.md5)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Speed benchmark of the serial and the memory-mapped parallel EDF writer of the zmax_edf_merge_converter.')
+	parser.add_argument('--hours', type=float, default=8.0,
+					help='hours of the synthetic 256 Hz recording. Default is 8.0')
+	parser.add_argument('--channels', type=int, default=16,
+					help='number of channels of the synthetic recording. Default is 16')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, -1],
+					help='the --write_workers to compare, 1 is the serial pyedflib writer, -1 all cores. Default is 1 2 4 -1')
+	parser.add_argument('--repeats', type=int, default=3,
+					help='number of repeated runs. Default is 3')
+	parser.add_argument('--output_dir', type=str,
+					help='folder to write the EDF files to (on the storage to benchmark). Default is a temporary folder')
+	args = parser.parse_args()
+
+	sys.path.insert(0, get_repository_path())
+	import zmax_edf_merge_converter
+
+	n_samples = int(args.hours * 3600 * 256)
+	recording = make_recording(zmax_edf_merge_converter, args.channels, n_samples)
+	print("%d channels, %g hours, %d cores" % (args.channels, args.hours, os.cpu_count()))
+
+	failed = False
+	with tempfile.TemporaryDirectory(dir=args.output_dir) as temp_dir:
+		filepath = os.path.join(temp_dir, 'benchmark_merged.edf')
+		file_hashes = set()
+		print("%-24s %10s %10s %10s %10s" % ('writer', 'min [s]', 'median [s]', 'MB/s', 'speedup'))
+		median_serial = None
+		for workers in args.workers:
+			durations, file_hash = time_writer(zmax_edf_merge_converter, recording, filepath, workers, args.repeats)
+			file_hashes.add(file_hash)
+			median = statistics.median(durations)
+			if median_serial is None:
+				median_serial = median
+			name = 'pyedflib_serial' if workers == 1 else 'mapped_%s_workers' % ('all' if workers == -1 else workers)
+			print("%-24s %10.3f %10.3f %10.1f %10.2f" % (name, min(durations), median, os.path.getsize(filepath) / median / 1e6, median_serial / median))
+		if len(file_hashes) > 1:
+			failed = True
+
+	if failed:
+		print('FAILED: the writers wrote different files')
+		sys.exit(1)
+	print('finished')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2022, Frederik D. Weber
+
+Speed and output benchmark of the native EEG cleaner (--zmax_eegcleaner_native)
+of the zmax_edf_merge_converter. A synthetic EEG with the SD-card writing noise
+(85.33 Hz and its harmonics 42.66, 21.33, 10.66, 5.33 Hz) is cleaned and compared
+to the EEG without the noise. Optionally the output is also compared to the one
+of EDFCleaner.exe, given a folder with the EEG L.edf and the EEG L Cleaned.edf of
+EDFCleaner.exe (e.g. a copy of a recording after a run with --zmax_eegcleaner).
+
+python benchmarks/benchmark_eegcleaner.py
+python benchmarks/benchmark_eegcleaner.py --hours 10 --repeats 3 --max_residual_uV 1.0
+python benchmarks/benchmark_eegcleaner.py --reference_dir "C:\\path\\to\\a\\recording\\cleaned\\with\\EDFCleaner"
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HARMONICS_HZ = [5.333, 10.667, 21.333, 42.667, 85.333]
+
+def get_repository_path():
+	return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_noisy_eeg(n_samples, sfreq=256.0, eeg_rms_uV=20.0, noise_amplitudes_uV=(8.0, 6.0, 4.0, 3.0, 10.0), seed=0):
+	import numpy
+	rng = numpy.random.default_rng(seed)
+	# EEG with a 1/f spectrum
+	spectrum = numpy.fft.rfft(rng.standard_normal(n_samples))
+	freqs = numpy.fft.rfftfreq(n_samples, 1.0/sfreq)
+	spectrum[0] = 0
+	spectrum[1:] /= numpy.sqrt(freqs[1:])
+	eeg = numpy.fft.irfft(spectrum, n_samples)
+	eeg *= eeg_rms_uV / eeg.std()
+	# the noise repeats every 48 samples
+	t = numpy.arange(n_samples)
+	noise = sum(a*numpy.sin(2*numpy.pi*k*t/48.0 + k) for a, k in zip(noise_amplitudes_uV, [1, 2, 4, 8, 16]))
+	return eeg, eeg + noise
+
+def get_power_at(data, freq, sfreq=256.0):
+	import numpy
+	n = len(data) - len(data) % 48
+	spectrum = numpy.abs(numpy.fft.rfft(data[:n]))**2
+	return spectrum[int(round(freq * n / sfreq))]
+
+def time_cleaner(zmax_edf_merge_converter, data, repeats, workers):
+	# untimed, so that the imports (scipy.fft) and the thread pool are warm
+	zmax_edf_merge_converter.remove_zmax_sd_card_noise(data, workers=workers)
+	durations = []
+	for iRepeat in range(repeats):
+		t_start = time.perf_counter()
+		cleaned = zmax_edf_merge_converter.remove_zmax_sd_card_noise(data, workers=workers)
+		durations.append(time.perf_counter() - t_start)
+	return durations, cleaned
+
+def compare_to_reference(zmax_edf_merge_converter, reference_dir):
+	import numpy
+	header, data, start_datetime = zmax_edf_merge_converter.read_edf_signal_digital(os.path.join(reference_dir, 'EEG L.edf'))
+	header_ref, data_ref, start_datetime_ref = zmax_edf_merge_converter.read_edf_signal_digital(os.path.join(reference_dir, 'EEG L Cleaned.edf'))
+	scale, offset = zmax_edf_merge_converter.get_edf_digital_mapping(header, 0, header_ref, 0)
+	cleaned = zmax_edf_merge_converter.remove_zmax_sd_card_noise(data)*scale + offset
+	n = min(len(cleaned), len(data_ref))
+	difference = cleaned[:n] - data_ref[:n]
+	ref_scale = (header_ref['physical_max'][0] - header_ref['physical_min'][0]) / (header_ref['digital_max'][0] - header_ref['digital_min'][0])
+	print("reference EDFCleaner.exe: %d samples, rms difference %.3f %s, correlation %.5f" % (n, numpy.sqrt(numpy.mean(difference**2))*ref_scale, header_ref['units'][0], numpy.corrcoef(cleaned[:n], data_ref[:n])[0, 1]))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Speed and output benchmark of the native EEG cleaner of the zmax_edf_merge_converter.')
+	parser.add_argument('--hours', type=float, default=8.0,
+					help='hours of synthetic 256 Hz EEG to clean. Default is 8.0')
+	parser.add_argument('--repeats', type=int, default=5,
+					help='number of repeated runs. Default is 5')
+	parser.add_argument('--max_residual_uV', type=float, default=1.0,
+					help='fail if the rms difference of the cleaned to the noise free EEG is above this. Default is 1.0')
+	parser.add_argument('--reference_dir', type=str,
+					help='optional folder with EEG L.edf and the EEG L Cleaned.edf of EDFCleaner.exe to compare the output with')
+	args = parser.parse_args()
+
+	sys.path.insert(0, get_repository_path())
+	import numpy
+	import zmax_edf_merge_converter
+
+	n_samples = int(args.hours * 3600 * 256)
+	eeg, noisy = make_noisy_eeg(n_samples)
+
+	print("%-24s %10s %10s %12s" % ('cleaner', 'min [s]', 'median [s]', 'MSamples/s'))
+	for name, workers in [('native_1_core', 1), ('native_all_cores', -1)]:
+		durations, cleaned = time_cleaner(zmax_edf_merge_converter, noisy, args.repeats, workers)
+		print("%-24s %10.3f %10.3f %12.1f" % (name, min(durations), statistics.median(durations), n_samples / statistics.median(durations) / 1e6))
+
+	residual = numpy.sqrt(numpy.mean((cleaned - eeg)**2))
+	print("rms of the noise %.3f uV, rms difference of the cleaned to the noise free EEG %.3f uV" % (numpy.sqrt(numpy.mean((noisy - eeg)**2)), residual))
+	for freq in HARMONICS_HZ:
+		print("%8.3f Hz: power reduced by %6.1f dB" % (freq, 10*numpy.log10(get_power_at(noisy, freq) / get_power_at(cleaned, freq))))
+
+	if args.reference_dir is not None:
+		compare_to_reference(zmax_edf_merge_converter, args.reference_dir)
+
+	if residual > args.max_residual_uV:
+		print('FAILED: the cleaned EEG differs more than %g uV (rms) from the noise free EEG' % args.max_residual_uV)
+		sys.exit(1)
+	print('finished')
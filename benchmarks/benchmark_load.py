@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2022, Frederik D. Weber
+
+Load test of the whole zmax_edf_merge_converter command line on a synthetic
+archive. An archive of N ZMax recordings (folders of channel EDFs as
+offloaded, and the same recordings as zip files, no .hyp files) is built and
+the real __main__ entry point is run over it for every case of the option
+matrices (input layouts and --write_zip, hashing, channel selection profiles
+and conversion engines), optionally with several converter processes sharing
+a --work_queue to find where the throughput saturates. The channel EDFs are
+written at 256 Hz, the rate the converter merges to, so these cases measure
+reading, hashing, merging and writing without any resampling. The rates
+matrix builds the recordings once more with the slow channels (accelerometer,
+battery, temperature, light, noise and signal strength) at lower rates, to
+also measure the resampling to 256 Hz and --native_rates. Reported are the
+recordings per hour, the peak RSS of a converter process and the bytes read
+and written per recording (all reads and writes of the processes, i.e. also
+from the page cache, Linux only). With --baseline the results are compared to
+a stored baseline and the benchmark fails if a case regressed by more than
+--max_regression. The baseline depends on the machine and its storage, so it
+is not part of the repository: store one with --save_baseline on the machine
+(and with the options) the comparisons are run with.
+
+python benchmarks/benchmark_load.py
+python benchmarks/benchmark_load.py --recordings 10 40 --processes 1 2 4 --matrix inputs hashing channels engines rates
+python benchmarks/benchmark_load.py --save_baseline benchmarks/load_baseline.json
+python benchmarks/benchmark_load.py --baseline benchmarks/load_baseline.json --max_regression 0.25
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+# name, samples per second, unit, physical minimum and maximum of the channel EDFs
+CHANNELS = [('EEG L', 256, 'uV', -1976.0, 1976.0), ('EEG R', 256, 'uV', -1976.0, 1976.0), ('dX', 256, 'g', -2.0, 2.0), ('dY', 256, 'g', -2.0, 2.0), ('dZ', 256, 'g', -2.0, 2.0),
+			('BATT', 256, 'V', 0.0, 6.0), ('BODY TEMP', 256, 'C', 0.0, 50.0), ('LIGHT', 256, '', 0.0, 100.0), ('NASAL L', 256, '', 0.0, 100.0), ('NASAL R', 256, '', 0.0, 100.0),
+			('OXY_IR_AC', 256, '', -10000.0, 10000.0), ('OXY_R_AC', 256, '', -10000.0, 10000.0), ('OXY_DARK_AC', 256, '', -10000.0, 10000.0),
+			('OXY_IR_DC', 256, '', 0.0, 100000.0), ('OXY_R_DC', 256, '', 0.0, 100000.0), ('OXY_DARK_DC', 256, '', 0.0, 100000.0), ('NOISE', 256, '', 0.0, 1000.0), ('RSSI', 256, '', -100.0, 0.0)]
+
+# samples per second of the slow channels in the archive layout folders_low_rates (see the rates matrix)
+LOW_RATES = {'dX': 64, 'dY': 64, 'dZ': 64, 'BATT': 32, 'BODY TEMP': 32, 'LIGHT': 32, 'NOISE': 32, 'RSSI': 32}
+
+# name, layout of the archive (folders or zips), options of the converter
+MATRICES = {
+	'inputs': [
+		('folders', 'folders', ['--compact']),
+		('folders_write_zip', 'folders', ['--compact', '--write_zip']),
+		('zips', 'zips', ['--read_zip', '--compact']),
+		('zips_write_zip', 'zips', ['--read_zip', '--compact', '--write_zip']),
+	],
+	'hashing': [
+		('hashing_full', 'folders', ['--compact']),
+		('hashing_sampled', 'folders', ['--compact', '--file_hash_mode', 'sampled']),
+		('hashing_off', 'folders', ['--compact', '--no_file_hashing', '--no_signal_hashing']),
+		('zips_hashing_zip_crc', 'zips', ['--read_zip', '--compact', '--file_hash_mode', 'zip_crc']),
+	],
+	'channels': [
+		('channels_all', 'folders', ['--compact']),
+		('channels_lite', 'folders', ['--compact', '--zmax_lite']),
+		('channels_eeg_batt', 'folders', ['--compact', '--read_only_EEG_BATT']),
+		('channels_eeg', 'folders', ['--compact', '--read_only_EEG']),
+	],
+	'engines': [
+		('engine_mne', 'folders', []),
+		('engine_compact', 'folders', ['--compact']),
+		('engine_out_of_core', 'folders', ['--out_of_core']),
+		('engine_edfjoin_native', 'folders', ['--zmax_edfjoin', '--zmax_edfjoin_native']),
+	],
+	'rates': [
+		('low_rates_compact', 'folders_low_rates', ['--compact']),
+		('low_rates_native_rates', 'folders_low_rates', ['--native_rates']),
+		('low_rates_out_of_core', 'folders_low_rates', ['--out_of_core']),
+	],
+}
+
+METRICS = [('recordings_per_hour', -1), ('peak_rss_MB', 1), ('read_MB_per_recording', 1), ('written_MB_per_recording', 1)] # and the direction of a regression
+
+# runs the __main__ of the converter and writes /proc/self/io of the process at exit
+CHILD_CODE = """
+import atexit, runpy, sys
+def write_io(io_filepath=sys.argv[1]):
+	try:
+		with open('/proc/self/io') as f:
+			io = f.read()
+	except OSError:
+		io = ''
+	with open(io_filepath, 'w') as f:
+		f.write(io)
+atexit.register(write_io)
+sys.argv = sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def get_repository_path():
+	return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_recording(dirpath, seconds, start_datetime, seed=0, low_rates=False):
+	import numpy
+	import pyedflib
+	os.makedirs(dirpath, exist_ok=True)
+	rng = numpy.random.default_rng(seed)
+	for name, sfreq, unit, physical_min, physical_max in CHANNELS:
+		if low_rates:
+			sfreq = LOW_RATES.get(name, sfreq)
+		n_samples = seconds*sfreq
+		if name == 'BATT':
+			data = numpy.linspace(4.1, 3.7, n_samples)
+		elif name == 'NOISE':
+			data = numpy.zeros(n_samples)
+		else:
+			data = rng.uniform(0.5*physical_min, 0.5*physical_max, n_samples)
+		edfWriter = pyedflib.EdfWriter(os.path.join(dirpath, name + '.edf'), 1, file_type=pyedflib.FILETYPE_EDFPLUS)
+		edfWriter.setSignalHeader(0, {'label': name, 'dimension': unit, 'sample_frequency': sfreq, 'physical_max': physical_max, 'physical_min': physical_min,
+									'digital_max': 32767, 'digital_min': -32768, 'prefilter': '', 'transducer': ''})
+		edfWriter.setStartdatetime(start_datetime)
+		edfWriter.writeSamples([data])
+		edfWriter.close()
+
+def make_archive(archive_dir, n_recordings, seconds, layouts=('folders', 'zips')):
+	# every recording as a folder (subject/night) and as a zip file of the same channel EDFs
+	# (and as a folder with the slow channels at lower rates)
+	for iRecording in range(n_recordings):
+		subject = 'subject%03d' % (iRecording // 5)
+		night = 'night%d' % (iRecording % 5 + 1)
+		start_datetime = datetime.datetime(2022, 5, 1, 22, 0, 0) + datetime.timedelta(days=iRecording)
+		if 'folders_low_rates' in layouts:
+			make_recording(os.path.join(archive_dir, 'folders_low_rates', subject, night), seconds, start_datetime, seed=iRecording, low_rates=True)
+		folder = os.path.join(archive_dir, 'folders', subject, night)
+		make_recording(folder, seconds, start_datetime, seed=iRecording)
+		zippath = os.path.join(archive_dir, 'zips', subject, night + '.zip')
+		os.makedirs(os.path.dirname(zippath), exist_ok=True)
+		with zipfile.ZipFile(zippath, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+			for filename in sorted(os.listdir(folder)):
+				zf.write(os.path.join(folder, filename), filename)
+
+def get_io_bytes(io_filepath):
+	io = {}
+	if os.path.isfile(io_filepath):
+		with open(io_filepath) as f:
+			for line in f:
+				key, _, value = line.partition(':')
+				if value.strip():
+					io[key.strip()] = int(value)
+	return io.get('rchar'), io.get('wchar')
+
+def run_case(repository_path, input_dir, output_dir, options, n_processes, temp_dir):
+	converter = os.path.join(repository_path, 'zmax_edf_merge_converter.py')
+	command = [input_dir, '--write_redirection_path', output_dir, '--no_summary_csv'] + options
+	if n_processes > 1:
+		command += ['--work_queue', os.path.join(temp_dir, 'work_queue')]
+	processes = []
+	t_start = time.perf_counter()
+	for iProcess in range(n_processes):
+		io_filepath = os.path.join(temp_dir, 'io_%d.txt' % iProcess)
+		log = open(os.path.join(temp_dir, 'log_%d.txt' % iProcess), 'w')
+		node_id = ['--work_queue_node_id', 'node%d' % iProcess] if n_processes > 1 else []
+		processes.append((subprocess.Popen([sys.executable, '-c', CHILD_CODE, io_filepath, converter] + command + node_id, stdout=log, stderr=subprocess.STDOUT, cwd=temp_dir), io_filepath, log))
+	peak_rss_MB = None
+	for process, io_filepath, log in processes:
+		if hasattr(os, 'wait4'):
+			pid, status, rusage = os.wait4(process.pid, 0)
+			process.returncode = os.waitstatus_to_exitcode(status)
+			# ru_maxrss is in bytes on macOS and in KiB elsewhere
+			rss_MB = rusage.ru_maxrss / (1024.0*1024.0 if sys.platform == 'darwin' else 1024.0)
+			peak_rss_MB = rss_MB if peak_rss_MB is None else max(peak_rss_MB, rss_MB)
+		else:
+			process.wait()
+		log.close()
+	duration = time.perf_counter() - t_start
+	read_bytes = 0
+	written_bytes = 0
+	n_written = 0
+	n_failed = 0
+	for iProcess, (process, io_filepath, log) in enumerate(processes):
+		rchar, wchar = get_io_bytes(io_filepath)
+		read_bytes = None if (rchar is None or read_bytes is None) else read_bytes + rchar
+		written_bytes = None if (wchar is None or written_bytes is None) else written_bytes + wchar
+		with open(os.path.join(temp_dir, 'log_%d.txt' % iProcess), errors='replace') as f:
+			n_failed += sum(1 for line in f if line.startswith('FAILED'))
+	for root, _, files in os.walk(output_dir):
+		n_written += sum(1 for filename in files if os.path.splitext(filename)[0].endswith('_merged'))
+	return duration, peak_rss_MB, read_bytes, written_bytes, n_written, n_failed
+
+def compare_to_baseline(results, baseline, max_regression):
+	regressions = []
+	for key, result in results.items():
+		if key not in baseline:
+			continue
+		if result['failed'] > baseline[key].get('failed', 0):
+			regressions.append("%s: %d FAILED messages (baseline %d)" % (key, result['failed'], baseline[key].get('failed', 0)))
+		for metric, direction in METRICS:
+			value = result.get(metric)
+			value_baseline = baseline[key].get(metric)
+			if value is None or value_baseline is None or value_baseline == 0:
+				continue
+			change = direction*(value - value_baseline)/value_baseline
+			if change > max_regression:
+				regressions.append("%s: %s %.4g (baseline %.4g)" % (key, metric, value, value_baseline))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Load test of the zmax_edf_merge_converter command line on a synthetic archive.')
+	parser.add_argument('--recordings', type=int, nargs='+', default=[10],
+					help='number(s) of recordings of the synthetic archive. Default is 10')
+	parser.add_argument('--minutes', type=float, default=10.0,
+					help='minutes of every synthetic recording. Default is 10.0')
+	parser.add_argument('--processes', type=int, nargs='+', default=[1],
+					help='number(s) of converter processes that share a --work_queue. Default is 1')
+	parser.add_argument('--matrix', type=str, nargs='+', default=['inputs', 'hashing', 'channels'], choices=sorted(MATRICES),
+					help='the option matrices to run, rates builds an archive with lower rates of the slow channels. Default is inputs hashing channels')
+	parser.add_argument('--archive_dir', type=str,
+					help='folder to build the synthetic archive and write the outputs in (on the storage to test). Default is a temporary folder')
+	parser.add_argument('--report_json', type=str,
+					help='optional path of a json file to write the results to')
+	parser.add_argument('--save_baseline', type=str,
+					help='optional path of a json file to store the results as the baseline')
+	parser.add_argument('--baseline', type=str,
+					help='optional path of a stored baseline json file to compare the results to')
+	parser.add_argument('--max_regression', type=float, default=0.25,
+					help='fail if a case is more than this part worse than the baseline (fewer recordings per hour, more peak RSS or more bytes read or written per recording). Default is 0.25')
+	args = parser.parse_args()
+
+	repository_path = get_repository_path()
+	seconds = int(args.minutes*60)
+	cases = []
+	for matrix in args.matrix:
+		for case in MATRICES[matrix]:
+			if case not in cases:
+				cases.append(case)
+
+	layouts = ['folders', 'zips'] + sorted(set(layout for name, layout, options in cases) - set(['folders', 'zips']))
+
+	results = {}
+	if args.archive_dir is not None:
+		os.makedirs(args.archive_dir, exist_ok=True)
+	with tempfile.TemporaryDirectory(dir=args.archive_dir) as temp_dir:
+		pool_dir = os.path.join(temp_dir, 'pool')
+		t_start = time.perf_counter()
+		make_archive(pool_dir, max(args.recordings), seconds, layouts=layouts)
+		print("synthetic archive of %d recordings of %g minutes built in %.1f s" % (max(args.recordings), args.minutes, time.perf_counter() - t_start))
+
+		print("%-28s %6s %4s %12s %10s %12s %12s %8s %7s" % ('case', 'N', 'P', 'recs/hour', 'RSS [MB]', 'read MB/rec', 'write MB/rec', 'written', 'failed'))
+		for n_recordings in args.recordings:
+			archive_dir = os.path.join(temp_dir, 'archive_%d' % n_recordings)
+			for layout in layouts:
+				# the first n_recordings of the pool (in the order they were made)
+				for iRecording in range(n_recordings):
+					subject = 'subject%03d' % (iRecording // 5)
+					night = 'night%d' % (iRecording % 5 + 1)
+					if layout != 'zips':
+						shutil.copytree(os.path.join(pool_dir, layout, subject, night), os.path.join(archive_dir, layout, subject, night))
+					else:
+						os.makedirs(os.path.join(archive_dir, layout, subject), exist_ok=True)
+						shutil.copy(os.path.join(pool_dir, layout, subject, night + '.zip'), os.path.join(archive_dir, layout, subject))
+			for n_processes in args.processes:
+				for name, layout, options in cases:
+					run_dir = os.path.join(temp_dir, 'run')
+					output_dir = os.path.join(run_dir, 'output')
+					os.makedirs(output_dir)
+					duration, peak_rss_MB, read_bytes, written_bytes, n_written, n_failed = run_case(repository_path, os.path.join(archive_dir, layout), output_dir, options, n_processes, run_dir)
+					key = "%s_n%d_p%d" % (name, n_recordings, n_processes)
+					results[key] = {
+						'options': options, 'recordings': n_recordings, 'processes': n_processes, 'seconds': duration,
+						'recordings_per_hour': n_recordings / duration * 3600,
+						'peak_rss_MB': peak_rss_MB,
+						'read_MB_per_recording': None if read_bytes is None else read_bytes / 1e6 / n_recordings,
+						'written_MB_per_recording': None if written_bytes is None else written_bytes / 1e6 / n_recordings,
+						'written': n_written, 'failed': n_failed}
+					print("%-28s %6d %4d %12.1f %10s %12s %12s %8d %7d" % (name, n_recordings, n_processes, results[key]['recordings_per_hour'],
+						'n/a' if peak_rss_MB is None else '%.1f' % peak_rss_MB,
+						'n/a' if read_bytes is None else '%.2f' % results[key]['read_MB_per_recording'],
+						'n/a' if written_bytes is None else '%.2f' % results[key]['written_MB_per_recording'],
+						n_written, n_failed))
+					shutil.rmtree(run_dir)
+			shutil.rmtree(archive_dir)
+
+	report = {'minutes': args.minutes, 'python': sys.version.split()[0], 'platform': sys.platform, 'cores': os.cpu_count(), 'results': results}
+	for filepath in [args.report_json, args.save_baseline]:
+		if filepath is not None:
+			with open(filepath, 'w') as f:
+				json.dump(report, f, indent=1, sort_keys=True)
+
+	failed = False
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if baseline.get('minutes') != args.minutes:
+			print("the baseline was measured with recordings of %s minutes, not %g" % (baseline.get('minutes'), args.minutes))
+		regressions = compare_to_baseline(results, baseline['results'], args.max_regression)
+		for regression in regressions:
+			print("REGRESSION " + regression)
+		failed = len(regressions) > 0
+
+	if failed:
+		print('FAILED: %d values regressed by more than %g against the baseline' % (len(regressions), args.max_regression))
+		sys.exit(1)
+	print('finished')
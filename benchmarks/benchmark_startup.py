@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2022, Frederik D. Weber
+
+Startup time benchmark of the zmax_edf_merge_converter for short invocations
+(--help, an empty --zmax_edfjoin run and an import of the module) that should
+not load the heavy dependencies (mne, numpy, pyedflib, pandas).
+
+python benchmarks/benchmark_startup.py
+python benchmarks/benchmark_startup.py --repeats 20 --max_seconds 1.0
+python benchmarks/benchmark_startup.py --executable "C:\\path\\to\\dist\\zmax_edf_merge_converter.exe"
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ['mne', 'numpy', 'pyedflib', 'pandas', 'scipy']
+
+def get_repository_path():
+	return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_command(command, repeats, cwd=None):
+	durations = []
+	for iRepeat in range(repeats):
+		t_start = time.perf_counter()
+		subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+		durations.append(time.perf_counter() - t_start)
+	return durations
+
+def get_loaded_heavy_modules(repository_path):
+	code = "import sys; sys.path.insert(0, %r); import zmax_edf_merge_converter; print(','.join(m for m in %r if m in sys.modules))" % (repository_path, HEAVY_MODULES)
+	out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+	return [m for m in out.split(',') if m]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Startup time benchmark of short zmax_edf_merge_converter invocations.')
+	parser.add_argument('--repeats', type=int, default=10,
+					help='number of repeated runs per invocation. Default is 10')
+	parser.add_argument('--max_seconds', type=float, default=1.0,
+					help='fail if the median startup time of an invocation is above this. Default is 1.0')
+	parser.add_argument('--executable', type=str,
+					help='optional path to a compiled zmax_edf_merge_converter.exe to benchmark instead of the python script')
+	args = parser.parse_args()
+
+	repository_path = get_repository_path()
+	if args.executable is not None:
+		converter_command = [args.executable]
+	else:
+		converter_command = [sys.executable, os.path.join(repository_path, 'zmax_edf_merge_converter.py')]
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		empty_dir = os.path.join(temp_dir, 'empty')
+		os.makedirs(empty_dir)
+		invocations = [
+			('help', converter_command + ['--help']),
+			('zmax_edfjoin_no_files', converter_command + [empty_dir, '--zmax_edfjoin', '--no_summary_csv']),
+		]
+		if args.executable is None:
+			invocations.append(('import', [sys.executable, '-c', "import sys; sys.path.insert(0, %r); import zmax_edf_merge_converter" % repository_path]))
+			invocations.append(('python_baseline', [sys.executable, '-c', 'pass']))
+
+		failed = False
+		print("%-24s %10s %10s %10s" % ('invocation', 'min [s]', 'median [s]', 'max [s]'))
+		for name, command in invocations:
+			durations = time_command(command, args.repeats, cwd=temp_dir)
+			median = statistics.median(durations)
+			print("%-24s %10.3f %10.3f %10.3f" % (name, min(durations), median, max(durations)))
+			if median > args.max_seconds and name != 'python_baseline':
+				failed = True
+
+	if args.executable is None:
+		heavy_modules_loaded = get_loaded_heavy_modules(repository_path)
+		print("heavy modules loaded on import: %s" % (heavy_modules_loaded if heavy_modules_loaded else 'none'))
+		if heavy_modules_loaded:
+			failed = True
+
+	if failed:
+		print('FAILED: startup is slower than %g s or heavy modules are imported eagerly' % args.max_seconds)
+		sys.exit(1)
+	print('finished')
@@ -32,13 +32,10 @@ pipreqs /path/to/this/project
 
 """
 
-import mne
-import numpy
 import warnings
 import os
 import glob
 import datetime
-import pyedflib
 import shutil
 import argparse
 import pathlib
@@ -54,10 +51,24 @@ import tempfile
 import traceback
 import subprocess
 import logging
-import statistics
 import hashlib
 import csv
-import pandas
+import sqlite3
+import math
+import inspect
+import json
+import socket
+import socketserver
+import threading
+import concurrent.futures
+import fractions
+import contextlib
+import collections
+import itertools
+import ipaddress
+
+# the heavy dependencies (mne, numpy, pyedflib, pandas) are imported lazily
+# within the functions that need them to keep the startup of short runs fast
 
 # classes #
 
@@ -78,27 +89,70 @@ class StreamToLogger(object):
 # hashlib.md5 is slower than hashlib.blake2b
 # =============================================================================
 def get_file_hash(filepath, chunk_size_bytes=None, start_chunk=None, stop_chunk=None, hash_function=hashlib.md5):
+	# chunks are counted from 1 and start_chunk and stop_chunk are both included
+	if chunk_size_bytes is None:
+		chunk_size_bytes = 65536 # same hash as reading the whole file at once, but without holding it in memory
+	file_hash = hash_function()
 	with open(filepath, "rb") as f:
-		if chunk_size_bytes is None:
-			return hash_function(f.read()).hexdigest()
-		else:
-			file_hash = hash_function()
+		iChunk = 1
+		if start_chunk is not None and start_chunk > 1:
+			f.seek((start_chunk-1)*chunk_size_bytes)
+			iChunk = start_chunk
+		while stop_chunk is None or iChunk <= stop_chunk:
 			chunk = f.read(chunk_size_bytes)
-			iChunk = 1
-			while chunk:
-				if start_chunk is None:
-					if stop_chunk is None:
-						file_hash.update(chunk)
-					else:
-						if stop_chunk <= iChunk:
-							file_hash.update(chunk)
-				else:
-					if start_chunk >= iChunk:
-						if stop_chunk <= iChunk:
-							file_hash.update(chunk)
-				chunk = f.read(chunk_size_bytes)
-				iChunk += 1
-			return file_hash.hexdigest()
+			if not chunk:
+				break
+			file_hash.update(chunk)
+			iChunk += 1
+	return file_hash.hexdigest()
+
+# =============================================================================
+# reads size bytes at offset without moving the file position if the platform
+# has positional reads (os.pread), otherwise by seek and read
+# =============================================================================
+def read_file_at(f, offset, size):
+	if hasattr(os, 'pread'):
+		return os.pread(f.fileno(), size, offset)
+	f.seek(offset)
+	return f.read(size)
+
+# =============================================================================
+# sampled file fingerprint of the first n_first chunks, the last n_last chunks
+# and n_spaced evenly spaced chunks in between, mixed with the file size.
+# Takes the same (small) amount of reads regardless of the file size, files
+# smaller than all the sampled chunks together are hashed completely
+# =============================================================================
+def get_file_hash_sampled(filepath, chunk_size_bytes=65536, n_first=4, n_last=4, n_spaced=8, hash_function=hashlib.md5):
+	file_size = os.path.getsize(filepath)
+	file_hash = hash_function()
+	file_hash.update(("%d|%d|%d|%d|%d|" % (file_size, chunk_size_bytes, n_first, n_last, n_spaced)).encode('utf-8'))
+	n_chunks = (file_size + chunk_size_bytes - 1) // chunk_size_bytes
+	if n_chunks <= n_first + n_last + n_spaced:
+		chunk_indices = range(n_chunks)
+	else:
+		chunk_indices = set(range(n_first)) | set(range(n_chunks - n_last, n_chunks))
+		n_between = n_chunks - n_last - n_first
+		chunk_indices |= set(n_first + (k*n_between)//(n_spaced+1) for k in range(1, n_spaced+1))
+		chunk_indices = sorted(chunk_indices)
+	with open(filepath, "rb") as f:
+		for iChunk in chunk_indices:
+			file_hash.update(read_file_at(f, iChunk*chunk_size_bytes, chunk_size_bytes))
+	return file_hash.hexdigest()
+
+# =============================================================================
+# fingerprint of the EDF members of a zip file from its central directory only
+# (file names, uncompressed sizes and CRC32 of the members), nothing is read
+# from the members or decompressed. Zip files of the same EDF files have the
+# same fingerprint regardless of the compression and the time stamps
+# =============================================================================
+def get_zip_crc_fingerprint(filepath, hash_function=hashlib.md5):
+	entries = []
+	with zipfile.ZipFile(filepath, 'r') as zipObj:
+		for member in zipObj.infolist():
+			p, n, e = fileparts(member.filename)
+			if e.lower() == ".edf":
+				entries.append("%s%s|%d|%08x" % (n, e, member.file_size, member.CRC))
+	return hash_function('\n'.join(sorted(entries)).encode('utf-8')).hexdigest()
 
 # =============================================================================
 # hashlib.md5 is slower than hashlib.blake2b
@@ -148,11 +202,29 @@ def zip_directory(folderpath, zippath, deletefolder=False, compresslevel=6):
 # =============================================================================
 #
 # =============================================================================
-def safe_zip_dir_extract(filepath):
-	temp_dir = tempfile.TemporaryDirectory()
+def safe_zip_dir_extract(filepath, crop_start=None, crop_end=None, scratch_dir=None, verify_crc=False):
+	# members extracted completely are always checked against their CRC32 in
+	# the central directory, with verify_crc also the cropped EDFs are read to
+	# their end (decompressed only, not written) for the check
+	temp_dir = tempfile.TemporaryDirectory(dir=scratch_dir)
 	#temp_dir = tempfile.mkdtemp()
 	with zipfile.ZipFile(filepath, 'r') as zipObj:
-		zipObj.extractall(path=temp_dir.name)
+		if crop_start is None and crop_end is None:
+			zipObj.extractall(path=temp_dir.name)
+		else:
+			# only extract the data records within the crop window of the EDFs
+			for member in zipObj.infolist():
+				if member.is_dir() or fileparts(member.filename)[2].lower() != ".edf":
+					zipObj.extract(member, path=temp_dir.name)
+					continue
+				filepath_out = os.path.join(temp_dir.name, *member.filename.split('/'))
+				path_create(filepath_out, isFile=True)
+				with zipObj.open(member, 'r') as f:
+					copy_edf_records(f, filepath_out, crop_start=crop_start, crop_end=crop_end)
+					if verify_crc:
+						# raises zipfile.BadZipFile on a CRC mismatch at the end of the member
+						while f.read(1048576):
+							pass
 	#temp_dir.cleanup()
 	return temp_dir
 
@@ -162,32 +234,892 @@ def safe_zip_dir_extract(filepath):
 def safe_zip_dir_cleanup(temp_dir):
 	temp_dir.cleanup()
 
+# =============================================================================
+# atomically replaces (or with overwrite=False renames to) the final path with
+# a file staged on the same filesystem, fsync 'file' flushes the staged file
+# before and 'all' also the directory entry after the replace
+# =============================================================================
+def replace_file(filepath, filepath_final, fsync='none', overwrite=True):
+	if fsync in ('file', 'all'):
+		fd = os.open(filepath, os.O_RDWR)
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+	if overwrite:
+		os.replace(filepath, filepath_final)
+	else:
+		os.rename(filepath, filepath_final)
+	if fsync == 'all':
+		try:
+			fd = os.open(os.path.dirname(os.path.abspath(filepath_final)), os.O_RDONLY)
+		except OSError:
+			# directories cannot be opened (and need no flush) on Windows
+			return filepath_final
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+	return filepath_final
+
 
 # =============================================================================
-#
+# aligns the samples (last dimension) of an array to n_samples, the data is
+# placed at offset_samples (from the difference of the start times) into one
+# preallocated array of the same dtype, too short data is padded with a
+# constant and samples outside are dropped. If nothing is missing only a view
+# is taken
 # =============================================================================
-def raw_prolong_constant(raw, to_n_samples, contant=0, prepend=False):
-	append_samples = to_n_samples - raw.n_times
+def align_to_reference(data, n_samples, offset_samples=0, constant=0):
+	import numpy
+	src_start = max(0, -offset_samples)
+	dst_start = max(0, offset_samples)
+	n_copy = max(0, min(data.shape[-1] - src_start, n_samples - dst_start))
+	if dst_start == 0 and n_copy == n_samples:
+		return data[..., src_start:(src_start+n_samples)]
+	aligned = numpy.full(data.shape[:-1] + (n_samples,), constant, dtype=data.dtype)
+	aligned[..., dst_start:(dst_start+n_copy)] = data[..., src_start:(src_start+n_copy)]
+	return aligned
 
-	#raw_append = mne.io.RawEDF(numpy.full([raw._data.shape[0], append_samples], contant), info=raw.info)
-	raw_append = raw.copy()
-	raw_append.crop(tmin=raw_append.times[0], tmax=raw_append.times[append_samples-1], include_tmax=True, verbose=False)
-	raw_append._data = numpy.full([raw_append._data.shape[0], append_samples], contant)
-	if prepend:
-		raw_append.append([raw])
-		return raw_append
-	else:
-		raw.append([raw_append])
-		return raw
-		#mne.concatenate_raws([raw, raw_append])
+# =============================================================================
+# aligns the samples of a raw to the n_samples (and first sample) of a
+# reference raw at the same sampling rate (see align_to_reference)
+# =============================================================================
+def raw_align_to_reference(raw, n_samples, offset_samples=0, first_samp=0, constant=0):
+	import numpy
+	raw._data = align_to_reference(raw._data, n_samples, offset_samples=offset_samples, constant=constant)
+	raw._first_samps = numpy.array([first_samp])
+	raw._last_samps = numpy.array([first_samp + n_samples - 1])
+	return raw
 
 def get_check_channel_filenames():
 	return ['BATT', 'BODY TEMP', 'dX', 'dY', 'dZ', 'EEG L', 'EEG R', 'EEG R Cleaned', 'EEG L Cleaned', 'EEG R Cleaned_LFP', 'EEG L Cleaned_LFP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_IR_AC', 'OXY_IR_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_OXY_IR_AC', 'PARSED_NASAL L', 'PARSED_HR_r', 'PARSED_HR_r_strength', 'PARSED_OXY_R_AC', 'PARSED_HR_ir', 'PARSED_HR_ir_strength']
 
+# =============================================================================
+# cheap fingerprint of a recording before loading it, built from the header
+# (start time, number and duration of records) of EEG L.edf, the set of
+# channels and a few evenly spaced (sampled) data records of EEG L.edf. For a
+# zip file the uncompressed size and CRC32 of the EEG L.edf member (from the
+# central directory) are taken instead of the sampled records, as seeking in
+# a compressed member decompresses everything before, so only the central
+# directory and the header of EEG L.edf are read (the fingerprints of a zipped
+# and an unzipped copy of a recording differ)
+# =============================================================================
+def get_zmax_fingerprint(filepath, read_zip=False, n_sampled_records=5, hash_function=hashlib.md5):
+	check_channel_filenames = get_check_channel_filenames()
+	if read_zip:
+		with zipfile.ZipFile(filepath, 'r') as zipObj:
+			member_names = {}
+			for member_name in zipObj.namelist():
+				p, n, e = fileparts(member_name)
+				if e.lower() == ".edf" and n not in member_names:
+					member_names[n] = member_name
+			channel_names = [name for name in check_channel_filenames if name in member_names]
+			member = zipObj.getinfo(member_names['EEG L'])
+			with zipObj.open(member, 'r') as f:
+				return get_edf_fingerprint(f, channel_names, n_sampled_records=n_sampled_records, hash_function=hash_function, member=member)
+	else:
+		path = fileparts(filepath)[0]
+		channel_names = [name for name in check_channel_filenames if os.path.isfile(path + os.sep + name + '.edf')]
+		with open(path + os.sep + 'EEG L.edf', "rb") as f:
+			return get_edf_fingerprint(f, channel_names, n_sampled_records=n_sampled_records, hash_function=hash_function)
+
+def get_edf_fingerprint(fileobj, channel_names, n_sampled_records=5, hash_function=hashlib.md5, member=None):
+	header = read_edf_header(fileobj)
+	n_records = header['n_records']
+	fingerprint = hash_function()
+	fingerprint.update(("%s|%d|%g|%s" % (header['start_datetime'].isoformat(), n_records, header['record_length'], ','.join(channel_names))).encode('utf-8'))
+	if member is not None:
+		# covers all data records of the zip member without decompressing them
+		fingerprint.update(("|%d|%08x" % (member.file_size, member.CRC)).encode('utf-8'))
+	elif n_records > 0:
+		if n_sampled_records > 1:
+			sampled_records = sorted(set(int(round(k*(n_records-1)/(n_sampled_records-1))) for k in range(n_sampled_records)))
+		else:
+			sampled_records = [0]
+		for rec in sampled_records:
+			fileobj.seek(header['header_bytes'] + rec*header['record_bytes'])
+			fingerprint.update(fileobj.read(header['record_bytes']))
+	return fingerprint.hexdigest()
+
+# =============================================================================
+# inventory of a recording from the EDF headers of its channels only (for a
+# zip file its central directory and the member headers, no data is
+# decompressed) and the last data record of BATT.edf: the channels, the
+# start and stop time and number of samples (at sfreq) of the first channel
+# in the crop window, as the merged recording would have, and the mean BATT
+# voltage of the last data record
+# =============================================================================
+def get_zmax_inventory(filepath, read_zip=False, sfreq=256.0, crop_start=None, crop_end=None):
+	import numpy
+	check_channel_filenames = get_check_channel_filenames()
+	zipObj = zipfile.ZipFile(filepath, 'r') if read_zip else None
+	try:
+		members = {}
+		if read_zip:
+			for member in zipObj.infolist():
+				p, n, e = fileparts(member.filename)
+				if e.lower() == ".edf" and n in check_channel_filenames and n not in members:
+					members[n] = member
+			channel_names = [name for name in check_channel_filenames if name in members]
+		else:
+			path = fileparts(filepath)[0]
+			channel_names = get_zmax_channel_avail_list(path)
+
+		def open_channel(name):
+			return zipObj.open(members[name], 'r') if read_zip else open(path + os.sep + name + '.edf', 'rb')
+
+		def get_record_range(name):
+			# the data records in the crop window that are in the file
+			with open_channel(name) as f:
+				header = read_edf_header(f)
+			file_size = members[name].file_size if read_zip else os.path.getsize(path + os.sep + name + '.edf')
+			rec_start, rec_stop = get_edf_record_range(header, crop_start, crop_end)
+			return header, rec_start, max(rec_start, min(rec_stop, (file_size - header['header_bytes']) // header['record_bytes']))
+
+		inventory = {'channels': channel_names, 'start_datetime': None, 'n_samples': 0, 'battery_at_end': None}
+		if not channel_names:
+			return inventory
+		header, rec_start, rec_stop = get_record_range(channel_names[0])
+		inventory['start_datetime'] = (header['start_datetime'] + datetime.timedelta(seconds=rec_start*header['record_length'])).replace(tzinfo=datetime.timezone.utc) # as the meas_date in mne
+		inventory['n_samples'] = int(round((rec_stop - rec_start)*header['n_samps'][0] * sfreq / header['sfreq'][0]))
+		if 'BATT' in channel_names:
+			header, rec_start, rec_stop = get_record_range('BATT')
+			if rec_stop > rec_start:
+				with open_channel('BATT') as f:
+					f.seek(header['header_bytes'] + (rec_stop - 1)*header['record_bytes']) # zip members are decompressed up to there
+					record = numpy.frombuffer(f.read(header['record_bytes']), dtype='<i2')
+				inventory['battery_at_end'] = float(numpy.mean(get_edf_physical_values(record[:header['n_samps'][0]], header)))
+	finally:
+		if zipObj is not None:
+			zipObj.close()
+	return inventory
+
+# =============================================================================
+# reads only the fixed size EDF(+) header (256 bytes + 256 bytes per signal)
+# from a file path or an already opened binary file object (e.g. a zip member)
+# =============================================================================
+def read_edf_header(filepath_or_fileobj):
+	if hasattr(filepath_or_fileobj, 'read'):
+		f = filepath_or_fileobj
+		header_bytes_main = f.read(256)
+		n_signals = int(header_bytes_main[252:256].decode('ascii', 'replace').strip())
+		header_bytes_signals = f.read(n_signals * 256)
+	else:
+		with open(filepath_or_fileobj, "rb") as f:
+			return read_edf_header(f)
+
+	def field(b, start, length):
+		return b[start:start+length].decode('latin-1').strip()
+
+	def to_float(s, default=0.0):
+		try:
+			return float(s)
+		except ValueError:
+			return default
+
+	header = {}
+	header['version'] = field(header_bytes_main, 0, 8)
+	header['patient'] = field(header_bytes_main, 8, 80)
+	header['recording'] = field(header_bytes_main, 88, 80)
+	header['startdate'] = field(header_bytes_main, 168, 8)
+	header['starttime'] = field(header_bytes_main, 176, 8)
+	header['header_bytes'] = int(field(header_bytes_main, 184, 8))
+	header['reserved'] = field(header_bytes_main, 192, 44)
+	header['n_records'] = int(field(header_bytes_main, 236, 8))
+	header['record_length'] = to_float(field(header_bytes_main, 244, 8), 1.0)
+	header['n_signals'] = n_signals
+
+	day, month, year = [int(v) for v in header['startdate'].split('.')]
+	year = year + 1900 if year >= 85 else year + 2000
+	hour, minute, second = [int(v) for v in header['starttime'].split('.')]
+	header['start_datetime'] = datetime.datetime(year, month, day, hour, minute, second)
+
+	offset = 0
+	for key, length in [('ch_names', 16), ('transducer', 80), ('units', 8), ('physical_min', 8), ('physical_max', 8), ('digital_min', 8), ('digital_max', 8), ('prefilter', 80), ('n_samps', 8), ('reserved_signals', 32)]:
+		values = [field(header_bytes_signals, offset + iSig*length, length) for iSig in range(n_signals)]
+		if key in ['physical_min', 'physical_max', 'digital_min', 'digital_max']:
+			values = [to_float(v) for v in values]
+		elif key == 'n_samps':
+			values = [int(v) for v in values]
+		header[key] = values
+		offset += n_signals*length
+
+	header['record_bytes'] = 2 * sum(header['n_samps'])
+	header['sfreq'] = [n / header['record_length'] for n in header['n_samps']]
+	return header
+
+# =============================================================================
+# parses a crop argument that is either seconds (relative to meas_date) or an
+# absolute date time like "2022-05-01 22:00:00"
+# =============================================================================
+def parse_crop_time(value):
+	if value is None:
+		return None
+	if isinstance(value, (int, float, datetime.datetime)):
+		return value
+	try:
+		return float(value)
+	except ValueError:
+		pass
+	crop_datetime = datetime.datetime.fromisoformat(value.strip())
+	if crop_datetime.tzinfo is not None:
+		crop_datetime = crop_datetime.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+	return crop_datetime
+
+# =============================================================================
+# translate a crop window to the range of EDF data records [start, stop) that
+# cover it, the window is widened to full data records
+# =============================================================================
+def get_edf_record_range(header, crop_start=None, crop_end=None):
+	record_length = header['record_length']
+	n_records = header['n_records']
+
+	def to_seconds(t):
+		if isinstance(t, datetime.datetime):
+			return (t - header['start_datetime']).total_seconds()
+		return float(t)
+
+	rec_start = 0
+	rec_stop = n_records
+	if crop_start is not None:
+		rec_start = max(0, int(math.floor(to_seconds(crop_start) / record_length)))
+	if crop_end is not None:
+		rec_stop = min(n_records, int(math.ceil(to_seconds(crop_end) / record_length)))
+	if rec_start >= rec_stop:
+		raise ValueError("The crop window does not overlap with the recording starting at %s with %d records of %g seconds" % (header['start_datetime'], n_records, record_length))
+	return rec_start, rec_stop
+
+# =============================================================================
+# the TALs (time-stamped annotation lists) of an EDF Annotations signal of a
+# data record with all onsets moved by shift_seconds (e.g. as the start of the
+# file moved), padded with zeros to the same size. If the shifted TALs do not
+# fit, only the time-keeping (first) TAL is kept
+# =============================================================================
+def shift_edf_record_tals(annotation_bytes, shift_seconds):
+	tals = []
+	for tal in bytes(annotation_bytes).rstrip(b'\x00').split(b'\x00'):
+		if not tal:
+			continue
+		end = min([i for i in [tal.find(b'\x14'), tal.find(b'\x15')] if i >= 0], default=len(tal))
+		onset = float(tal[:end].decode('ascii')) - shift_seconds
+		tals.append(('%+.6f' % onset).rstrip('0').rstrip('.').encode('ascii') + tal[end:] + b'\x00')
+	shifted = b''.join(tals)
+	if len(shifted) > len(annotation_bytes):
+		shifted = tals[0]
+	return shifted + bytes(len(annotation_bytes) - len(shifted))
+
+# =============================================================================
+# copy only the header and the data records in the crop window of an EDF from
+# an open binary stream (e.g. a zip member) to a new file, the start date and
+# time and the number of records are adjusted in the header, and for EDF+ the
+# onsets of the TALs in the data records (relative to the start of the file)
+# =============================================================================
+def copy_edf_records(fileobj, filepath_out, crop_start=None, crop_end=None, chunk_records=256):
+	header = read_edf_header(fileobj)
+	rec_start, rec_stop = get_edf_record_range(header, crop_start, crop_end)
+	fileobj.seek(0)
+	header_raw = bytearray(fileobj.read(header['header_bytes']))
+
+	start_datetime = header['start_datetime'] + datetime.timedelta(seconds=rec_start*header['record_length'])
+	header_raw[168:176] = start_datetime.strftime("%d.%m.%y").encode('ascii')
+	header_raw[176:184] = start_datetime.strftime("%H.%M.%S").encode('ascii')
+	header_raw[236:244] = ("%-8d" % (rec_stop - rec_start)).encode('ascii')
+	recording = header_raw[88:168].decode('latin-1')
+	if recording.startswith('Startdate '):
+		recording_fields = recording.split(' ')
+		if len(recording_fields) > 1 and recording_fields[1] != 'X':
+			recording_fields[1] = start_datetime.strftime("%d-%b-%Y").upper()
+			header_raw[88:168] = ("%-80s" % ' '.join(recording_fields))[:80].encode('latin-1')
+
+	record_bytes = header['record_bytes']
+	annotation_slots = []
+	if header['reserved'].startswith('EDF+') and rec_start > 0:
+		signal_offsets = [0]
+		for n_samps in header['n_samps']:
+			signal_offsets.append(signal_offsets[-1] + 2*n_samps)
+		annotation_slots = [(signal_offsets[iSig], signal_offsets[iSig+1]) for iSig, ch_name in enumerate(header['ch_names']) if ch_name == 'EDF Annotations']
+	shift_seconds = rec_start*header['record_length']
+	fileobj.seek(header['header_bytes'] + rec_start*record_bytes)
+	with open(filepath_out, "wb") as f_out:
+		f_out.write(header_raw)
+		rec = rec_start
+		while rec < rec_stop:
+			n = min(chunk_records, rec_stop - rec)
+			block = fileobj.read(n*record_bytes)
+			if annotation_slots:
+				block = bytearray(block)
+				for iRecord in range(len(block) // record_bytes):
+					for slot_start, slot_stop in annotation_slots:
+						start = iRecord*record_bytes + slot_start
+						stop = iRecord*record_bytes + slot_stop
+						block[start:stop] = shift_edf_record_tals(block[start:stop], shift_seconds)
+			f_out.write(block)
+			rec += n
+	return filepath_out
+
+# =============================================================================
+# the time-keeping TAL (EDF+ time-stamped annotation list) of a data record
+# =============================================================================
+def get_edf_record_tal(onset_seconds):
+	onset = ("%.6f" % onset_seconds).rstrip('0').rstrip('.')
+	return ('+' + onset + '\x14\x14\x00').encode('ascii')
+
+# =============================================================================
+# joins the signals of several EDF files with the same data record duration
+# (e.g. the ZMax channel files) into one EDF+ file on the byte level (as
+# EDFJoin.exe but in process): the signal headers are copied and the raw
+# data records of all files are interleaved chunk by chunk without decoding
+# them, an EDF Annotations signal with the time-keeping TALs is added. The
+# files are aligned in time to the data records of the first one (in the
+# crop window), missing records are filled with the digital value of zero
+# =============================================================================
+def join_edf_files(filepaths, joined_filepath, labels=None, crop_start=None, crop_end=None, chunk_records=256):
+	import numpy
+	signal_fields = [('ch_names', 16), ('transducer', 80), ('units', 8), ('physical_min', 8), ('physical_max', 8), ('digital_min', 8), ('digital_max', 8), ('prefilter', 80), ('n_samps', 8), ('reserved_signals', 32)]
+	headers = []
+	headers_raw = []
+	for filepath in filepaths:
+		with open(filepath, "rb") as f:
+			header = read_edf_header(f)
+			f.seek(0)
+			headers_raw.append(f.read(header['header_bytes']))
+		header['n_records_in_file'] = (os.path.getsize(filepath) - header['header_bytes']) // header['record_bytes']
+		headers.append(header)
+	record_length = headers[0]['record_length']
+	for filepath, header in zip(filepaths, headers):
+		if header['record_length'] != record_length:
+			raise ValueError("The data record duration of %s (%g s) differs from the one of %s (%g s)" % (filepath, header['record_length'], filepaths[0], record_length))
+	if labels is None:
+		labels = [fileparts(filepath)[1] for filepath in filepaths]
+
+	rec_start, rec_stop = get_edf_record_range(headers[0], crop_start, crop_end)
+	rec_stop = max(rec_start, min(rec_stop, headers[0]['n_records_in_file']))
+	n_records = rec_stop - rec_start
+	start_datetime = headers[0]['start_datetime'] + datetime.timedelta(seconds=rec_start*record_length)
+
+	# the data signals of every file (without their own EDF Annotations),
+	# single signal files get the file name as label (as the channel names)
+	signals = []
+	for iFile, header in enumerate(headers):
+		data_signals = [iSig for iSig in range(header['n_signals']) if header['ch_names'][iSig] != 'EDF Annotations']
+		for iSig in data_signals:
+			signals.append({'file': iFile, 'signal': iSig, 'label': labels[iFile] if len(data_signals) == 1 else header['ch_names'][iSig],
+							'first_record': int(round((start_datetime - header['start_datetime']).total_seconds() / record_length)), # in the file
+							'byte_start': 2*sum(header['n_samps'][:iSig]), 'n_bytes': 2*header['n_samps'][iSig],
+							'fill': numpy.frombuffer(numpy.full(header['n_samps'][iSig], get_edf_digital_zero(header, iSig), dtype='<i2').tobytes(), dtype=numpy.uint8)})
+	n_signals = len(signals) + 1
+	tal_samps = (max(len(get_edf_record_tal(n_records*record_length)), 32) + 1) // 2
+
+	# header, the signal fields are copied as they are from the files
+	def field(value, length):
+		return (("%-" + str(length) + "s") % value)[:length]
+
+	header_raw = field('0', 8) + field('X X X X', 80) + field('Startdate ' + start_datetime.strftime("%d-%b-%Y").upper() + ' X X X', 80)
+	header_raw += start_datetime.strftime("%d.%m.%y") + start_datetime.strftime("%H.%M.%S") + field(256*(n_signals+1), 8) + field('EDF+C', 44) + field(n_records, 8)
+	header_raw = header_raw.encode('latin-1') + headers_raw[0][244:252] + field(n_signals, 4).encode('latin-1')
+	annotation_fields = {'ch_names': 'EDF Annotations', 'physical_min': '-1', 'physical_max': '1', 'digital_min': '-32768', 'digital_max': '32767', 'n_samps': tal_samps}
+	field_offset = 0
+	for key, length in signal_fields:
+		for signal in signals:
+			if key == 'ch_names':
+				header_raw += field(signal['label'], length).encode('latin-1')
+			else:
+				start = 256 + headers[signal['file']]['n_signals']*field_offset + signal['signal']*length
+				header_raw += headers_raw[signal['file']][start:(start+length)]
+		header_raw += field(annotation_fields.get(key, ''), length).encode('latin-1')
+		field_offset += length
+
+	# the data records, interleaved chunk by chunk
+	record_bytes = sum(signal['n_bytes'] for signal in signals) + 2*tal_samps
+	files = [open(filepath, "rb") for filepath in filepaths]
+	try:
+		with open(joined_filepath, "wb") as f_out:
+			f_out.write(header_raw)
+			records = numpy.zeros([chunk_records, record_bytes], dtype=numpy.uint8)
+			for rec in range(0, n_records, chunk_records):
+				n = min(chunk_records, n_records - rec)
+				byte_start = 0
+				for signal in signals:
+					header = headers[signal['file']]
+					# the records of this chunk that are in the file, the others are filled
+					rec_first = min(max(rec, -signal['first_record']), rec + n)
+					rec_last = max(min(rec + n, header['n_records_in_file'] - signal['first_record']), rec_first)
+					records[:n, byte_start:(byte_start+signal['n_bytes'])] = signal['fill']
+					if rec_last > rec_first:
+						block = read_file_at(files[signal['file']], header['header_bytes'] + (signal['first_record'] + rec_first)*header['record_bytes'], (rec_last - rec_first)*header['record_bytes'])
+						block = numpy.frombuffer(block, dtype=numpy.uint8).reshape(rec_last - rec_first, header['record_bytes'])
+						records[(rec_first-rec):(rec_last-rec), byte_start:(byte_start+signal['n_bytes'])] = block[:, signal['byte_start']:(signal['byte_start']+signal['n_bytes'])]
+					byte_start += signal['n_bytes']
+				tals = b''.join(get_edf_record_tal((rec + iRecord)*record_length).ljust(2*tal_samps, b'\x00') for iRecord in range(n))
+				records[:n, byte_start:] = numpy.frombuffer(tals, dtype=numpy.uint8).reshape(n, 2*tal_samps)
+				f_out.write(records[:n].tobytes())
+	finally:
+		for f in files:
+			f.close()
+	return joined_filepath
+
+# =============================================================================
+# sequential reader of the digital (int16) samples of one signal of an EDF
+# from an open binary stream (e.g. a zip member), only chunk_records data
+# records are held in memory at a time
+# =============================================================================
+class EdfSignalStream(object):
+	def __init__(self, fileobj, header=None, signal_index=0, start_record=0, chunk_records=64):
+		import numpy
+		self.fileobj = fileobj
+		self.header = read_edf_header(fileobj) if header is None else header
+		self.chunk_records = chunk_records
+		self.sample_start = sum(self.header['n_samps'][:signal_index])
+		self.sample_stop = self.sample_start + self.header['n_samps'][signal_index]
+		self.record_samples = sum(self.header['n_samps'])
+		self.buffer = numpy.zeros(0, dtype='<i2')
+		self.fileobj.seek(self.header['header_bytes'] + start_record*self.header['record_bytes'])
+
+	def read(self, n_samples):
+		import numpy
+		buffers = [self.buffer]
+		n_buffered = len(self.buffer)
+		while n_buffered < n_samples:
+			block = self.fileobj.read(self.chunk_records*self.header['record_bytes'])
+			n_records = len(block) // self.header['record_bytes']
+			if n_records == 0:
+				break
+			data = numpy.frombuffer(block, dtype='<i2', count=n_records*self.record_samples).reshape(n_records, self.record_samples)
+			buffers.append(data[:, self.sample_start:self.sample_stop].reshape(-1))
+			n_buffered += len(buffers[-1])
+		samples = numpy.concatenate(buffers) if len(buffers) > 1 else self.buffer
+		self.buffer = samples[n_samples:]
+		return samples[:n_samples]
+
+# =============================================================================
+# digital value of a signal of header_to that corresponds to the same physical
+# value as a digital value of a signal of header_from, as factor and offset
+# =============================================================================
+def get_edf_digital_mapping(header_from, signal_index_from, header_to, signal_index_to):
+	scale_from, offset_from = get_edf_scale_offset(header_from, signal_index_from)
+	scale_to, offset_to = get_edf_scale_offset(header_to, signal_index_to)
+	return scale_from/scale_to, (offset_from - offset_to)/scale_to
+
+# =============================================================================
+# end-to-end check of a converted EDF (or the EDF in a converted zip) against
+# the channel EDFs of the source folder (or zip), record by record on the
+# digital values without loading either side completely. The source values
+# are mapped through the physical ranges of both headers and may differ by
+# max_lsb_difference. Resampled channels cannot be compared sample by sample
+# and are not verified. Returns a result per channel with the first mismatch
+# =============================================================================
+def verify_zmax_conversion(converted_filepath, filepath, read_zip=False, chunk_records=64, max_lsb_difference=1):
+	import numpy
+	results = {}
+	with contextlib.ExitStack() as stack:
+		if fileparts(converted_filepath)[2].lower() == ".zip":
+			zip_converted = stack.enter_context(zipfile.ZipFile(converted_filepath, 'r'))
+			member_name = [n for n in zip_converted.namelist() if fileparts(n)[2].lower() == ".edf"][0]
+			f_converted = stack.enter_context(zip_converted.open(member_name, 'r'))
+		else:
+			f_converted = stack.enter_context(open(converted_filepath, "rb"))
+		header_converted = read_edf_header(f_converted)
+
+		if read_zip:
+			zip_source = stack.enter_context(zipfile.ZipFile(filepath, 'r'))
+			source_member_names = {}
+			for member_name in zip_source.namelist():
+				p, n, e = fileparts(member_name)
+				if e.lower() == ".edf" and n not in source_member_names:
+					source_member_names[n] = member_name
+			def open_source(name):
+				return zip_source.open(source_member_names[name], 'r') if name in source_member_names else None
+		else:
+			path = fileparts(filepath)[0]
+			def open_source(name):
+				source_filepath = path + os.sep + name + '.edf'
+				return open(source_filepath, "rb") if os.path.isfile(source_filepath) else None
+
+		streams = {}
+		for iSig, ch_name in enumerate(header_converted['ch_names']):
+			if ch_name == 'EDF Annotations':
+				continue
+			result = {'status': 'not_verified', 'n_samples': 0, 'first_mismatch': None, 'note': ''}
+			results[ch_name] = result
+			f_source = open_source(ch_name)
+			if f_source is None:
+				result['note'] = 'no source file'
+				continue
+			stack.enter_context(f_source)
+			header_source = read_edf_header(f_source)
+			if header_source['sfreq'][0] != header_converted['sfreq'][iSig]:
+				result['note'] = 'resampled from %g Hz to %g Hz' % (header_source['sfreq'][0], header_converted['sfreq'][iSig])
+				continue
+			offset_seconds = (header_converted['start_datetime'] - header_source['start_datetime']).total_seconds()
+			start_record = int(round(offset_seconds / header_source['record_length']))
+			if start_record < 0:
+				result['note'] = 'converted file starts %g seconds before the source' % -offset_seconds
+				continue
+			factor, offset = get_edf_digital_mapping(header_source, 0, header_converted, iSig)
+			streams[iSig] = (EdfSignalStream(f_source, header=header_source, signal_index=0, start_record=start_record, chunk_records=chunk_records), factor, offset)
+			result['status'] = 'ok'
+
+		record_samples = sum(header_converted['n_samps'])
+		sample_starts = numpy.cumsum([0] + header_converted['n_samps'])
+		f_converted.seek(header_converted['header_bytes'])
+		while streams:
+			block = f_converted.read(chunk_records*header_converted['record_bytes'])
+			n_records = len(block) // header_converted['record_bytes']
+			if n_records == 0:
+				break
+			data = numpy.frombuffer(block, dtype='<i2', count=n_records*record_samples).reshape(n_records, record_samples)
+			for iSig in list(streams.keys()):
+				stream, factor, offset = streams[iSig]
+				result = results[header_converted['ch_names'][iSig]]
+				converted = data[:, sample_starts[iSig]:sample_starts[iSig+1]].reshape(-1)
+				source = stream.read(len(converted))
+				expected = numpy.clip(numpy.round(source*factor + offset), header_converted['digital_min'][iSig], header_converted['digital_max'][iSig])
+				mismatches = numpy.flatnonzero(numpy.abs(converted[:len(source)] - expected) > max_lsb_difference)
+				if len(mismatches) > 0:
+					iSample = mismatches[0]
+					result['first_mismatch'] = {'sample': result['n_samples'] + int(iSample), 'expected': int(expected[iSample]), 'found': int(converted[iSample])}
+				elif len(source) < len(converted):
+					# after the end of the source only padding (the digital value of zero) is expected
+					not_padded = numpy.flatnonzero(converted[len(source):] != get_edf_digital_zero(header_converted, iSig))
+					if len(not_padded) > 0:
+						result['first_mismatch'] = {'sample': result['n_samples'] + len(source) + int(not_padded[0]), 'expected': None, 'found': int(converted[len(source) + not_padded[0]])}
+					else:
+						result['n_padded'] = result.get('n_padded', 0) + len(converted) - len(source)
+						result['note'] = 'padded %d samples at the end' % result['n_padded']
+				result['n_samples'] += len(converted)
+				if result['first_mismatch'] is not None:
+					result['status'] = 'mismatch'
+					result['first_mismatch']['seconds'] = result['first_mismatch']['sample'] / header_converted['sfreq'][iSig]
+					del streams[iSig] # only the first mismatch is reported
+	return results
+
+# =============================================================================
+# the zmax channels (EDF files) that are available in the folder path
+# =============================================================================
+def get_zmax_channel_avail_list(path):
+	channel_avail_list = []
+	for iCh, name in enumerate(get_check_channel_filenames()):
+		checkname = path + os.sep + name + '.edf'
+		if os.path.isfile(checkname):
+			channel_avail_list.append(name)
+	return channel_avail_list
+
+# =============================================================================
+# content-addressed cache of the output files of the external tools
+# (PPGParser.exe, EDFCleaner.exe), keyed by the hash of the tool binary and
+# of the content (and names) of its input files. An entry is a folder of the
+# output files, its mtime is the time it was last used, the least recently
+# used entries are removed once the cache is larger than max_bytes
+# =============================================================================
+class ToolCache(object):
+	def __init__(self, cache_dirpath, max_bytes=10*1024**3, hash_function=hashlib.md5):
+		self.cache_dirpath = cache_dirpath
+		self.max_bytes = max_bytes
+		self.hash_function = hash_function
+		self.exe_hashes = {}
+		os.makedirs(cache_dirpath, exist_ok=True)
+
+	def get_exe_hash(self, exe_path):
+		stat = os.stat(exe_path)
+		key = (os.path.abspath(exe_path), stat.st_size, stat.st_mtime_ns)
+		if key not in self.exe_hashes:
+			self.exe_hashes[key] = get_file_hash(exe_path, hash_function=self.hash_function)
+		return self.exe_hashes[key]
+
+	def get_key(self, exe_path, input_filepaths):
+		key_hash = self.hash_function(self.get_exe_hash(exe_path).encode('utf-8'))
+		for input_filepath in input_filepaths:
+			key_hash.update(("|%s|%s" % (os.path.basename(input_filepath), get_file_hash(input_filepath, chunk_size_bytes=1048576, hash_function=self.hash_function))).encode('utf-8'))
+		return key_hash.hexdigest()
+
+	def get_entry_dirpath(self, key):
+		return os.path.join(self.cache_dirpath, key[:2], key)
+
+	def restore(self, key, dirpath):
+		# copies the output files of a cached entry to dirpath, returns their names or None
+		entry_dirpath = self.get_entry_dirpath(key)
+		try:
+			filenames = os.listdir(entry_dirpath)
+			for filename in filenames:
+				temp_filepath = os.path.join(dirpath, filename + '.tool_cache_TEMP_')
+				shutil.copyfile(os.path.join(entry_dirpath, filename), temp_filepath)
+				os.replace(temp_filepath, os.path.join(dirpath, filename))
+			os.utime(entry_dirpath)
+		except FileNotFoundError:
+			return None # not cached (or evicted meanwhile)
+		return filenames
+
+	def store(self, key, dirpath, filenames):
+		entry_dirpath = self.get_entry_dirpath(key)
+		if not filenames or os.path.isdir(entry_dirpath):
+			return
+		temp_dirpath = entry_dirpath + '_TEMP_' + hashlib.md5(os.urandom(16)).hexdigest()
+		os.makedirs(temp_dirpath)
+		try:
+			for filename in filenames:
+				shutil.copyfile(os.path.join(dirpath, filename), os.path.join(temp_dirpath, filename))
+			os.rename(temp_dirpath, entry_dirpath)
+		except OSError:
+			shutil.rmtree(temp_dirpath, ignore_errors=True) # e.g. stored by another process meanwhile
+			return
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for prefix in os.listdir(self.cache_dirpath):
+			prefix_dirpath = os.path.join(self.cache_dirpath, prefix)
+			if not os.path.isdir(prefix_dirpath):
+				continue
+			for entry in os.listdir(prefix_dirpath):
+				entry_dirpath = os.path.join(prefix_dirpath, entry)
+				if '_TEMP_' in entry or not os.path.isdir(entry_dirpath):
+					continue
+				try:
+					size = sum(os.path.getsize(os.path.join(entry_dirpath, filename)) for filename in os.listdir(entry_dirpath))
+					entries.append((os.path.getmtime(entry_dirpath), size, entry_dirpath))
+				except FileNotFoundError:
+					pass # evicted by another process meanwhile
+		total_bytes = sum(size for mtime, size, entry_dirpath in entries)
+		for mtime, size, entry_dirpath in sorted(entries):
+			if total_bytes <= self.max_bytes:
+				break
+			shutil.rmtree(entry_dirpath, ignore_errors=True)
+			total_bytes -= size
+
+# =============================================================================
+# the size and modification time of the files of a folder
+# =============================================================================
+def get_dir_snapshot(dirpath):
+	snapshot = {}
+	for entry in os.scandir(dirpath):
+		if entry.is_file():
+			stat = entry.stat()
+			snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+	return snapshot
+
+# =============================================================================
+# runs an external tool on input files (next to which it writes its output
+# files), with a tool_cache the output files are served from the cache if
+# the tool already ran on the same inputs (key_filepaths, default all input
+# files) and are cached otherwise. Returns if the output was cached
+# =============================================================================
+def run_zmax_tool(exe_path, input_filepaths, timeout_seconds=None, tool_cache=None, key_filepaths=None):
+	dirpath = os.path.dirname(input_filepaths[0])
+	if tool_cache is not None:
+		key = tool_cache.get_key(exe_path, input_filepaths if key_filepaths is None else key_filepaths)
+		if tool_cache.restore(key, dirpath) is not None:
+			print('TOOL CACHE used for %s on %s' % (os.path.basename(exe_path), dirpath))
+			return True
+		snapshot = get_dir_snapshot(dirpath)
+	exec_string =  "\"" + exe_path + "\""
+	for input_filepath in input_filepaths:
+		exec_string = exec_string + " " + "\"" + input_filepath + "\""
+	completed = subprocess.run(exec_string, shell=False, timeout=timeout_seconds)
+	if completed.returncode != 0:
+		# the (partial) outputs of a failed run are not cached
+		print('FAILED running %s on %s (return code %d)' % (os.path.basename(exe_path), dirpath, completed.returncode))
+	elif tool_cache is not None:
+		tool_cache.store(key, dirpath, [filename for filename, stat in get_dir_snapshot(dirpath).items() if snapshot.get(filename) != stat])
+	return False
+
+# =============================================================================
+# content-addressed store of the converted files (--output_store_dir): a
+# file is stored under the key of its content and the export paths are hard
+# links to it, so a duplicate recording is linked instead of written again
+# (copied if the store is on another filesystem). Every export path is
+# recorded in a .refs file next to the stored file, its references are the
+# recorded paths that still link to it, unreferenced files are removed by
+# cleanup
+# =============================================================================
+class OutputStore(object):
+	def __init__(self, store_dirpath, hash_function=hashlib.md5):
+		self.store_dirpath = store_dirpath
+		self.hash_function = hash_function
+		os.makedirs(store_dirpath, exist_ok=True)
+
+	def get_key(self, *parts):
+		return self.hash_function('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+	def get_object_filepath(self, key, extension):
+		return os.path.join(self.store_dirpath, key[:2], key + extension)
+
+	@staticmethod
+	def link_or_copy(filepath, filepath_link):
+		# returns 'link' or 'copy'
+		try:
+			os.link(filepath, filepath_link)
+			return 'link'
+		except OSError:
+			if not os.path.isfile(filepath):
+				raise
+			shutil.copyfile(filepath, filepath_link)
+			return 'copy'
+
+	def link(self, key, extension, filepath):
+		# links the stored file of key to filepath, returns 'link', 'copy' or None if not stored
+		try:
+			os.remove(filepath)
+		except FileNotFoundError:
+			pass
+		try:
+			return self.link_or_copy(self.get_object_filepath(key, extension), filepath)
+		except FileNotFoundError:
+			return None
+
+	def store(self, key, extension, filepath):
+		object_filepath = self.get_object_filepath(key, extension)
+		if os.path.isfile(object_filepath):
+			return
+		os.makedirs(os.path.dirname(object_filepath), exist_ok=True)
+		temp_filepath = object_filepath + '_TEMP_' + hashlib.md5(os.urandom(16)).hexdigest()
+		self.link_or_copy(filepath, temp_filepath)
+		os.replace(temp_filepath, object_filepath)
+
+	def add_reference(self, key, extension, filepath, mode='link'):
+		with open(self.get_object_filepath(key, extension) + '.refs', 'a', encoding='utf-8') as f:
+			f.write(mode + '\t' + os.path.abspath(filepath) + '\n')
+
+	def get_references(self, object_filepath):
+		# the recorded paths that still link to (or for copies still exist for) the stored file
+		references = []
+		try:
+			with open(object_filepath + '.refs', 'r', encoding='utf-8') as f:
+				lines = f.read().splitlines()
+		except FileNotFoundError:
+			return references
+		for line in lines:
+			mode, filepath = line.split('\t', 1)
+			if (mode, filepath) in references:
+				continue
+			try:
+				if os.path.samefile(filepath, object_filepath) or (mode == 'copy' and os.path.isfile(filepath)):
+					references.append((mode, filepath))
+			except OSError:
+				pass # removed or moved
+		return references
+
+	def get_reference_count(self, key, extension):
+		return len(self.get_references(self.get_object_filepath(key, extension)))
+
+	def cleanup(self):
+		# removes the stored files without references and compacts the .refs files, returns the number of removed files and their bytes
+		n_removed = 0
+		bytes_removed = 0
+		for prefix in os.listdir(self.store_dirpath):
+			prefix_dirpath = os.path.join(self.store_dirpath, prefix)
+			if not os.path.isdir(prefix_dirpath):
+				continue
+			for filename in os.listdir(prefix_dirpath):
+				object_filepath = os.path.join(prefix_dirpath, filename)
+				if '_TEMP_' in filename or filename.endswith('.refs') or not os.path.isfile(object_filepath):
+					continue
+				references = self.get_references(object_filepath)
+				if references:
+					temp_filepath = object_filepath + '.refs_TEMP_'
+					with open(temp_filepath, 'w', encoding='utf-8') as f:
+						f.writelines(mode + '\t' + filepath + '\n' for mode, filepath in references)
+					os.replace(temp_filepath, object_filepath + '.refs')
+					continue
+				bytes_removed += os.path.getsize(object_filepath)
+				os.remove(object_filepath)
+				try:
+					os.remove(object_filepath + '.refs')
+				except FileNotFoundError:
+					pass
+				n_removed += 1
+		return n_removed, bytes_removed
+
+# =============================================================================
+# runs the Hypnodyne PPGParser and EDFCleaner on the channel EDFs of the folder
+# of filepath (they add channels), returns the available channels afterwards
+# =============================================================================
+def zmax_reprocess_channels(filepath, channel_avail_list, zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache=None):
+	path, name, extension = fileparts(filepath)
+	reprocessed = False
+	if zmax_ppgparser and not zmax_ppgparser_native:
+		print('ATTEMPT to reparse heart signals using the PPGParser ' + filepath)
+		addfilepaths = [path + os.sep + name + '.edf' for name in channel_avail_list]
+		# the outputs of earlier runs of the tools in the folder are not part of the cache key
+		key_filepaths = [path + os.sep + name + '.edf' for name in channel_avail_list if not (name.startswith('PARSED_') or ' Cleaned' in name)]
+		try:
+			reprocessed = True
+			run_zmax_tool(zmax_ppgparser_exe_path, addfilepaths, timeout_seconds=zmax_ppgparser_timeout_seconds, tool_cache=tool_cache, key_filepaths=key_filepaths)
+		except:
+			print(traceback.format_exc())
+			print('FAILED to reparse ' + filepath)
+
+
+	if zmax_eegcleaner and not zmax_eegcleaner_native:
+		print('ATTEMPT to clean the EEG signals using the EDFCleaner ' + filepath)
+		addfilepaths = [path + os.sep + name + '.edf' for name in channel_avail_list if name in ['EEG L', 'EEG R']]
+		try:
+			if addfilepaths:
+				reprocessed = True
+				run_zmax_tool(zmax_eegcleaner_exe_path, addfilepaths, timeout_seconds=zmax_eegcleaner_timeout_seconds, tool_cache=tool_cache)
+		except:
+			print(traceback.format_exc())
+			print('FAILED to clean EEG from ' + filepath)
+
+	if reprocessed:
+		channel_avail_list = get_zmax_channel_avail_list(path)
+
+	# the cleaned and parsed channels are computed from their source channels when read in
+	native_channel_names = []
+	if zmax_eegcleaner and zmax_eegcleaner_native:
+		print('ATTEMPT to clean the EEG signals natively ' + filepath)
+		native_channel_names += [name for name, source_name in get_zmax_cleaned_channel_sources().items() if source_name in channel_avail_list]
+	if zmax_ppgparser and zmax_ppgparser_native:
+		print('ATTEMPT to reparse heart signals natively ' + filepath)
+		native_channel_names += [name for name, (source_name, output) in get_zmax_parsed_channel_sources().items() if source_name in channel_avail_list]
+	if native_channel_names:
+		channel_avail_list = [name for name in get_check_channel_filenames() if (name in channel_avail_list) or (name in native_channel_names)]
+	return channel_avail_list
+
+# =============================================================================
+# the EEG channels the cleaned channels of EDFCleaner.exe are made of
+# =============================================================================
+def get_zmax_cleaned_channel_sources():
+	return {'EEG L Cleaned': 'EEG L', 'EEG R Cleaned': 'EEG R'}
+
+# =============================================================================
+# the PPG channels and the output of parse_zmax_ppg the parsed channels of
+# PPGParser.exe are made of (the PARSED_NASAL channels are not parsed natively)
+# =============================================================================
+def get_zmax_parsed_channel_sources():
+	return {'PARSED_OXY_IR_AC': ('OXY_IR_AC', 'ppg'), 'PARSED_HR_ir': ('OXY_IR_AC', 'hr'), 'PARSED_HR_ir_strength': ('OXY_IR_AC', 'strength'),
+			'PARSED_OXY_R_AC': ('OXY_R_AC', 'ppg'), 'PARSED_HR_r': ('OXY_R_AC', 'hr'), 'PARSED_HR_r_strength': ('OXY_R_AC', 'strength')}
+
+# =============================================================================
+# the name of the channel EDF file to read in for a channel name, i.e. the
+# one of the source channel for a cleaned or parsed channel that is computed
+# natively (there is no file of it), and how the channel is computed: None
+# (read in as it is), 'cleaned' or the output of parse_zmax_ppg
+# =============================================================================
+def get_zmax_channel_read_name(path, name):
+	cleaned_channel_sources = get_zmax_cleaned_channel_sources()
+	parsed_channel_sources = get_zmax_parsed_channel_sources()
+	if (name in cleaned_channel_sources or name in parsed_channel_sources) and not os.path.isfile(path + os.sep + name + '.edf'):
+		if name in cleaned_channel_sources:
+			return cleaned_channel_sources[name], 'cleaned'
+		return parsed_channel_sources[name]
+	return name, None
+
+# =============================================================================
+# the header of a natively parsed channel (with the one signal of the
+# header_source it is parsed from), the filtered PPG keeps the scaling
+# =============================================================================
+def get_zmax_parsed_channel_header(header_source, output):
+	if output == 'hr':
+		return dict(header_source, units=['bpm'], physical_min=[0.0], physical_max=[300.0], digital_min=[-32768], digital_max=[32767])
+	if output == 'strength':
+		return dict(header_source, units=[''], physical_min=[0.0], physical_max=[1.0], digital_min=[-32768], digital_max=[32767])
+	return header_source
+
 # =============================================================================
 #
 # =============================================================================
-def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=None, no_read=False, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength']):
+def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache=None, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=None, zmax_edfjoin_native=False, no_read=False, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength'], crop_start=None, crop_end=None):
 	path, name, extension = fileparts(filepath)
 	if (extension).lower() != ".edf":
 		warnings.warn("The filepath " + filepath + " does not seem to be an EDF file.")
@@ -200,71 +1132,43 @@ def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=Fa
 		path, name, extension = fileparts(filepath)
 		check_channel_filenames = get_check_channel_filenames()
 		raw_avail_list = []
-		channel_avail_list = []
 		channel_read_list = []
-		for iCh, name in enumerate(check_channel_filenames):
-			checkname = path + os.sep + name + '.edf'
-			if os.path.isfile(checkname):
-				channel_avail_list.append(name)
-
-		reprocessed = False
-		if zmax_ppgparser and zmax_ppgparser_exe_path is not None:
-			print('ATTEMPT to reparse heart signals using the PPGParser ' + filepath)
-			exec_string =  "\"" + zmax_ppgparser_exe_path + "\""
-			for iCh, name in enumerate(channel_avail_list):
-				addfilepath = path + os.sep + name + '.edf'
-				exec_string = exec_string + " " + "\"" + addfilepath + "\""
-			try:
-				reprocessed = True
-				subprocess.run(exec_string, shell=False, timeout=zmax_ppgparser_timeout_seconds)
-			except:
-				print(traceback.format_exc())
-				print('FAILED to reparse ' + filepath)
-
-
-		if zmax_eegcleaner and zmax_eegcleaner_exe_path is not None:
-			print('ATTEMPT to clean the EEG signals using the EDFCleaner ' + filepath)
-			exec_string =  "\"" + zmax_eegcleaner_exe_path + "\""
-			hasEEG = False
-			for iCh, name in enumerate(channel_avail_list):
-				if name in ['EEG L', 'EEG R']:
-					hasEEG = True
-					addfilepath = path + os.sep + name + '.edf'
-					exec_string = exec_string + " " + "\"" + addfilepath + "\""
-			try:
-				if hasEEG:
-					reprocessed = True
-					subprocess.run(exec_string, shell=False, timeout=zmax_eegcleaner_timeout_seconds)
-			except:
-				print(traceback.format_exc())
-				print('FAILED to clean EEG from ' + filepath)
-
-		if reprocessed:
-			channel_avail_list = []
-			for iCh, name in enumerate(check_channel_filenames):
-				checkname = path + os.sep + name + '.edf'
-				if os.path.isfile(checkname):
-					channel_avail_list.append(name)
+		channel_avail_list = get_zmax_channel_avail_list(path)
+		channel_avail_list = zmax_reprocess_channels(filepath, channel_avail_list, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=zmax_ppgparser_native, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=zmax_eegcleaner_native, tool_cache=tool_cache)
 
 		if format == "zmax_edf_join":
 			joined_filepath = None
+			if not zmax_edfjoin_native and (zmax_edfjoin_exe_path is None or not os.path.isfile(zmax_edfjoin_exe_path)):
+				print('NOTE: EDFJoin was not found (%s), the EDF signals are joined natively instead' % zmax_edfjoin_exe_path)
+				zmax_edfjoin_native = True
+			if (crop_start is not None or crop_end is not None) and not zmax_edfjoin_native:
+				print('NOTE: cropping is not applied when joining unzipped EDF files with EDFJoin ' + filepath)
 			if channel_avail_list:
-				print('ATTEMPT to join the EDF signals using the EDFJoin ' + filepath)
-				hasChannel = False
-				exec_string =  "\"" + zmax_edfjoin_exe_path + "\""
-				for iCh, name in enumerate(channel_avail_list):
-					if not name in drop_zmax:
-						hasChannel = True
-						addfilepath = path + os.sep + name + '.edf'
-						exec_string = exec_string + " " + "\"" + addfilepath + "\""
+				print('ATTEMPT to join the EDF signals using the %s %s' % ('native EDF join' if zmax_edfjoin_native else 'EDFJoin', filepath))
+				addfilepaths = [path + os.sep + name + '.edf' for name in channel_avail_list if not name in drop_zmax and get_zmax_channel_read_name(path, name)[1] is None]
+				if any(get_zmax_channel_read_name(path, name)[1] is not None for name in channel_avail_list):
+					print('NOTE: natively cleaned or parsed channels are not joined (the data records are joined as they are) ' + filepath)
 				try:
-					if hasChannel:
-						subprocess.run(exec_string, shell=False, timeout=zmax_edfjoin_timeout_seconds)
-						#joined_filepath = path + os.sep + 'out.EDF'
-						joined_filepath = os.path.abspath(os.getcwd()) + os.sep + 'out.EDF'
+					if addfilepaths:
+						if zmax_edfjoin_native:
+							# directly to the final place, no out.EDF in the current working directory
+							joined_filepath = zmax_edfjoin_move_path if zmax_edfjoin_move_path is not None else os.path.abspath(os.getcwd()) + os.sep + 'out.EDF'
+							join_edf_files(addfilepaths, joined_filepath, crop_start=crop_start, crop_end=crop_end)
+						else:
+							exec_string =  "\"" + zmax_edfjoin_exe_path + "\""
+							for addfilepath in addfilepaths:
+								exec_string = exec_string + " " + "\"" + addfilepath + "\""
+							subprocess.run(exec_string, shell=False, timeout=zmax_edfjoin_timeout_seconds)
+							#joined_filepath = path + os.sep + 'out.EDF'
+							joined_filepath = os.path.abspath(os.getcwd()) + os.sep + 'out.EDF'
 						if not no_read:
+							import mne
 							raw = mne.io.read_raw_edf(joined_filepath, preload=preload)
-						if zmax_edfjoin_move_path != None:
+						if zmax_edfjoin_move_path != None and joined_filepath == zmax_edfjoin_move_path:
+							zmax_edfjoin_keep = False
+							if no_read:
+								return joined_filepath
+						elif zmax_edfjoin_move_path != None:
 							try:
 								joined_filepath_moved = shutil.move(joined_filepath, zmax_edfjoin_move_path)
 								zmax_edfjoin_keep = False
@@ -285,12 +1189,21 @@ def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=Fa
 					print('FAILED to join ZMax EDF files from ' + filepath)
 
 		elif format == "zmax_edf":
+			import numpy
+			ppg_parsed = {}
 			for iCh, name in enumerate(channel_avail_list):
 				if not name in drop_zmax:
-					readfilepath = path + os.sep + name + '.edf'
+					read_name, native = get_zmax_channel_read_name(path, name)
+					readfilepath = path + os.sep + read_name + '.edf'
 					try:
-						raw_read = read_edf_to_raw(readfilepath, format="edf")
-						if 'PARSED_' in name:
+						raw_read = read_edf_to_raw(readfilepath, format="edf", crop_start=crop_start, crop_end=crop_end)
+						if native == 'cleaned':
+							raw_read._data[0] = remove_zmax_sd_card_noise(raw_read._data[0], sfreq=raw_read.info['sfreq'])
+						elif native is not None:
+							if read_name not in ppg_parsed:
+								ppg_parsed[read_name] = parse_zmax_ppg(raw_read._data[0], sfreq=raw_read.info['sfreq'])
+							raw_read._data[0] = ppg_parsed[read_name][native]
+						if 'PARSED_' in name or native is not None:
 							raw_read.rename_channels({raw_read.info["ch_names"][0]: name})
 						raw_avail_list.append(raw_read)
 						channel_read_list.append(name)
@@ -304,16 +1217,21 @@ def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=Fa
 			print(channel_read_list)
 
 			if raw_avail_list[0] is not None:
-				nSamples_should = raw_avail_list[0].n_times
+				# length and first sample of the first channel at 256 Hz
+				nSamples_should = int(round(raw_avail_list[0].n_times * 256.0 / raw_avail_list[0].info['sfreq']))
+				first_samp_should = int(round(raw_avail_list[0].first_samp * 256.0 / raw_avail_list[0].info['sfreq']))
+				start_datetime_should = raw_avail_list[0].info['meas_date'] + datetime.timedelta(seconds=raw_avail_list[0].first_time)
 
 			for i, r in enumerate(raw_avail_list):
 				if r is not None:
 					sfreq_temp = r.info['sfreq']
 					if sfreq_temp != 256.0:
-						raw_avail_list[i] = r.resample(256.0)
-						nSamples = raw_avail_list[i].n_times
-						if nSamples < nSamples_should:
-							raw_avail_list[i] = raw_prolong_constant(raw_avail_list[i], nSamples_should, contant=0, prepend=True)
+						r = r.resample(256.0)
+					# the channels start at their header start times (relative to the first channel)
+					offset_samples = int(round((r.info['meas_date'] + datetime.timedelta(seconds=r.first_time) - start_datetime_should).total_seconds() * 256.0))
+					if (r.n_times != nSamples_should) or (offset_samples != 0):
+						r = raw_align_to_reference(r, nSamples_should, offset_samples=offset_samples, first_samp=first_samp_should, constant=0)
+					raw_avail_list[i] = r
 
 			# append the raws together
 			raw = raw_avail_list[0].add_channels(raw_avail_list[1:])
@@ -354,7 +1272,24 @@ def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=Fa
 
 		#raw.info['chs'][0]['unit']
 	else:
-		raw = mne.io.read_raw_edf(filepath, preload=preload)
+		import mne
+		if crop_start is None and crop_end is None:
+			raw = mne.io.read_raw_edf(filepath, preload=preload)
+		else:
+			# only the data records in the crop window are read (when loading the data) by mne
+			header = read_edf_header(filepath)
+			rec_start, rec_stop = get_edf_record_range(header, crop_start, crop_end)
+			raw = mne.io.read_raw_edf(filepath, preload=False)
+			# as in the header and not from the number of samples, the file can
+			# hold fewer data records than the header says (e.g. a cut offload)
+			n_samps_per_record = int(round(raw.info['sfreq'] * header['record_length']))
+			n_records_in_file = min((os.path.getsize(filepath) - header['header_bytes']) // header['record_bytes'], raw.n_times // n_samps_per_record)
+			rec_stop = min(rec_stop, n_records_in_file)
+			if rec_start >= rec_stop:
+				raise ValueError("The crop window does not overlap with the %d data records in the file %s" % (n_records_in_file, filepath))
+			raw.crop(tmin=raw.times[rec_start*n_samps_per_record], tmax=raw.times[rec_stop*n_samps_per_record - 1], include_tmax=True)
+			if preload:
+				raw.load_data()
 	return raw
 
 # =============================================================================
@@ -363,6 +1298,32 @@ def read_edf_to_raw(filepath, preload=True, format="zmax_edf", zmax_ppgparser=Fa
 def edfWriteAnnotation(edfWriter, onset_in_seconds, duration_in_seconds, description, str_format='utf-8'):
 	edfWriter.writeAnnotation(onset_in_seconds, duration_in_seconds, description, str_format)
 
+# =============================================================================
+# the physical dimensions of the zmax channels in the merged EDF
+# =============================================================================
+def get_zmax_channel_dimensions():
+	return {'BATT': 'V', 'BODY TEMP': "C", 'dX': "g", 'dY': "g", 'dZ': "g", 'EEG L': "uV", 'EEG R': "uV", 'EEG R Cleaned': "uV", 'EEG L Cleaned': "uV", 'EEG R Cleaned_LFP': "uV", 'EEG L Cleaned_LFP': "uV", 'LIGHT': "", 'NASAL L': "", 'NASAL R': "", 'NOISE': "", 'OXY_DARK_AC': "", 'OXY_DARK_DC': "", 'OXY_IR_AC': "", 'OXY_IR_DC': "", 'OXY_R_AC': "", 'OXY_R_DC': "", 'RSSI': "", 'PARSED_NASAL R': "", 'PARSED_OXY_IR_AC': "", 'PARSED_NASAL L': "", 'PARSED_HR_r': "bpm", 'PARSED_HR_r_strength': "", 'PARSED_OXY_R_AC': "", 'PARSED_HR_ir': "bpm", 'PARSED_HR_ir_strength': ""}
+
+# =============================================================================
+# the recording header fields (and the start annotation) of a merged EDF
+# =============================================================================
+def edf_writer_set_zmax_header(edfWriter, start_datetime, deidentify=False):
+	edfWriter.setTechnician('')
+	edfWriter.setRecordingAdditional('merged from single zmax files')
+	edfWriter.setPatientName('')
+	edfWriter.setPatientCode('')
+	edfWriter.setPatientAdditional('')
+	edfWriter.setAdmincode('')
+	edfWriter.setEquipment('Hypnodyne zmax')
+	edfWriter.setGender(0)
+	edfWriter.setBirthdate(datetime.date(2000, 1, 1))
+	#edfWriter.setStartdatetime(datetime.datetime.now())
+	if deidentify:
+		edfWriter.setStartdatetime(datetime.date(2000, 1, 1))
+	else:
+		edfWriter.setStartdatetime(start_datetime)
+	edfWriteAnnotation(edfWriter,0, -1, u"signal_start")
+
 # =============================================================================
 #
 # =============================================================================
@@ -371,7 +1332,8 @@ def write_raw_to_edf(raw, filepath, format="zmax_edf", deidentify=False):
 	if (extension).lower() != ".edf":
 		warnings.warn("The filepath " + filepath + " does not seem to be an EDF file.")
 	if format == "zmax_edf":
-		channel_dimensions_zmax = {'BATT': 'V', 'BODY TEMP': "C", 'dX': "g", 'dY': "g", 'dZ': "g", 'EEG L': "uV", 'EEG R': "uV", 'EEG R Cleaned': "uV", 'EEG L Cleaned': "uV", 'EEG R Cleaned_LFP': "uV", 'EEG L Cleaned_LFP': "uV", 'LIGHT': "", 'NASAL L': "", 'NASAL R': "", 'NOISE': "", 'OXY_DARK_AC': "", 'OXY_DARK_DC': "", 'OXY_IR_AC': "", 'OXY_IR_DC': "", 'OXY_R_AC': "", 'OXY_R_DC': "", 'RSSI': "", 'PARSED_NASAL R': "", 'PARSED_OXY_IR_AC': "", 'PARSED_NASAL L': "", 'PARSED_HR_r': "bpm", 'PARSED_HR_r_strength': "", 'PARSED_OXY_R_AC': "", 'PARSED_HR_ir': "bpm", 'PARSED_HR_ir_strength': ""}
+		import pyedflib
+		channel_dimensions_zmax = get_zmax_channel_dimensions()
 
 		#EDF_format_extention = ".edf"
 		EDF_format_filetype = pyedflib.FILETYPE_EDFPLUS
@@ -388,21 +1350,7 @@ def write_raw_to_edf(raw, filepath, format="zmax_edf", deidentify=False):
 		"""
 		if has_annotations:
 			edfWriter.set_number_of_annotation_signals(nAnnotation) #nAnnotation*60 annotations per minute on average
-		edfWriter.setTechnician('')
-		edfWriter.setRecordingAdditional('merged from single zmax files')
-		edfWriter.setPatientName('')
-		edfWriter.setPatientCode('')
-		edfWriter.setPatientAdditional('')
-		edfWriter.setAdmincode('')
-		edfWriter.setEquipment('Hypnodyne zmax')
-		edfWriter.setGender(0)
-		edfWriter.setBirthdate(datetime.date(2000, 1, 1))
-		#edfWriter.setStartdatetime(datetime.datetime.now())
-		if deidentify:
-			edfWriter.setStartdatetime(datetime.date(2000, 1, 1))
-		else:
-			edfWriter.setStartdatetime(raw.info['meas_date'])
-		edfWriteAnnotation(edfWriter,0, -1, u"signal_start")
+		edf_writer_set_zmax_header(edfWriter, raw.info['meas_date'] + datetime.timedelta(seconds=raw.first_time), deidentify=deidentify)
 
 		for iCh in range(0,nChannels):
 			ch_name = raw.info['ch_names'][iCh]
@@ -442,26 +1390,26 @@ def write_raw_to_edf(raw, filepath, format="zmax_edf", deidentify=False):
 # =============================================================================
 #
 # =============================================================================
-def read_edf_to_raw_zipped(filepath, format="zmax_edf", zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=None, no_read=False, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength']):
-	temp_dir = safe_zip_dir_extract(filepath)
+def read_edf_to_raw_zipped(filepath, format="zmax_edf", zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache=None, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=None, zmax_edfjoin_native=False, no_read=False, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength'], crop_start=None, crop_end=None, scratch_dir=None, verify_crc=False):
+	temp_dir = safe_zip_dir_extract(filepath, crop_start=crop_start, crop_end=crop_end, scratch_dir=scratch_dir, verify_crc=verify_crc)
 	raw = None
 	if format in ["zmax_edf", "zmax_edf_join"]:
-		raw = read_edf_to_raw(temp_dir.name + os.sep + "EEG L.edf", format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_edfjoin_exe_path=zmax_edfjoin_exe_path, zmax_edfjoin_timeout_seconds=zmax_edfjoin_timeout_seconds, zmax_edfjoin_keep=zmax_edfjoin_keep, zmax_edfjoin_move_path=zmax_edfjoin_move_path, no_read=no_read, drop_zmax=drop_zmax)
+		raw = read_edf_to_raw(temp_dir.name + os.sep + "EEG L.edf", format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=zmax_ppgparser_native, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=zmax_eegcleaner_native, tool_cache=tool_cache, zmax_edfjoin_exe_path=zmax_edfjoin_exe_path, zmax_edfjoin_timeout_seconds=zmax_edfjoin_timeout_seconds, zmax_edfjoin_keep=zmax_edfjoin_keep, zmax_edfjoin_move_path=zmax_edfjoin_move_path, zmax_edfjoin_native=zmax_edfjoin_native, no_read=no_read, drop_zmax=drop_zmax)
 	elif format == "edf":
 		fileendings = ('*.edf', '*.EDF')
 		filepath_list_edfs = []
 		for fileending in fileendings:
 			filepath_list_edfs.extend(glob.glob(temp_dir.name + os.sep + fileending,recursive=True))
 		if filepath_list_edfs:
-			raw = read_edf_to_raw(filepath_list_edfs[0], format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, no_read=no_read)
+			raw = read_edf_to_raw(filepath_list_edfs[0], format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=zmax_ppgparser_native, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=zmax_eegcleaner_native, tool_cache=tool_cache, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, no_read=no_read)
 	safe_zip_dir_cleanup(temp_dir)
 	return raw
 
 # =============================================================================
 #
 # =============================================================================
-def write_raw_to_edf_zipped(raw, zippath, edf_filename=None, format="zmax_edf", compresslevel=6):
-	temp_dir = tempfile.TemporaryDirectory()
+def write_raw_to_edf_zipped(raw, zippath, edf_filename=None, format="zmax_edf", compresslevel=6, scratch_dir=None):
+	temp_dir = tempfile.TemporaryDirectory(dir=scratch_dir)
 	if edf_filename is None:
 		filepath = temp_dir.name + os.sep + fileparts(zippath)[1] + '.edf'
 	else:
@@ -472,99 +1420,955 @@ def write_raw_to_edf_zipped(raw, zippath, edf_filename=None, format="zmax_edf",
 	return zippath
 
 # =============================================================================
-#
+# reads the digital (int16) samples of one signal of an EDF (only the data
+# records of a crop window) chunk by chunk into one preallocated array,
+# returns the header, the samples and the start date time of the samples
 # =============================================================================
-def raw_zmax_data_quality(raw):
-		# the last second of Battery voltage
-		quality = None
-		try:
-			quality = statistics.mean(raw.get_data(picks=['BATT'])[0][-256:])
-		except Exception:
-			print(traceback.format_exc())
-		return quality
+def read_edf_signal_digital(filepath, signal_index=0, crop_start=None, crop_end=None, chunk_records=256):
+	import numpy
+	with open(filepath, "rb") as f:
+		header = read_edf_header(f)
+		rec_start, rec_stop = get_edf_record_range(header, crop_start, crop_end)
+		n_samps = header['n_samps'][signal_index]
+		sample_start = sum(header['n_samps'][:signal_index])
+		record_samples = sum(header['n_samps'])
+		data = numpy.empty((rec_stop - rec_start)*n_samps, dtype='<i2')
+		f.seek(header['header_bytes'] + rec_start*header['record_bytes'])
+		iSample = 0
+		rec = rec_start
+		while rec < rec_stop:
+			block = f.read(min(chunk_records, rec_stop - rec)*header['record_bytes'])
+			n_records = len(block) // header['record_bytes']
+			if n_records == 0:
+				break
+			records = numpy.frombuffer(block, dtype='<i2', count=n_records*record_samples).reshape(n_records, record_samples)
+			data[iSample:(iSample + n_records*n_samps)] = records[:, sample_start:(sample_start+n_samps)].reshape(-1)
+			iSample += n_records*n_samps
+			rec += n_records
+	start_datetime = header['start_datetime'] + datetime.timedelta(seconds=rec_start*header['record_length'])
+	return header, data[:iSample], start_datetime
 
-def get_dir_path(pathstring):
-	pathstring = os.path.normpath(pathstring)
-	if os.path.isdir(pathstring):
-		return pathstring
-	elif os.path.isfile(pathstring):
-		p, n, e = fileparts(pathstring)
-		return p + os.sep + n
-	else:
-		p, n, e = fileparts(pathstring)
-		if e:
-			return p + os.sep + n
-		else:
-			return pathstring
-		print("'%s' is not a file or directory" % pathstring)
-		raise Exception(pathstring)
-	return None
+# =============================================================================
+# the digital value of the physical zero of a signal (e.g. for padding)
+# =============================================================================
+def get_edf_digital_zero(header, signal_index):
+	scale = (header['physical_max'][signal_index] - header['physical_min'][signal_index]) / (header['digital_max'][signal_index] - header['digital_min'][signal_index])
+	digital_zero = int(round(header['digital_min'][signal_index] - header['physical_min'][signal_index]/scale))
+	return min(max(digital_zero, header['digital_min'][signal_index]), header['digital_max'][signal_index])
 
-def nullable_string(val):
-	if not val:
-		return None
-	return val
+# =============================================================================
+# the scale and offset of a signal from its digital to its physical values
+# =============================================================================
+def get_edf_scale_offset(header, signal_index):
+	scale = (header['physical_max'][signal_index] - header['physical_min'][signal_index]) / (header['digital_max'][signal_index] - header['digital_min'][signal_index])
+	return scale, header['physical_min'][signal_index] - header['digital_min'][signal_index]*scale
 
-def dir_path_or_file(pathstring):
-	pathstring = os.path.normpath(pathstring)
-	if nullable_string(pathstring):
-		if os.path.isdir(pathstring):
-			return pathstring
-		if os.path.isfile(pathstring):
-			return pathstring
-		else:
-			print("'%s' is not a directory or file" % pathstring)
-			raise NotADirectoryError(pathstring)
-	return None
+# =============================================================================
+# the physical (float64) values of digital samples of a signal and the
+# digital values (kept as float32, not rounded) of physical ones
+# =============================================================================
+def get_edf_physical_values(data, header, signal_index=0):
+	import numpy
+	scale, offset = get_edf_scale_offset(header, signal_index)
+	return numpy.asarray(data, dtype=numpy.float64)*scale + offset
 
-def dir_path(pathstring):
-	pathstring = os.path.normpath(pathstring)
-	if nullable_string(pathstring):
-		if os.path.isdir(pathstring):
-			return pathstring
-		else:
-			print("'%s' is not a directory" % pathstring)
-			raise NotADirectoryError(pathstring)
-	return None
+def get_edf_digital_values(data, header, signal_index=0):
+	import numpy
+	scale, offset = get_edf_scale_offset(header, signal_index)
+	return ((numpy.asarray(data, dtype=numpy.float64) - offset)/scale).astype(numpy.float32)
 
-def dir_path_new(pathstring):
-	pathstring = os.path.normpath(pathstring)
-	if nullable_string(pathstring):
-		return pathstring
-	return None
+# =============================================================================
+# polyphase resampling (scipy.signal.resample_poly) of the samples of one
+# channel, the result is kept as float32
+# =============================================================================
+def resample_samples(data, sfreq_from, sfreq_to):
+	import numpy
+	from scipy.signal import resample_poly
+	ratio = fractions.Fraction(sfreq_to).limit_denominator(1000) / fractions.Fraction(sfreq_from).limit_denominator(1000)
+	return resample_poly(data.astype(numpy.float32), ratio.numerator, ratio.denominator).astype(numpy.float32)
 
-def file_path(pathstring):
-	pathstring = os.path.normpath(pathstring)
-	if nullable_string(pathstring):
-		if os.path.isfile(pathstring):
-			return pathstring
-		else:
-			print("'%s' is not a file" % pathstring)
-			raise NotADirectoryError(pathstring)
-	return None
+# =============================================================================
+# removes the SD card write noise from the zmax EEG (as EDFCleaner.exe), i.e.
+# 85.33 Hz and its subharmonics 42.66, 21.33, 10.66 and 5.33 Hz, which repeat
+# every period of 48 samples at 256 Hz. For each chunk of chunk_samples the
+# signal is folded by the period and averaged, only the noise frequencies of
+# this mean period are kept (FFT) and it is subtracted from every period. All
+# the chunks of a batch are processed at once (with the FFTs on workers
+# cores). The chunks are on a fixed grid of the channel samples, sample_start
+# is the index of the first sample of data (a multiple of chunk_samples), so
+# that parts of a channel are cleaned the same as the whole channel
+# =============================================================================
+def remove_zmax_sd_card_noise(data, sfreq=256.0, sample_start=0, chunk_samples=15360, period=48, harmonics=(1, 2, 4, 8, 16), batch_chunks=64, workers=-1, dtype=None):
+	import numpy
+	import scipy.fft
+	if sfreq != 256.0:
+		raise ValueError("The SD card noise can only be removed at 256 Hz, not at %g Hz" % sfreq)
+	if (chunk_samples % period != 0) or (sample_start % chunk_samples != 0):
+		raise ValueError("chunk_samples (%d) must be a multiple of the period (%d) and sample_start (%d) of chunk_samples" % (chunk_samples, period, sample_start))
+	keep = numpy.zeros(period//2 + 1, dtype=bool)
+	keep[list(harmonics)] = True
+
+	def get_noise_period(mean_periods):
+		spectrum = scipy.fft.rfft(mean_periods, axis=-1, workers=workers)
+		spectrum[..., ~keep] = 0
+		return scipy.fft.irfft(spectrum, n=period, axis=-1, workers=workers)
+
+	cleaned = numpy.empty(len(data), dtype=numpy.float64 if dtype is None else dtype)
+	n_chunks = len(data) // chunk_samples
+	for chunk in range(0, n_chunks, batch_chunks):
+		n = min(batch_chunks, n_chunks - chunk)
+		periods = numpy.array(data[(chunk*chunk_samples):((chunk+n)*chunk_samples)], dtype=numpy.float64).reshape(n, chunk_samples // period, period) # a copy
+		periods -= get_noise_period(periods.mean(axis=1))[:, numpy.newaxis, :]
+		cleaned[(chunk*chunk_samples):((chunk+n)*chunk_samples)] = periods.reshape(-1)
+	# the last incomplete chunk, if it has at least one period
+	rest = numpy.asarray(data[(n_chunks*chunk_samples):], dtype=numpy.float64)
+	if len(rest) >= period:
+		phase = numpy.arange(len(rest)) % period
+		mean_period = numpy.bincount(phase, weights=rest, minlength=period) / numpy.bincount(phase, minlength=period)
+		rest = rest - get_noise_period(mean_period)[phase]
+	cleaned[(n_chunks*chunk_samples):] = rest
+	return cleaned
 
-def dir_path_create(pathstring):
-	if nullable_string(pathstring):
-		try:
-			pathstring = dir_path(pathstring)
-			return pathstring
-		except NotADirectoryError:
-			try:
-				os.makedirs(pathstring, exist_ok=True)
-				print("Directory '%s' was not existent and was created" %pathstring)
-			except:
-				print("Directory '%s' was could not be created" %pathstring)
-				NotADirectoryError(pathstring)
-			finally:
-				return nullable_string(pathstring)
-	else:
-		return None
+# =============================================================================
+# native alternative to the Hypnodyne PPGParser: the heart rate of a PPG
+# channel (e.g. OXY_IR_AC) from the beats (the maxima of the band-pass
+# filtered PPG at least 0.25 s apart, i.e. up to 240 bpm, and at least half
+# the maximum within 1 s, i.e. not the dicrotic wave), the heart rate of
+# every sample is the one of the beat interval it is in (0 if there is none
+# between 30 and 240 bpm). The strength (0 to 1) is the part of the PPG
+# amplitude (in 5 s) that is in the heart rate band. The PPG is parsed in
+# chunks of chunk_samples with margin_samples of the neighbouring chunks on
+# each side, i.e. padded has (n chunks)*chunk_samples + 2*margin_samples
+# samples, and batch_chunks chunks are filtered at once
+# =============================================================================
+def parse_zmax_ppg_padded(padded, sfreq=256.0, chunk_samples=15360, margin_samples=2560, band=(0.5, 4.0), batch_chunks=32, dtype=None):
+	import numpy
+	from scipy.signal import butter, sosfiltfilt
+	from scipy.ndimage import maximum_filter1d, uniform_filter1d
+	n_chunks = (len(padded) - 2*margin_samples) // chunk_samples
+	window_samples = chunk_samples + 2*margin_samples
+	sos = butter(2, band, btype='bandpass', fs=sfreq, output='sos')
+	beat_samples = int(round(0.25*sfreq)) | 1
+	beat_max_samples = int(round(2*sfreq)) | 1
+	strength_samples = int(round(5*sfreq))
+	windows = numpy.lib.stride_tricks.sliding_window_view(padded, window_samples)[::chunk_samples]
+	outputs = {output: numpy.empty(n_chunks*chunk_samples, dtype=numpy.float64 if dtype is None else dtype) for output in ['ppg', 'hr', 'strength']}
+	for chunk in range(0, n_chunks, batch_chunks):
+		batch = numpy.array(windows[chunk:(chunk + batch_chunks)], dtype=numpy.float64)
+		n = len(batch)
+		filtered = sosfiltfilt(sos, batch, axis=-1)
+		# the beats of all chunks of the batch by their flat index
+		beats = numpy.flatnonzero((filtered == maximum_filter1d(filtered, beat_samples, axis=-1)) & (filtered > 0) & (2*filtered >= maximum_filter1d(filtered, beat_max_samples, axis=-1)))
+		intervals = numpy.diff(beats)
+		bpm = 60.0*sfreq/numpy.maximum(intervals, 1)
+		bpm[(numpy.diff(beats // window_samples) != 0) | (bpm < 30) | (bpm > 240)] = 0
+		interval = numpy.searchsorted(beats, numpy.arange(n*window_samples), side='right') - 1
+		inside = (interval >= 0) & (interval < len(intervals))
+		hr = numpy.zeros(n*window_samples)
+		hr[inside] = bpm[interval[inside]]
+		hr = hr.reshape(n, window_samples)
+		ac = batch - uniform_filter1d(batch, strength_samples, axis=-1)
+		strength = numpy.sqrt(uniform_filter1d(filtered**2, strength_samples, axis=-1) / numpy.maximum(uniform_filter1d(ac**2, strength_samples, axis=-1), numpy.finfo(numpy.float64).tiny))
+		numpy.clip(strength, 0, 1, out=strength)
+		for output, values in [('ppg', filtered), ('hr', hr), ('strength', strength)]:
+			outputs[output][(chunk*chunk_samples):((chunk + n)*chunk_samples)] = values[:, margin_samples:(margin_samples + chunk_samples)].reshape(-1)
+	return outputs
 
 # =============================================================================
-# 
+# parses a whole PPG channel (see parse_zmax_ppg_padded), the chunks are on a
+# fixed grid and the channel is padded with its first and last sample, so
+# that parts of a channel are parsed the same as the whole channel. Returns
+# a dict of the filtered PPG ('ppg'), the heart rate ('hr', in bpm) and the
+# strength ('strength') with a value per sample
 # =============================================================================
-def find_zmax_files(parentdirpath, readzip=False, zipfile_match_string='', zipfile_nonmatch_string='', find_hyp_files=False):
-	"""
+def parse_zmax_ppg(data, sfreq=256.0, chunk_seconds=60, margin_seconds=10, dtype=None):
+	import numpy
+	chunk_samples = int(round(chunk_seconds*sfreq))
+	margin_samples = int(round(margin_seconds*sfreq))
+	if len(data) == 0:
+		return {output: numpy.empty(0, dtype=numpy.float64 if dtype is None else dtype) for output in ['ppg', 'hr', 'strength']}
+	n_chunks = -(-len(data) // chunk_samples)
+	padded = numpy.pad(numpy.asarray(data, dtype=numpy.float64), (margin_samples, margin_samples + n_chunks*chunk_samples - len(data)), mode='edge')
+	outputs = parse_zmax_ppg_padded(padded, sfreq=sfreq, chunk_samples=chunk_samples, margin_samples=margin_samples, dtype=dtype)
+	return {output: values[:len(data)] for output, values in outputs.items()}
+
+# =============================================================================
+# merged zmax recording in a compact form, the samples of every channel are
+# kept as the digital int16 values of the EDFs (or as float32 once resampled)
+# with a scale and offset per channel to get the physical values. Physical
+# float64 values are only computed when they are asked for (get_data)
+# =============================================================================
+class CompactRecording(object):
+	unit_factors = {'uV': 1e-6, 'mV': 1e-3, 'nV': 1e-9} # to SI units as in mne
+
+	def __init__(self, sfreq, start_datetime):
+		self.sfreq = sfreq
+		self.start_datetime = start_datetime
+		self.ch_names = []
+		self.sfreqs = []
+		self.data = []
+		self.units = []
+		self.physical_min = []
+		self.physical_max = []
+		self.digital_min = []
+		self.digital_max = []
+
+	@property
+	def n_times(self):
+		# the number of samples at sfreq, the channels can have other sampling rates
+		return int(round(self.get_n_samples(0) * self.sfreq / self.sfreqs[0])) if self.data else 0
+
+	def get_n_samples(self, iCh):
+		return len(self.data[iCh])
+
+	def to_channel_samples(self, iCh, samples):
+		# a sample (at sfreq) as a sample of the channel
+		if self.sfreqs[iCh] == self.sfreq:
+			return samples
+		return int(samples * self.sfreqs[iCh] // self.sfreq)
+
+	def add_channel(self, ch_name, data, unit, physical_min, physical_max, digital_min, digital_max, sfreq=None):
+		self.ch_names.append(ch_name)
+		self.sfreqs.append(self.sfreq if sfreq is None else sfreq)
+		self.data.append(data)
+		self.units.append(unit)
+		self.physical_min.append(physical_min)
+		self.physical_max.append(physical_max)
+		self.digital_min.append(digital_min)
+		self.digital_max.append(digital_max)
+
+	def drop_channels(self, ch_names):
+		for ch_name in ch_names:
+			iCh = self.ch_names.index(ch_name)
+			for values in [self.ch_names, self.sfreqs, self.data, self.units, self.physical_min, self.physical_max, self.digital_min, self.digital_max]:
+				del values[iCh]
+
+	def get_scale_offset(self, iCh):
+		scale = (self.physical_max[iCh] - self.physical_min[iCh]) / (self.digital_max[iCh] - self.digital_min[iCh])
+		return scale, self.physical_min[iCh] - self.digital_min[iCh]*scale
+
+	def get_samples(self, iCh, start=None, stop=None):
+		# the kept (int16 or float32) samples
+		return self.data[iCh][start:stop]
+
+	def get_digital(self, iCh, start=None, stop=None):
+		import numpy
+		data = self.get_samples(iCh, start, stop)
+		if data.dtype == numpy.int16:
+			return data
+		return numpy.clip(numpy.round(data), self.digital_min[iCh], self.digital_max[iCh]).astype(numpy.int16)
+
+	def get_data(self, picks=None, start=0, stop=None):
+		# physical values (in SI units like mne, e.g. V instead of uV) as channels
+		# x samples, start and stop are samples at sfreq. The picked channels
+		# need to have the same sampling rate and have its number of samples
+		import numpy
+		if picks is None:
+			picks = range(len(self.ch_names))
+		indices = [self.ch_names.index(pick) if isinstance(pick, str) else pick for pick in picks]
+		if len(set(self.sfreqs[iCh] for iCh in indices)) > 1:
+			raise ValueError("The channels %s have different sampling rates, get their data one rate at a time" % [self.ch_names[iCh] for iCh in indices])
+		stop = self.n_times if stop is None else min(stop, self.n_times)
+		if indices:
+			start = self.to_channel_samples(indices[0], start)
+			stop = min(self.to_channel_samples(indices[0], stop), self.get_n_samples(indices[0]))
+		data = numpy.empty([len(indices), max(0, stop - start)])
+		for i, iCh in enumerate(indices):
+			scale, offset = self.get_scale_offset(iCh)
+			factor = self.unit_factors.get(self.units[iCh], 1.0)
+			numpy.multiply(self.get_samples(iCh, start, stop), scale*factor, out=data[i])
+			data[i] += offset*factor
+		return data
+
+	def is_flat(self, iCh, max_not_flat=10):
+		import numpy
+		return numpy.count_nonzero(self.data[iCh] != numpy.median(self.data[iCh])) <= max_not_flat
+
+	def resample(self, sfreq):
+		for iCh in range(len(self.ch_names)):
+			self.data[iCh] = resample_samples(self.data[iCh], self.sfreqs[iCh], sfreq)
+		self.sfreq = sfreq
+		self.sfreqs = [sfreq] * len(self.ch_names)
+		return self
+
+	def get_channel_hash(self, iCh, hash_function=hashlib.md5):
+		return hash_function(("%s|%g|%r|%r|%r|%r|%s|" % (self.ch_names[iCh], self.sfreqs[iCh], self.physical_min[iCh], self.physical_max[iCh], self.digital_min[iCh], self.digital_max[iCh], self.data[iCh].dtype.str)).encode('utf-8'))
+
+	def get_channel_digest(self, iCh, hash_function=hashlib.md5):
+		import numpy
+		channel_hash = self.get_channel_hash(iCh, hash_function=hash_function)
+		channel_hash.update(numpy.ascontiguousarray(self.data[iCh]))
+		return channel_hash.digest()
+
+	def get_hash(self, hash_function=hashlib.md5):
+		# the hashes of the single channels combined into one
+		recording_hash = hash_function()
+		for iCh in range(len(self.ch_names)):
+			recording_hash.update(self.get_channel_digest(iCh, hash_function=hash_function))
+		return recording_hash.hexdigest()
+
+	def close(self):
+		pass
+
+# =============================================================================
+# reads all zmax channel EDFs of the folder of filepath into a
+# CompactRecording (at sfreq), channels of other sampling rates are resampled
+# and aligned to the first channel (as in read_edf_to_raw). With native_rates
+# the channels of whole samples per second keep their sampling rate
+# =============================================================================
+def read_zmax_compact(filepath, sfreq=256.0, native_rates=False, zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache=None, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength'], crop_start=None, crop_end=None):
+	import numpy
+	path, name, extension = fileparts(filepath)
+	channel_avail_list = get_zmax_channel_avail_list(path)
+	channel_avail_list = zmax_reprocess_channels(filepath, channel_avail_list, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=zmax_ppgparser_native, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=zmax_eegcleaner_native, tool_cache=tool_cache)
+	recording = None
+	channel_read_list = []
+	ppg_parsed = {}
+	for name in channel_avail_list:
+		if name in drop_zmax:
+			continue
+		read_name, native = get_zmax_channel_read_name(path, name)
+		try:
+			header, data, start_datetime = read_edf_signal_digital(path + os.sep + read_name + '.edf', crop_start=crop_start, crop_end=crop_end)
+			if native == 'cleaned':
+				data = remove_zmax_sd_card_noise(data, sfreq=header['sfreq'][0], dtype=numpy.float32)
+			elif native is not None:
+				if read_name not in ppg_parsed:
+					ppg_parsed[read_name] = parse_zmax_ppg(get_edf_physical_values(data, header), sfreq=header['sfreq'][0], dtype=numpy.float32)
+				header = get_zmax_parsed_channel_header(header, native)
+				data = get_edf_digital_values(ppg_parsed[read_name][native], header)
+		except Exception:
+			print(traceback.format_exc())
+			print('FAILED TO read in channel: ' + name)
+			continue
+		start_datetime = start_datetime.replace(tzinfo=datetime.timezone.utc) # as the meas_date in mne
+		sfreq_channel = header['sfreq'][0]
+		if recording is None:
+			# the first channel sets the start and the number of samples
+			recording = CompactRecording(sfreq, start_datetime)
+			nSamples_should = int(round(len(data) * sfreq / sfreq_channel))
+		sfreq_keep = sfreq_channel if (native_rates and sfreq_channel == int(sfreq_channel)) else sfreq
+		if sfreq_channel != sfreq_keep:
+			data = resample_samples(data, sfreq_channel, sfreq_keep)
+		nSamples_should_channel = int(round(nSamples_should * sfreq_keep / sfreq))
+		offset_samples = int(round((start_datetime - recording.start_datetime).total_seconds() * sfreq_keep))
+		if (len(data) != nSamples_should_channel) or (offset_samples != 0):
+			data = align_to_reference(data, nSamples_should_channel, offset_samples=offset_samples, constant=get_edf_digital_zero(header, 0))
+		recording.add_channel(name, data, header['units'][0], header['physical_min'][0], header['physical_max'][0], header['digital_min'][0], header['digital_max'][0], sfreq=sfreq_keep)
+		channel_read_list.append(name)
+
+	print("zmax edf channels found:")
+	print(channel_avail_list)
+	print("zmax edf channels read in:")
+	print(channel_read_list)
+	return recording
+
+# =============================================================================
+#
+# =============================================================================
+def read_zmax_compact_zipped(filepath, crop_start=None, crop_end=None, scratch_dir=None, verify_crc=False, **kwargs):
+	temp_dir = safe_zip_dir_extract(filepath, crop_start=crop_start, crop_end=crop_end, scratch_dir=scratch_dir, verify_crc=verify_crc)
+	try:
+		recording = read_zmax_compact(temp_dir.name + os.sep + "EEG L.edf", **kwargs)
+	finally:
+		safe_zip_dir_cleanup(temp_dir)
+	return recording
+
+# =============================================================================
+# out-of-core sample sources for a BlockwiseRecording, each with n_samples,
+# dtype and get(start, stop) that returns only the asked samples. The digital
+# samples of one signal of an EDF (in a crop window), only the data records
+# covering start to stop are read
+# =============================================================================
+class EdfDigitalSource(object):
+	def __init__(self, filepath, signal_index=0, crop_start=None, crop_end=None):
+		import numpy
+		self.filepath = filepath
+		self.signal_index = signal_index
+		self.header = read_edf_header(filepath)
+		self.rec_start, rec_stop = get_edf_record_range(self.header, crop_start, crop_end)
+		# as read_edf_signal_digital, only the data records that are in the file
+		n_records_in_file = (os.path.getsize(filepath) - self.header['header_bytes']) // self.header['record_bytes']
+		self.rec_stop = max(self.rec_start, min(rec_stop, n_records_in_file))
+		self.n_samps = self.header['n_samps'][signal_index]
+		self.sample_start = sum(self.header['n_samps'][:signal_index])
+		self.n_samples = (self.rec_stop - self.rec_start)*self.n_samps
+		self.dtype = numpy.dtype(numpy.int16)
+		self.start_datetime = self.header['start_datetime'] + datetime.timedelta(seconds=self.rec_start*self.header['record_length'])
+
+	def get(self, start, stop):
+		import numpy
+		stop = min(stop, self.n_samples)
+		if stop <= start:
+			return numpy.empty(0, dtype=self.dtype)
+		rec_first = start // self.n_samps
+		rec_last = (stop - 1) // self.n_samps + 1
+		record_samples = sum(self.header['n_samps'])
+		with open(self.filepath, "rb") as f:
+			block = read_file_at(f, self.header['header_bytes'] + (self.rec_start + rec_first)*self.header['record_bytes'], (rec_last - rec_first)*self.header['record_bytes'])
+		records = numpy.frombuffer(block, dtype='<i2', count=(rec_last - rec_first)*record_samples).reshape(rec_last - rec_first, record_samples)
+		data = records[:, self.sample_start:(self.sample_start+self.n_samps)].reshape(-1)
+		return data[(start - rec_first*self.n_samps):(stop - rec_first*self.n_samps)].astype(self.dtype)
+
+# =============================================================================
+# resampled samples of a source (as resample_samples on all of them), each
+# asked segment is resampled from the source samples around it with enough
+# overlap for the polyphase filter, so that the segments are the same as the
+# ones of resampling all samples at once
+# =============================================================================
+class ResampledSource(object):
+	def __init__(self, source, sfreq_from, sfreq_to):
+		import numpy
+		self.source = source
+		self.sfreq_from = sfreq_from
+		self.sfreq_to = sfreq_to
+		ratio = fractions.Fraction(sfreq_to).limit_denominator(1000) / fractions.Fraction(sfreq_from).limit_denominator(1000)
+		self.up = ratio.numerator
+		self.down = ratio.denominator
+		self.n_samples = -((-source.n_samples*self.up) // self.down)
+		self.dtype = numpy.dtype(numpy.float32)
+		# half the filter length of resample_poly in input samples (and some more)
+		self.overlap = (10*max(self.up, self.down)) // self.up + 2
+
+	def get(self, start, stop):
+		stop = min(stop, self.n_samples)
+		source_start = max(0, (start*self.down) // self.up - self.overlap)
+		source_start -= source_start % self.down # keep the polyphase at the same phase
+		source_stop = min(self.source.n_samples, -((-stop*self.down) // self.up) + self.overlap)
+		data = resample_samples(self.source.get(source_start, source_stop), self.sfreq_from, self.sfreq_to)
+		offset = start - (source_start*self.up) // self.down
+		return data[offset:(offset + max(0, stop - start))]
+
+# =============================================================================
+# samples of a source aligned to n_samples of a reference (as
+# align_to_reference), the missing samples are the constant
+# =============================================================================
+class AlignedSource(object):
+	def __init__(self, source, n_samples, offset_samples=0, constant=0):
+		self.source = source
+		self.n_samples = n_samples
+		self.offset_samples = offset_samples
+		self.constant = constant
+		self.dtype = source.dtype
+
+	def get(self, start, stop):
+		import numpy
+		stop = min(stop, self.n_samples)
+		src_start = max(0, start - self.offset_samples)
+		src_stop = min(self.source.n_samples, stop - self.offset_samples)
+		if src_start == start - self.offset_samples and src_stop == stop - self.offset_samples:
+			return self.source.get(src_start, src_stop)
+		aligned = numpy.full(max(0, stop - start), self.constant, dtype=self.dtype)
+		if src_stop > src_start:
+			dst_start = src_start + self.offset_samples - start
+			aligned[dst_start:(dst_start + src_stop - src_start)] = self.source.get(src_start, src_stop)
+		return aligned
+
+# =============================================================================
+# the samples of a source cleaned from the SD card noise (as
+# remove_zmax_sd_card_noise on all of them), the asked samples are extended
+# to the whole chunks of the cleaning
+# =============================================================================
+class CleanedSource(object):
+	def __init__(self, source, sfreq=256.0, chunk_samples=15360):
+		import numpy
+		self.source = source
+		self.sfreq = sfreq
+		self.chunk_samples = chunk_samples
+		self.n_samples = source.n_samples
+		self.dtype = numpy.dtype(numpy.float32)
+
+	def get(self, start, stop):
+		stop = min(stop, self.n_samples)
+		chunk_start = (start // self.chunk_samples) * self.chunk_samples
+		chunk_stop = min(self.n_samples, -((-stop) // self.chunk_samples) * self.chunk_samples)
+		data = remove_zmax_sd_card_noise(self.source.get(chunk_start, chunk_stop), sfreq=self.sfreq, sample_start=chunk_start, chunk_samples=self.chunk_samples, dtype=self.dtype)
+		return data[(start - chunk_start):(stop - chunk_start)]
+
+# =============================================================================
+# the outputs of parse_zmax_ppg of a source (with the digital samples of the
+# one signal of header), the asked samples are extended to the whole chunks
+# and their margins (as parse_zmax_ppg on all of them). The outputs of the
+# last chunks asked for are kept, as the outputs are asked one after the other
+# =============================================================================
+class ParsedPpgSource(object):
+	def __init__(self, source, header, chunk_seconds=60, margin_seconds=10):
+		self.source = source
+		self.header = header
+		self.sfreq = header['sfreq'][0]
+		self.chunk_samples = int(round(chunk_seconds*self.sfreq))
+		self.margin_samples = int(round(margin_seconds*self.sfreq))
+		self.n_samples = source.n_samples
+		self.outputs_range = None
+		self.outputs = None
+
+	def get_outputs(self, start, stop):
+		import numpy
+		stop = min(stop, self.n_samples)
+		chunk_start = (start // self.chunk_samples) * self.chunk_samples
+		chunk_stop = -((-stop) // self.chunk_samples) * self.chunk_samples
+		if self.outputs_range != (chunk_start, chunk_stop):
+			read_start = max(0, chunk_start - self.margin_samples)
+			read_stop = min(self.n_samples, chunk_stop + self.margin_samples)
+			padded = numpy.pad(get_edf_physical_values(self.source.get(read_start, read_stop), self.header), (read_start - (chunk_start - self.margin_samples), (chunk_stop + self.margin_samples) - read_stop), mode='edge')
+			self.outputs = parse_zmax_ppg_padded(padded, sfreq=self.sfreq, chunk_samples=self.chunk_samples, margin_samples=self.margin_samples, dtype=numpy.float32)
+			self.outputs_range = (chunk_start, chunk_stop)
+		return {output: values[(start - chunk_start):(stop - chunk_start)] for output, values in self.outputs.items()}
+
+# =============================================================================
+# one output of a ParsedPpgSource as digital values of header
+# =============================================================================
+class ParsedPpgOutputSource(object):
+	def __init__(self, parsed, output, header):
+		import numpy
+		self.parsed = parsed
+		self.output = output
+		self.header = header
+		self.n_samples = parsed.n_samples
+		self.dtype = numpy.dtype(numpy.float32)
+
+	def get(self, start, stop):
+		import numpy
+		if min(stop, self.n_samples) <= start:
+			return numpy.empty(0, dtype=self.dtype)
+		return get_edf_digital_values(self.parsed.get_outputs(start, stop)[self.output], self.header)
+
+# =============================================================================
+# out-of-core CompactRecording for recordings that do not fit into memory
+# (e.g. multi-day recordings), the channels are sources that are read,
+# aligned and resampled block by block of block_samples only when asked for
+# (hashing, flat channel check, writing), so the memory used is bounded by the
+# block size. The results are the same as the ones of a CompactRecording
+# =============================================================================
+class BlockwiseRecording(CompactRecording):
+	def __init__(self, sfreq, start_datetime, block_samples=153600, temp_dir=None):
+		super().__init__(sfreq, start_datetime)
+		self.block_samples = block_samples
+		self.temp_dir = temp_dir
+		self.digests = {}
+
+	def get_n_samples(self, iCh):
+		return self.data[iCh].n_samples
+
+	def iter_blocks(self, iCh=None):
+		# the blocks at sfreq or in samples of the channel iCh
+		n_samples = self.n_times if iCh is None else self.get_n_samples(iCh)
+		block_samples = self.block_samples if iCh is None else self.to_channel_samples(iCh, self.block_samples)
+		for start in range(0, n_samples, block_samples):
+			yield start, min(start + block_samples, n_samples)
+
+	def get_samples(self, iCh, start=None, stop=None):
+		start = 0 if start is None else start
+		stop = self.get_n_samples(iCh) if stop is None else stop
+		return self.data[iCh].get(start, stop)
+
+	def is_flat(self, iCh, max_not_flat=10):
+		import numpy
+		n = self.get_n_samples(iCh)
+		if n <= 2*(max_not_flat + 1):
+			return super().is_flat(iCh, max_not_flat=max_not_flat)
+		# flat if one value has all but max_not_flat samples (it is then also
+		# the median), stops as soon as there are too many different values
+		counts = collections.Counter()
+		for start, stop in self.iter_blocks(iCh):
+			values, value_counts = numpy.unique(self.get_samples(iCh, start, stop), return_counts=True)
+			counts.update(dict(zip(values.tolist(), value_counts.tolist())))
+			if len(counts) > max_not_flat + 1:
+				return False
+		return max(counts.values()) >= n - max_not_flat
+
+	def resample(self, sfreq):
+		self.data = [ResampledSource(source, sfreq_channel, sfreq) for source, sfreq_channel in zip(self.data, self.sfreqs)]
+		self.sfreq = sfreq
+		self.sfreqs = [sfreq] * len(self.ch_names)
+		return self
+
+	def get_channel_digest(self, iCh, hash_function=hashlib.md5):
+		import numpy
+		key = (self.data[iCh], self.ch_names[iCh], self.sfreqs[iCh], hash_function().name)
+		if key not in self.digests:
+			channel_hash = self.get_channel_hash(iCh, hash_function=hash_function)
+			for start, stop in self.iter_blocks(iCh):
+				channel_hash.update(numpy.ascontiguousarray(self.get_samples(iCh, start, stop)))
+			self.digests[key] = channel_hash.digest()
+		return self.digests[key]
+
+	def close(self):
+		if self.temp_dir is not None:
+			safe_zip_dir_cleanup(self.temp_dir)
+			self.temp_dir = None
+
+# =============================================================================
+# as read_zmax_compact but into a BlockwiseRecording, only the EDF headers are
+# read here
+# =============================================================================
+def read_zmax_blockwise(filepath, sfreq=256.0, block_seconds=600, native_rates=False, zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False, zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache=None, drop_zmax=['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength'], crop_start=None, crop_end=None):
+	path, name, extension = fileparts(filepath)
+	channel_avail_list = get_zmax_channel_avail_list(path)
+	channel_avail_list = zmax_reprocess_channels(filepath, channel_avail_list, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=zmax_ppgparser_native, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=zmax_eegcleaner_native, tool_cache=tool_cache)
+	recording = None
+	channel_read_list = []
+	ppg_parsed = {}
+	for name in channel_avail_list:
+		if name in drop_zmax:
+			continue
+		read_name, native = get_zmax_channel_read_name(path, name)
+		try:
+			edf_source = EdfDigitalSource(path + os.sep + read_name + '.edf', crop_start=crop_start, crop_end=crop_end)
+			header = edf_source.header
+			if native == 'cleaned':
+				source = CleanedSource(edf_source, sfreq=header['sfreq'][0])
+			elif native is not None:
+				if read_name not in ppg_parsed:
+					ppg_parsed[read_name] = ParsedPpgSource(edf_source, header)
+				header = get_zmax_parsed_channel_header(header, native)
+				source = ParsedPpgOutputSource(ppg_parsed[read_name], native, header)
+			else:
+				source = edf_source
+		except Exception:
+			print(traceback.format_exc())
+			print('FAILED TO read in channel: ' + name)
+			continue
+		start_datetime = edf_source.start_datetime.replace(tzinfo=datetime.timezone.utc) # as the meas_date in mne
+		sfreq_channel = header['sfreq'][0]
+		if recording is None:
+			# the first channel sets the start and the number of samples
+			recording = BlockwiseRecording(sfreq, start_datetime, block_samples=int(round(block_seconds*sfreq)))
+			nSamples_should = int(round(source.n_samples * sfreq / sfreq_channel))
+		sfreq_keep = sfreq_channel if (native_rates and sfreq_channel == int(sfreq_channel)) else sfreq
+		if sfreq_channel != sfreq_keep:
+			source = ResampledSource(source, sfreq_channel, sfreq_keep)
+		nSamples_should_channel = int(round(nSamples_should * sfreq_keep / sfreq))
+		offset_samples = int(round((start_datetime - recording.start_datetime).total_seconds() * sfreq_keep))
+		if (source.n_samples != nSamples_should_channel) or (offset_samples != 0):
+			source = AlignedSource(source, nSamples_should_channel, offset_samples=offset_samples, constant=get_edf_digital_zero(header, 0))
+		recording.add_channel(name, source, header['units'][0], header['physical_min'][0], header['physical_max'][0], header['digital_min'][0], header['digital_max'][0], sfreq=sfreq_keep)
+		channel_read_list.append(name)
+
+	print("zmax edf channels found:")
+	print(channel_avail_list)
+	print("zmax edf channels read in:")
+	print(channel_read_list)
+	return recording
+
+# =============================================================================
+# the extracted channel EDFs are kept until the recording is closed
+# =============================================================================
+def read_zmax_blockwise_zipped(filepath, crop_start=None, crop_end=None, scratch_dir=None, verify_crc=False, **kwargs):
+	temp_dir = safe_zip_dir_extract(filepath, crop_start=crop_start, crop_end=crop_end, scratch_dir=scratch_dir, verify_crc=verify_crc)
+	try:
+		recording = read_zmax_blockwise(temp_dir.name + os.sep + "EEG L.edf", **kwargs)
+	except Exception:
+		safe_zip_dir_cleanup(temp_dir)
+		raise
+	if recording is None:
+		safe_zip_dir_cleanup(temp_dir)
+	else:
+		recording.temp_dir = temp_dir
+	return recording
+
+# =============================================================================
+# writes a CompactRecording as EDF+ with the digital values (no conversion to
+# physical values and back), one data record per second with the samples of
+# every channel at its sampling rate, chunk_records data records are
+# assembled at a time. With workers other than 1 (-1 for all cores) the data
+# records of a CompactRecording are filled in by threads into the memory-mapped
+# file (see write_edf_records_mapped), the file is the same
+# =============================================================================
+def write_compact_to_edf(recording, filepath, deidentify=False, chunk_records=64, workers=1):
+	import numpy
+	import pyedflib
+	if workers == 0 or workers < -1:
+		raise ValueError("workers must be a positive number of threads or -1 for all cores, not %d" % workers)
+	path, name, extension = fileparts(filepath)
+	if (extension).lower() != ".edf":
+		warnings.warn("The filepath " + filepath + " does not seem to be an EDF file.")
+	channel_dimensions_zmax = get_zmax_channel_dimensions()
+	nChannels = len(recording.ch_names)
+	n_samps = [int(round(sfreq)) for sfreq in recording.sfreqs]
+	record_offsets = numpy.cumsum([0] + n_samps)
+	edfWriter = pyedflib.EdfWriter(filepath, nChannels, file_type=pyedflib.FILETYPE_EDFPLUS)
+	edf_writer_set_zmax_header(edfWriter, recording.start_datetime, deidentify=deidentify)
+	for iCh, ch_name in enumerate(recording.ch_names):
+		channel_info = {'label': ch_name, 'dimension': channel_dimensions_zmax.get(ch_name, ""), 'sample_rate': n_samps[iCh],
+						'physical_max': recording.physical_max[iCh], 'physical_min': recording.physical_min[iCh],
+						'digital_max': int(recording.digital_max[iCh]), 'digital_min': int(recording.digital_min[iCh]),
+						'prefilter': 'HP:0.1Hz LP:75Hz', 'transducer': 'none'}
+		edfWriter.setSignalHeader(iCh, channel_info)
+		edfWriter.setLabel(iCh, ch_name)
+
+	n_records = min([recording.get_n_samples(iCh) // n_samps[iCh] for iCh in range(nChannels)], default=0) # as pyedflib writeSamples, an incomplete last record is not written
+	if workers != 1 and n_records > 0 and type(recording) is CompactRecording:
+		# pyedflib only writes the header and the first data record (with the
+		# start annotation). A BlockwiseRecording is always written by one
+		# thread, its sources keep state between reads (e.g. the parsed chunk
+		# of a ParsedPpgSource) and are not thread safe
+		edfWriter.blockWriteDigitalShortSamples(numpy.zeros(record_offsets[-1], dtype=numpy.int16))
+		edfWriter.close()
+		return write_edf_records_mapped(recording, filepath, n_records, chunk_records=chunk_records, workers=workers)
+	records = numpy.empty([chunk_records, record_offsets[-1]], dtype=numpy.int16)
+	for rec in range(0, n_records, chunk_records):
+		n = min(chunk_records, n_records - rec)
+		for iCh in range(nChannels):
+			records[:n, record_offsets[iCh]:record_offsets[iCh+1]] = recording.get_digital(iCh, rec*n_samps[iCh], (rec+n)*n_samps[iCh]).reshape(n, n_samps[iCh])
+		for iRecord in range(n):
+			edfWriter.blockWriteDigitalShortSamples(records[iRecord])
+	edfWriter.close()
+	return filepath
+
+# =============================================================================
+# extends an EDF+ written with only its first data record to n_records data
+# records, the size and layout follow from its header. The file is
+# preallocated and memory-mapped, workers threads (-1 for all cores) each copy
+# the digital samples of all channels of chunk_records data records into their
+# slots and the time-keeping TALs of the following data records are written
+# as by pyedflib
+# =============================================================================
+def write_edf_records_mapped(recording, filepath, n_records, chunk_records=64, workers=-1):
+	import numpy
+	with open(filepath, "r+b") as f:
+		header = read_edf_header(f)
+		f.seek(236)
+		f.write(("%-8d" % n_records).encode('ascii'))
+		f.truncate(header['header_bytes'] + n_records*header['record_bytes'])
+	n_samps = header['n_samps']
+	record_offsets = numpy.cumsum([0] + n_samps)
+	mapped = numpy.memmap(filepath, dtype=numpy.uint8, mode='r+', offset=header['header_bytes'], shape=(n_records, header['record_bytes']))
+	records = mapped.view('<i2')
+
+	def fill_records(records, rec):
+		n = min(chunk_records, n_records - rec)
+		for iCh in range(len(n_samps) - 1):
+			records[rec:(rec+n), record_offsets[iCh]:record_offsets[iCh+1]] = recording.get_digital(iCh, rec*n_samps[iCh], (rec+n)*n_samps[iCh]).reshape(n, n_samps[iCh])
+
+	try:
+		annotation_bytes = 2*n_samps[-1]
+		tals = numpy.array([get_edf_record_tal(rec*header['record_length']) for rec in range(1, n_records)], dtype='S%d' % annotation_bytes) # zero padded
+		mapped[1:, (header['record_bytes'] - annotation_bytes):] = tals.view(numpy.uint8).reshape(-1, annotation_bytes)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() if workers == -1 else workers) as executor:
+			for done in executor.map(fill_records, itertools.repeat(records), range(0, n_records, chunk_records)):
+				pass
+	finally:
+		# close the mapping right away (also after an error), an open mapping
+		# keeps the file from being renamed or deleted on Windows
+		mapped.flush()
+		del records, mapped
+	return filepath
+
+# =============================================================================
+#
+# =============================================================================
+def write_compact_to_edf_zipped(recording, zippath, edf_filename=None, compresslevel=6, chunk_records=64, scratch_dir=None, workers=1):
+	temp_dir = tempfile.TemporaryDirectory(dir=scratch_dir)
+	if edf_filename is None:
+		filepath = temp_dir.name + os.sep + fileparts(zippath)[1] + '.edf'
+	else:
+		filepath = temp_dir.name + os.sep + fileparts(edf_filename)[1] + '.edf'
+	write_compact_to_edf(recording, filepath, chunk_records=chunk_records, workers=workers)
+	zip_directory(temp_dir.name, zippath, deletefolder=False, compresslevel=compresslevel)
+	safe_zip_dir_cleanup(temp_dir)
+	return zippath
+
+# =============================================================================
+#
+# =============================================================================
+def raw_zmax_data_quality(raw):
+		# the last second of Battery voltage
+		import numpy
+		quality = None
+		try:
+			quality = float(numpy.mean(raw.get_data(picks=['BATT'], start=max(0, raw.n_times-256))[0]))
+		except Exception:
+			print(traceback.format_exc())
+		return quality
+
+# =============================================================================
+# signal quality of all channels of a raw or a (compact) recording in one
+# pass over blocks of block_seconds (all channels of a block at once): the
+# minimum and maximum, the part of the samples that are clipped (at the
+# digital minimum or maximum, only known for a CompactRecording), the part of
+# the samples that are equal to the one before (flat), the rms, and the part
+# of the power (in 1 s segments) at the line frequencies. The values are in
+# the units of the channels (e.g. uV). Returns the rows per channel and the
+# battery discharge curve (start seconds and mean BATT voltage of every
+# battery_interval_seconds)
+# =============================================================================
+def get_zmax_channel_quality(recording, block_seconds=600, line_frequencies=(50.0, 60.0), battery_interval_seconds=60):
+	import numpy
+	import scipy.fft
+	ch_names = list(recording.ch_names)
+	sfreq = recording.sfreq if hasattr(recording, 'sfreq') else recording.info['sfreq']
+	sfreqs = recording.sfreqs if isinstance(recording, CompactRecording) else [sfreq] * len(ch_names)
+	units = recording.units if isinstance(recording, CompactRecording) else [get_zmax_channel_dimensions().get(ch_name, '') for ch_name in ch_names]
+	factors = numpy.array([CompactRecording.unit_factors.get(unit, 1.0) for unit in units])[:, numpy.newaxis]
+	n_channels = len(ch_names)
+	n_times = recording.n_times
+	block_samples = max(1, int(round(block_seconds))) * int(round(sfreq))
+	if isinstance(recording, CompactRecording):
+		# half a digital step inside the physical range
+		steps = numpy.array([recording.get_scale_offset(iCh)[0] for iCh in range(n_channels)])
+		clip_low = numpy.array(recording.physical_min) + steps/2
+		clip_high = numpy.array(recording.physical_max) - steps/2
+	battery_index = ch_names.index('BATT') if 'BATT' in ch_names else None
+	battery_curve = []
+
+	n_samples = numpy.zeros(n_channels, dtype=numpy.int64)
+	minimum = numpy.full(n_channels, numpy.inf)
+	maximum = numpy.full(n_channels, -numpy.inf)
+	n_clipped = numpy.zeros(n_channels, dtype=numpy.int64)
+	n_flat = numpy.zeros(n_channels, dtype=numpy.int64)
+	sum_squares = numpy.zeros(n_channels)
+	line_power = numpy.zeros((n_channels, len(line_frequencies)))
+	total_power = numpy.zeros(n_channels)
+	# the channels of one sampling rate at a time (see --native_rates)
+	for sfreq_group in sorted(set(sfreqs)):
+		picks = [iCh for iCh in range(n_channels) if sfreqs[iCh] == sfreq_group]
+		segment_samples = int(round(sfreq_group))
+		line_bins = [int(round(f * segment_samples / sfreq_group)) if f < sfreq_group/2 else None for f in line_frequencies]
+		battery_interval_samples = max(1, int(round(battery_interval_seconds*sfreq_group)))
+		battery_sums = numpy.zeros(-(-int(round(n_times * sfreq_group / sfreq)) // battery_interval_samples))
+		battery_counts = numpy.zeros(len(battery_sums))
+		power = numpy.zeros((len(picks), segment_samples//2 + 1))
+		last = None
+		group_start = 0
+		for start in range(0, n_times, block_samples):
+			stop = min(start + block_samples, n_times)
+			data = recording.get_data(picks=picks, start=start, stop=stop) / factors[picks]
+			if data.shape[1] == 0:
+				continue
+			n_samples[picks] += data.shape[1]
+			minimum[picks] = numpy.minimum(minimum[picks], data.min(axis=1))
+			maximum[picks] = numpy.maximum(maximum[picks], data.max(axis=1))
+			if isinstance(recording, CompactRecording):
+				n_clipped[picks] += numpy.count_nonzero((data <= clip_low[picks, numpy.newaxis]) | (data >= clip_high[picks, numpy.newaxis]), axis=1)
+			n_flat[picks] += numpy.count_nonzero(data[:, 1:] == data[:, :-1], axis=1)
+			if last is not None:
+				n_flat[picks] += data[:, 0] == last
+			last = data[:, -1]
+			sum_squares[picks] += numpy.einsum('ij,ij->i', data, data)
+			n_segments = data.shape[1] // segment_samples
+			if n_segments > 0:
+				segments = data[:, :(n_segments*segment_samples)].reshape(len(picks), n_segments, segment_samples)
+				segments = segments - segments.mean(axis=2, keepdims=True)
+				power += (numpy.abs(scipy.fft.rfft(segments, axis=2, workers=-1))**2).sum(axis=1)
+			if battery_index in picks:
+				interval = numpy.arange(group_start, group_start + data.shape[1]) // battery_interval_samples
+				battery_sums += numpy.bincount(interval, weights=data[picks.index(battery_index)], minlength=len(battery_sums))[:len(battery_sums)]
+				battery_counts += numpy.bincount(interval, minlength=len(battery_counts))[:len(battery_counts)]
+			group_start += data.shape[1]
+		total_power[picks] = power[:, 1:].sum(axis=1)
+		for iLine, line_bin in enumerate(line_bins):
+			line_power[picks, iLine] = power[:, line_bin] if line_bin is not None else numpy.nan
+		if battery_index in picks:
+			battery_curve = [(i*battery_interval_samples/sfreq_group, float(battery_sums[i]/battery_counts[i])) for i in range(len(battery_sums)) if battery_counts[i] > 0]
+
+	rows = []
+	for iCh, ch_name in enumerate(ch_names):
+		row = {'channel': ch_name, 'unit': units[iCh], 'n_samples': int(n_samples[iCh])}
+		if n_samples[iCh] > 0:
+			row.update({'min': float(minimum[iCh]), 'max': float(maximum[iCh]), 'flat_fraction': n_flat[iCh] / n_samples[iCh], 'rms': float(numpy.sqrt(sum_squares[iCh] / n_samples[iCh]))})
+			row['clipping_fraction'] = n_clipped[iCh] / n_samples[iCh] if isinstance(recording, CompactRecording) else 'not_computed'
+		for iLine, f in enumerate(line_frequencies):
+			row['line_noise_%gHz_fraction' % f] = float(line_power[iCh, iLine] / total_power[iCh]) if (not numpy.isnan(line_power[iCh, iLine]) and total_power[iCh] > 0) else 'not_computed'
+		rows.append(row)
+	return rows, battery_curve
+
+def get_dir_path(pathstring):
+	pathstring = os.path.normpath(pathstring)
+	if os.path.isdir(pathstring):
+		return pathstring
+	elif os.path.isfile(pathstring):
+		p, n, e = fileparts(pathstring)
+		return p + os.sep + n
+	else:
+		p, n, e = fileparts(pathstring)
+		if e:
+			return p + os.sep + n
+		else:
+			return pathstring
+		print("'%s' is not a file or directory" % pathstring)
+		raise Exception(pathstring)
+	return None
+
+def nullable_string(val):
+	if not val:
+		return None
+	return val
+
+def path_in_dir(pathstring, cwd=None):
+	# a relative path is taken relative to cwd instead of the working directory of the process
+	if (cwd is None) or (not nullable_string(pathstring)) or os.path.isabs(pathstring):
+		return pathstring
+	return os.path.join(cwd, pathstring)
+
+def path_type_in_dir(path_type, cwd=None):
+	if cwd is None:
+		return path_type
+	def path_type_relative(pathstring):
+		return path_type(path_in_dir(pathstring, cwd))
+	path_type_relative.__name__ = path_type.__name__
+	return path_type_relative
+
+def dir_path_or_file(pathstring):
+	pathstring = os.path.normpath(pathstring)
+	if nullable_string(pathstring):
+		if os.path.isdir(pathstring):
+			return pathstring
+		if os.path.isfile(pathstring):
+			return pathstring
+		else:
+			print("'%s' is not a directory or file" % pathstring)
+			raise NotADirectoryError(pathstring)
+	return None
+
+def dir_path(pathstring):
+	pathstring = os.path.normpath(pathstring)
+	if nullable_string(pathstring):
+		if os.path.isdir(pathstring):
+			return pathstring
+		else:
+			print("'%s' is not a directory" % pathstring)
+			raise NotADirectoryError(pathstring)
+	return None
+
+def dir_path_new(pathstring):
+	pathstring = os.path.normpath(pathstring)
+	if nullable_string(pathstring):
+		return pathstring
+	return None
+
+def file_path(pathstring):
+	pathstring = os.path.normpath(pathstring)
+	if nullable_string(pathstring):
+		if os.path.isfile(pathstring):
+			return pathstring
+		else:
+			print("'%s' is not a file" % pathstring)
+			raise NotADirectoryError(pathstring)
+	return None
+
+def dir_path_create(pathstring):
+	if nullable_string(pathstring):
+		try:
+			pathstring = dir_path(pathstring)
+			return pathstring
+		except NotADirectoryError:
+			try:
+				os.makedirs(pathstring, exist_ok=True)
+				print("Directory '%s' was not existent and was created" %pathstring)
+			except:
+				print("Directory '%s' was could not be created" %pathstring)
+				NotADirectoryError(pathstring)
+			finally:
+				return nullable_string(pathstring)
+	else:
+		return None
+
+# =============================================================================
+# 
+# =============================================================================
+def find_zmax_files(parentdirpath, readzip=False, zipfile_match_string='', zipfile_nonmatch_string='', find_hyp_files=False):
+	"""
 	finds all the zmax data from different wearables in the HB file structure given the parent path to the subject files
 	:param wearable:
 	:return:
@@ -597,25 +2401,1569 @@ def path_create(path, isFile=False):
 		path, name, extension = fileparts(path)
 	if not os.path.exists(path):
 		os.makedirs(path)
-
-if __name__ == "__main__":
-
-	# determine if application is a script file or frozen exe
+# =============================================================================
+# determine if application is a script file or frozen exe
+# =============================================================================
+def get_application_path():
 	application_path = ''
 	if getattr(sys, 'frozen', False):
 		application_path = os.path.dirname(sys.executable)
 	elif __file__:
 		application_path = os.path.dirname(__file__)
+	return application_path
+
+def get_summary_header():
+	return ['file_number', 'conversion_status', 'conversion_datetime', 'zmax_file_path_original_outer', 'zmax_file_path_original', 'hash_zmax_file_path_original_md5', 'converted_file_path', 'hash_converted_file_path_md5', 'rec_start_datetime', 'rec_stop_datetime', 'rec_duration_datetime', 'rec_duration_seconds', 'rec_duration_original_samples', 'rec_battery_at_end_voltage', 'hash_signals_before_conversion', 'hash_signals_after_conversion', 'fingerprint_preload', 'verify_status', 'eeg_cleaner', 'ppg_parser', 'channels']
+
+# =============================================================================
+# the columns of the channel quality and the battery curve sidecar csv files
+# (see get_zmax_channel_quality), the first ones refer to the summary row
+# =============================================================================
+def get_quality_header(line_frequencies=(50.0, 60.0)):
+	return ['file_number', 'zmax_file_path_original', 'converted_file_path', 'channel', 'unit', 'n_samples', 'min', 'max', 'clipping_fraction', 'flat_fraction', 'rms'] + ['line_noise_%gHz_fraction' % f for f in line_frequencies]
+
+def get_battery_curve_header():
+	return ['file_number', 'zmax_file_path_original', 'converted_file_path', 'rec_seconds', 'battery_voltage']
+
+def get_battery_curve_filepath(filepath_quality_csv):
+	path, name, extension = fileparts(filepath_quality_csv)
+	return path + os.sep + name + '_battery' + (extension if extension else '.csv')
+
+# =============================================================================
+# mark for each row the (first) file_number of another row that is a duplicate
+# in the column, either for equal values or for numbers that are exactly
+# number_offset larger (e.g. recordings from different HDRecorder versions)
+# =============================================================================
+def summary_find_duplicates(df_csv_in, column, duplicate_column, number_offset=None):
+	import numpy
+	df_csv_in_sorted = df_csv_in.sort_values(by=[column],ascending=True)
+	df_csv_in_sorted[duplicate_column] = numpy.nan
+	df_len = len(df_csv_in_sorted.index)
+	for iRow in range(0,df_len,1):
+		row = df_csv_in_sorted.iloc[iRow, :]
+		value = row[column]
+		if number_offset is None:
+			if (value is None) or (value == 'not_computed'):
+				break
+		else:
+			if (value is None) or value is numpy.nan:
+				break
+		for iRow2 in range(iRow+1,df_len,1):
+			row2 = df_csv_in_sorted.iloc[iRow2, :]
+			value2 = row2[column]
+			if number_offset is None:
+				is_duplicate = value2 == value
+			else:
+				if value2 > (value + 5*256):
+					break
+				is_duplicate = value2 == (value + number_offset)
+			if is_duplicate:
+				df_csv_in_sorted.iloc[iRow, df_csv_in_sorted.columns.get_loc(duplicate_column)] = row2["file_number"]
+				df_csv_in_sorted.iloc[iRow2, df_csv_in_sorted.columns.get_loc(duplicate_column)] = row["file_number"]
+				break
+	return df_csv_in_sorted.sort_values(by=['file_number'],ascending=True)
+
+# =============================================================================
+# adds the duplicates_in_* columns to a (finished) summary csv file
+# =============================================================================
+def summary_csv_add_duplicates(filepath_csv_summary_file):
+	import pandas
+	df_csv_in = pandas.read_csv(filepath_csv_summary_file, quoting=csv.QUOTE_NONNUMERIC)
+	df_csv_in = summary_find_duplicates(df_csv_in, 'rec_duration_original_samples', "duplicates_in_duration", number_offset=0)
+	df_csv_in = summary_find_duplicates(df_csv_in, 'rec_duration_original_samples', "duplicates_in_duration_different_conversion", number_offset=5*256)
+	df_csv_in = summary_find_duplicates(df_csv_in, 'hash_zmax_file_path_original_md5', "duplicates_in_hash_zmax_file_path_original_md5")
+	df_csv_in = summary_find_duplicates(df_csv_in, 'hash_converted_file_path_md5', "duplicates_in_hash_converted_file_path_md5")
+	df_csv_in = summary_find_duplicates(df_csv_in, 'hash_signals_before_conversion', "duplicates_in_hash_signals_before_conversion")
+	df_csv_in = summary_find_duplicates(df_csv_in, 'hash_signals_after_conversion', "duplicates_in_hash_signals_after_conversion")
+	if 'fingerprint_preload' in df_csv_in.columns: # summary files of earlier versions
+		df_csv_in = summary_find_duplicates(df_csv_in, 'fingerprint_preload', "duplicates_in_fingerprint_preload")
+	df_csv_in.to_csv(filepath_csv_summary_file, mode='w', index=False, header=True, quoting=csv.QUOTE_NONNUMERIC)
+	return df_csv_in
+
+# =============================================================================
+# persistent summary database (sqlite) across runs, every new row is checked
+# for duplicates with index lookups when it is inserted, the duplicates_in_*
+# columns refer to the summary_id of the other row
+# =============================================================================
+class SummaryStore(object):
+	duplicate_columns = [('rec_duration_original_samples', 'duplicates_in_duration'), ('rec_duration_original_samples', 'duplicates_in_duration_different_conversion'), ('hash_zmax_file_path_original_md5', 'duplicates_in_hash_zmax_file_path_original_md5'), ('hash_converted_file_path_md5', 'duplicates_in_hash_converted_file_path_md5'), ('hash_signals_before_conversion', 'duplicates_in_hash_signals_before_conversion'), ('hash_signals_after_conversion', 'duplicates_in_hash_signals_after_conversion'), ('fingerprint_preload', 'duplicates_in_fingerprint_preload')]
+	index_columns = ['hash_zmax_file_path_original_md5', 'hash_converted_file_path_md5', 'hash_signals_before_conversion', 'hash_signals_after_conversion', 'rec_duration_original_samples', 'fingerprint_preload']
+
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.connection = sqlite3.connect(filepath, timeout=60)
+		self.columns = ['summary_id', 'summary_csv'] + get_summary_header() + [c for _, c in self.duplicate_columns]
+		self.create()
+
+	def create(self):
+		column_definitions = ['summary_id INTEGER PRIMARY KEY AUTOINCREMENT', 'summary_csv TEXT']
+		for column in get_summary_header() + [c for _, c in self.duplicate_columns]:
+			if column in ['file_number', 'rec_duration_original_samples'] or column.startswith('duplicates_in_'):
+				column_definitions.append('"%s" INTEGER' % column)
+			elif column in ['rec_duration_seconds', 'rec_battery_at_end_voltage']:
+				column_definitions.append('"%s" REAL' % column)
+			else:
+				column_definitions.append('"%s" TEXT' % column)
+		with self.connection:
+			self.connection.execute('CREATE TABLE IF NOT EXISTS summary (%s)' % ', '.join(column_definitions))
+			# add the columns that are missing in databases of earlier versions
+			existing_columns = [r[1] for r in self.connection.execute('PRAGMA table_info(summary)')]
+			for column, column_definition in zip(self.columns, column_definitions):
+				if column not in existing_columns:
+					self.connection.execute('ALTER TABLE summary ADD COLUMN %s' % column_definition)
+			for column in self.index_columns:
+				self.connection.execute('CREATE INDEX IF NOT EXISTS "idx_summary_%s" ON summary ("%s")' % (column, column))
+
+	@staticmethod
+	def to_db(value):
+		if hasattr(value, 'item'): # numpy scalars
+			value = value.item()
+		if value is None or isinstance(value, (int, float, str)):
+			return value
+		return str(value)
+
+	def find_duplicate(self, column, value):
+		value = self.to_db(value)
+		if value is None or value in ['not_computed', 'not_retrieved', '']:
+			return None
+		found = self.connection.execute('SELECT summary_id FROM summary WHERE "%s" = ? ORDER BY summary_id LIMIT 1' % column, (value,)).fetchone()
+		return None if found is None else found[0]
+
+	def find_duplicates(self, row):
+		duplicates = {}
+		n_samples = self.to_db(row.get('rec_duration_original_samples'))
+		for column, duplicate_column in self.duplicate_columns:
+			if duplicate_column == 'duplicates_in_duration_different_conversion':
+				duplicate = None
+				if n_samples is not None:
+					duplicate = self.find_duplicate(column, n_samples + 5*256)
+					if duplicate is None:
+						duplicate = self.find_duplicate(column, n_samples - 5*256)
+			else:
+				duplicate = self.find_duplicate(column, row.get(column))
+			duplicates[duplicate_column] = duplicate
+		return duplicates
+
+	# =========================================================================
+	# inserts a summary row (dict of the summary header), marks duplicates in
+	# the new and (if not yet marked) in the found row, returns the duplicates
+	# =========================================================================
+	def insert(self, row, summary_csv=None):
+		with self.connection:
+			duplicates = self.find_duplicates(row)
+			values = [None, summary_csv] + [self.to_db(row.get(c)) for c in get_summary_header()] + [duplicates[c] for _, c in self.duplicate_columns]
+			cursor = self.connection.execute('INSERT INTO summary (%s) VALUES (%s)' % (', '.join('"%s"' % c for c in self.columns), ', '.join('?' * len(self.columns))), values)
+			summary_id = cursor.lastrowid
+			for duplicate_column, duplicate in duplicates.items():
+				if duplicate is not None:
+					self.connection.execute('UPDATE summary SET "%s" = ? WHERE summary_id = ? AND "%s" IS NULL' % (duplicate_column, duplicate_column), (summary_id, duplicate))
+		return summary_id, duplicates
+
+	def export_csv(self, filepath_csv):
+		cursor = self.connection.execute('SELECT %s FROM summary ORDER BY summary_id' % ', '.join('"%s"' % c for c in self.columns))
+		with open(filepath_csv, 'w', newline='') as f:
+			writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+			writer.writerow(self.columns)
+			for row in cursor:
+				writer.writerow(['' if v is None else v for v in row])
+		return filepath_csv
+
+	def close(self):
+		self.connection.close()
+
+# =============================================================================
+# run journal (json lines) that records the completed stages of every
+# recording, so that an interrupted batch run can be resumed: finished
+# recordings are skipped, the temporary files of unfinished ones are removed
+# and the rows are appended to the summary csv of the first run
+# =============================================================================
+class RunJournal(object):
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.journal_file = None
+		self.summary_csv = None
+		self.done = {}
+		self.temp_paths = {}
+		if os.path.isfile(filepath):
+			self.load()
+
+	def load(self):
+		with open(self.filepath, 'r', encoding='utf-8') as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					continue # the last line of an interrupted run can be incomplete
+				if record.get('event') == 'run':
+					if self.summary_csv is None:
+						self.summary_csv = record.get('summary_csv')
+				elif record.get('event') == 'stage':
+					key = record['key']
+					if record['stage'] == 'done':
+						self.done[key] = record
+						self.temp_paths.pop(key, None)
+					elif record.get('temp_paths'):
+						self.temp_paths.setdefault(key, []).extend(record['temp_paths'])
+
+	def is_open(self):
+		return self.journal_file is not None
+
+	def open(self, summary_csv):
+		self.journal_file = open(self.filepath, 'a', encoding='utf-8')
+		self.write({'event': 'run', 'summary_csv': summary_csv, 'started': datetime.datetime.now().isoformat()})
+		if self.summary_csv is None:
+			self.summary_csv = summary_csv
+
+	def write(self, record):
+		self.journal_file.write(json.dumps(record) + '\n')
+		self.journal_file.flush()
+		os.fsync(self.journal_file.fileno())
+
+	@staticmethod
+	def get_key(job):
+		# the export path of .hyp conversions is stable while their extracted files are not
+		return job.filepath_outer + '|' + (job.export_filepath if job.export_filepath is not None else job.filepath)
+
+	def is_done(self, job):
+		return self.get_key(job) in self.done
+
+	def record_stage(self, job, stage, temp_paths=None):
+		record = {'event': 'stage', 'key': self.get_key(job), 'stage': stage, 'file_number': job.file_number, 'conversion_status': job.conversion_status}
+		if temp_paths:
+			record['temp_paths'] = temp_paths
+		if stage == 'done':
+			record['fingerprint_preload'] = job.fingerprint_preload
+			self.done[record['key']] = record
+			self.temp_paths.pop(record['key'], None)
+		elif temp_paths:
+			self.temp_paths.setdefault(record['key'], []).extend(temp_paths)
+		self.write(record)
+
+	def get_stale_temp_paths(self):
+		return [temp_path for temp_paths in self.temp_paths.values() for temp_path in temp_paths]
+
+	def close(self):
+		if self.journal_file is not None:
+			self.journal_file.close()
+			self.journal_file = None
 
+# =============================================================================
+# work queue on a shared file system (no service needed) for several nodes
+# converting the same archive: a node claims a recording by creating its lock
+# file exclusively (O_EXCL), keeps the lease by touching the lock file
+# (heartbeat) and marks it done when finished. Lock files that were not
+# touched for lease_seconds (e.g. of a crashed node) are reclaimed by renaming
+# them (only one node can succeed) and checking that the renamed lock is still
+# the expired one (else it is put back). The times are compared to the mtime of the
+# node file, i.e. to the clock of the file server. Each node writes its own
+# summary shard that are merged into one summary in the end
+# =============================================================================
+class WorkQueue(object):
+	def __init__(self, queue_dirpath, node_id=None, lease_seconds=600, heartbeat_seconds=None):
+		self.queue_dirpath = queue_dirpath
+		self.node_id = "%s_%d" % (socket.gethostname(), os.getpid()) if node_id is None else node_id
+		self.lease_seconds = lease_seconds
+		self.heartbeat_seconds = max(1.0, lease_seconds / 4.0) if heartbeat_seconds is None else heartbeat_seconds
+		self.token = "%s_%s" % (self.node_id, hashlib.md5(os.urandom(16)).hexdigest())
+		for subdir in ['locks', 'done', 'nodes', 'summaries']:
+			os.makedirs(os.path.join(queue_dirpath, subdir), exist_ok=True)
+		self.node_filepath = os.path.join(queue_dirpath, 'nodes', self.node_id + '.alive')
+		self.claimed = {}
+		self.lock = threading.Lock()
+		self.heartbeat_stop = threading.Event()
+		self.heartbeat_thread = None
+
+	@staticmethod
+	def get_key(job):
+		# relative to the parent path, so that nodes can mount the archive at different paths
+		base_dirpath = job.parentdirpath if os.path.isdir(job.parentdirpath) else os.path.dirname(job.parentdirpath)
+		return os.path.relpath(job.filepath_outer, base_dirpath) + '|' + os.path.relpath(job.export_filepath if job.export_filepath is not None else job.filepath, base_dirpath)
+
+	def get_item_name(self, key):
+		return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+	def get_lock_filepath(self, key):
+		return os.path.join(self.queue_dirpath, 'locks', self.get_item_name(key) + '.lock')
+
+	def get_done_filepath(self, key):
+		return os.path.join(self.queue_dirpath, 'done', self.get_item_name(key) + '.done')
+
+	def get_summary_shard_filepath(self):
+		return os.path.join(self.queue_dirpath, 'summaries', 'summary_' + self.node_id + '_' + datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f") + '.csv')
+
+	def touch_node(self):
+		# the current time of the file server
+		with open(self.node_filepath, 'a'):
+			pass
+		os.utime(self.node_filepath)
+		return os.path.getmtime(self.node_filepath)
+
+	def start_heartbeat(self):
+		if self.heartbeat_thread is None:
+			self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+			self.heartbeat_thread.start()
+
+	def heartbeat(self):
+		while not self.heartbeat_stop.wait(self.heartbeat_seconds):
+			with self.lock:
+				self.touch_node()
+				for key, lock_filepath in list(self.claimed.items()):
+					# after a reclaim the same path holds the lock of the other node
+					if self.read_lock(lock_filepath).get('token') == self.token:
+						try:
+							os.utime(lock_filepath)
+							continue
+						except FileNotFoundError:
+							pass
+					print('LOST the lease of the work queue item (reclaimed by another node): %s' % key)
+					del self.claimed[key]
+
+	def read_lock(self, lock_filepath):
+		try:
+			with open(lock_filepath, 'r', encoding='utf-8') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def reclaim_if_expired(self, key):
+		lock_filepath = self.get_lock_filepath(key)
+		try:
+			age = self.touch_node() - os.path.getmtime(lock_filepath)
+		except FileNotFoundError:
+			return True
+		if age < self.lease_seconds:
+			return False
+		token_expired = self.read_lock(lock_filepath).get('token')
+		reclaim_filepath = lock_filepath + '.reclaim_' + self.token
+		try:
+			os.rename(lock_filepath, reclaim_filepath)
+		except FileNotFoundError:
+			return False # another node was faster
+		# another node might have reclaimed the item between the check and the
+		# rename, then the renamed file is its fresh lock and is put back
+		lock_renamed = self.read_lock(reclaim_filepath)
+		try:
+			age_renamed = self.touch_node() - os.path.getmtime(reclaim_filepath)
+		except FileNotFoundError:
+			return False
+		if age_renamed < self.lease_seconds or lock_renamed.get('token') != token_expired:
+			try:
+				os.link(reclaim_filepath, lock_filepath)
+			except FileExistsError:
+				pass # yet another node holds the item now, the node of the renamed lock notices the lost lease
+			os.remove(reclaim_filepath)
+			return False
+		print('RECLAIMING the work queue item of node %s (lease expired %d s ago): %s' % (lock_renamed.get('node_id'), age_renamed - self.lease_seconds, key))
+		os.remove(reclaim_filepath)
+		return True
+
+	# =========================================================================
+	# returns 'claimed', 'done' (by any node) or 'locked' (by another node)
+	# =========================================================================
+	def claim(self, key):
+		if os.path.exists(self.get_done_filepath(key)):
+			return 'done'
+		lock_filepath = self.get_lock_filepath(key)
+		for attempt in range(2):
+			try:
+				fd = os.open(lock_filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			except FileExistsError:
+				if attempt == 0 and self.reclaim_if_expired(key):
+					continue
+				return 'locked'
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				json.dump({'node_id': self.node_id, 'token': self.token, 'key': key, 'claimed': datetime.datetime.now().isoformat()}, f)
+			break
+		if os.path.exists(self.get_done_filepath(key)):
+			# finished by another node in the meantime
+			os.remove(lock_filepath)
+			return 'done'
+		with self.lock:
+			self.claimed[key] = lock_filepath
+		self.start_heartbeat()
+		return 'claimed'
+
+	def is_claimed(self, key):
+		return key in self.claimed
+
+	def holds_lease(self, key):
+		# checks the lock file itself, the heartbeat might not have noticed a reclaim yet
+		with self.lock:
+			lock_filepath = self.claimed.get(key)
+			if lock_filepath is not None and self.read_lock(lock_filepath).get('token') == self.token:
+				return True
+			if lock_filepath is not None:
+				print('LOST the lease of the work queue item (reclaimed by another node): %s' % key)
+				del self.claimed[key]
+			return False
+
+	def release(self, key):
+		with self.lock:
+			lock_filepath = self.claimed.pop(key, None)
+			# do not remove the lock of another node that reclaimed the item
+			if lock_filepath is not None and self.read_lock(lock_filepath).get('token') == self.token:
+				os.remove(lock_filepath)
+
+	def complete(self, key, conversion_status):
+		done_filepath = self.get_done_filepath(key)
+		with open(done_filepath + '.' + self.token, 'w', encoding='utf-8') as f:
+			json.dump({'node_id': self.node_id, 'key': key, 'conversion_status': conversion_status, 'finished': datetime.datetime.now().isoformat()}, f)
+		os.replace(done_filepath + '.' + self.token, done_filepath)
+		self.release(key)
+
+	def close(self):
+		# unfinished items can be claimed right away by the other nodes
+		self.heartbeat_stop.set()
+		if self.heartbeat_thread is not None:
+			self.heartbeat_thread.join()
+			self.heartbeat_thread = None
+		for key in list(self.claimed.keys()):
+			self.release(key)
+
+	# =========================================================================
+	# merges the summary shards of all nodes into one summary csv, the rows
+	# are renumbered (file_number) and checked for duplicates across nodes
+	# =========================================================================
+	def merge_summaries(self, filepath_csv):
+		import pandas
+		header = get_summary_header()
+		shards = [pandas.read_csv(shard_filepath, quoting=csv.QUOTE_NONNUMERIC) for shard_filepath in sorted(glob.glob(os.path.join(self.queue_dirpath, 'summaries', '*.csv')))]
+		shards = [df_shard.reindex(columns=header) for df_shard in shards if len(df_shard.index) > 0]
+		if not shards:
+			print('no summary shards with rows found in ' + self.queue_dirpath)
+			return None
+		df_summary = pandas.concat(shards, ignore_index=True).sort_values(by=['conversion_datetime'], kind='stable')
+		df_summary['file_number'] = range(1, len(df_summary.index) + 1)
+		df_summary.to_csv(filepath_csv, mode='w', index=False, header=True, quoting=csv.QUOTE_NONNUMERIC)
+		summary_csv_add_duplicates(filepath_csv)
+		return filepath_csv
+
+# =============================================================================
+# one recording (i.e. one folder of zmax EDFs or one zip file) to convert,
+# holds the merged data in memory as long as needed and the summary values
+# =============================================================================
+class ConversionJob(object):
+	def __init__(self, filepath, filepath_outer=None, parentdirpath=None, read_zip=False, export_filepath=None, file_number=None, conversion_datetime=None, index=0, total=1):
+		self.filepath = filepath
+		self.filepath_outer = filepath if filepath_outer is None else filepath_outer
+		self.parentdirpath = parentdirpath
+		self.read_zip = read_zip
+		self.export_filepath = export_filepath
+		self.file_number = file_number
+		self.conversion_datetime = datetime.datetime.now() if conversion_datetime is None else conversion_datetime
+		self.index = index
+		self.total = total
+
+		self.raw = None
+		self.recording = None
+		self.skipped = False
+		self.export_filepath_final = ''
+		self.export_filepath_final_to_rename = None
+		self.rm_dir_list = []
+
+		self.conversion_status = 'not_converted'
+		self.md5_signal_hash_before_conversion = 'not_computed'
+		self.md5_file_original_hash = 'not_computed'
+		self.md5_signal_hash_after_conversion = 'not_computed'
+		self.md5_file_converted_hash = 'not_computed'
+		self.rec_start_datetime = 'not_retrieved'
+		self.rec_stop_datetime = 'not_retrieved'
+		self.rec_duration_datetime = 'not_retrieved'
+		self.rec_battery_at_end = 'not_retrieved'
+		self.rec_duration_seconds = None
+		self.rec_n_samples = None
+		self.summary_id = None
+		self.duplicates = {}
+		self.fingerprint_preload = 'not_computed'
+		self.verify_status = 'not_verified'
+		self.eeg_cleaner = 'none'
+		self.ppg_parser = 'none'
+		self.channels = 'not_retrieved'
+		self.verify_results = {}
+		self.channel_quality = []
+		self.battery_curve = []
+
+	def progress(self):
+		return "%d of %d: '%s' " % (self.index+1, self.total, self.filepath)
+
+	def get_data(self, picks=None):
+		# the merged signals as a (channels x samples) array
+		if self.recording is not None:
+			return self.recording.get_data(picks=picks)
+		if self.raw is None:
+			return None
+		return self.raw.get_data(picks=picks)
+
+	def get_metadata(self):
+		return dict(zip(get_summary_header(), self.summary_row()))
+
+	def summary_row(self):
+		return [self.file_number, self.conversion_status, self.conversion_datetime, self.filepath_outer, self.filepath, self.md5_file_original_hash, self.export_filepath_final, self.md5_file_converted_hash, self.rec_start_datetime, self.rec_stop_datetime, self.rec_duration_datetime, self.rec_duration_seconds, self.rec_n_samples, self.rec_battery_at_end, self.md5_signal_hash_before_conversion, self.md5_signal_hash_after_conversion, self.fingerprint_preload, self.verify_status, self.eeg_cleaner, self.ppg_parser, self.channels]
+
+# =============================================================================
+# runs the discovery, reading, merging, hashing and writing of zmax recordings
+# as composable calls, the command line interface is a thin wrapper around it
+# =============================================================================
+class Converter(object):
+	def __init__(self, write_redirection_path=None, read_zip=False, zipfile_match_string='', zipfile_nonmatch_string='',
+			zmax_ppgparser=False, zmax_ppgparser_exe_path=None, zmax_ppgparser_timeout_seconds=None, zmax_ppgparser_native=False,
+			zmax_edfjoin=False, zmax_edfjoin_exe_path=None, zmax_edfjoin_timeout_seconds=None, zmax_edfjoin_native=False,
+			zmax_eegcleaner=False, zmax_eegcleaner_exe_path=None, zmax_eegcleaner_timeout_seconds=None, zmax_eegcleaner_native=False, tool_cache_dir=None, tool_cache_max_GB=10.0,
+			output_store_dir=None, output_store_cleanup=False, inventory=False,
+			zmax_raw_hyp_file=False, zmax_hdrecorder_exe_path=None, zmax_hdrecorder_timeout_seconds=None, zmax_raw_hyp_keep_edf=False,
+			write_name_postfix="_merged", temp_file_postfix="_TEMP_", scratch_dir=None, fsync='none', resample_Hz=None, crop_start=None, crop_end=None,
+			zmax_lite=False, read_only_EEG=False, read_only_EEG_BATT=False, no_write=False, no_overwrite=False,
+			no_summary_csv=False, no_file_hashing=False, no_signal_hashing=False, exclude_empty_channels=False, write_zip=False, verify=False, quality_csv=None, compact=False, out_of_core=False, block_seconds=600, native_rates=False, write_workers=1,
+			file_hash_mode='full', verify_zip_crc=False, summary_db=None, skip_duplicate_fingerprints=False, resume=None, work_queue=None, work_queue_node_id=None, work_queue_lease_seconds=600, application_path=None, filepath_csv_summary_file=None, keep_raw=False, cwd=None):
+		if application_path is None:
+			application_path = get_application_path()
+		self.application_path = application_path
+		# relative paths are taken relative to cwd (e.g. of the client of a server job) instead of the working directory of the process
+		self.cwd = cwd
+		write_redirection_path, tool_cache_dir, output_store_dir, scratch_dir, quality_csv, summary_db, resume, work_queue, filepath_csv_summary_file = [path_in_dir(pathstring, cwd) for pathstring in (write_redirection_path, tool_cache_dir, output_store_dir, scratch_dir, quality_csv, summary_db, resume, work_queue, filepath_csv_summary_file)]
+		zmax_ppgparser_exe_path, zmax_edfjoin_exe_path, zmax_eegcleaner_exe_path, zmax_hdrecorder_exe_path = [path_in_dir(pathstring, cwd) for pathstring in (zmax_ppgparser_exe_path, zmax_edfjoin_exe_path, zmax_eegcleaner_exe_path, zmax_hdrecorder_exe_path)]
+
+		self.write_redirection_path = write_redirection_path
+		self.read_zip = read_zip
+		self.zipfile_match_string = zipfile_match_string
+		self.zipfile_nonmatch_string = zipfile_nonmatch_string
+
+		self.zmax_ppgparser = zmax_ppgparser
+		self.zmax_ppgparser_exe_path = application_path + os.sep + 'PPGParser.exe' if zmax_ppgparser_exe_path is None else zmax_ppgparser_exe_path # in the current working directory
+		self.zmax_ppgparser_timeout_seconds = zmax_ppgparser_timeout_seconds
+		self.zmax_ppgparser_native = zmax_ppgparser_native
+		self.zmax_edfjoin = zmax_edfjoin
+		self.zmax_edfjoin_exe_path = application_path + os.sep + 'EDFJoin.exe' if zmax_edfjoin_exe_path is None else zmax_edfjoin_exe_path # in the current working directory
+		self.zmax_edfjoin_timeout_seconds = zmax_edfjoin_timeout_seconds
+		self.zmax_edfjoin_native = zmax_edfjoin_native
+		self.zmax_eegcleaner = zmax_eegcleaner
+		self.zmax_eegcleaner_exe_path = application_path + os.sep + 'EDFCleaner.exe' if zmax_eegcleaner_exe_path is None else zmax_eegcleaner_exe_path # in the current working directory
+		self.zmax_eegcleaner_timeout_seconds = zmax_eegcleaner_timeout_seconds
+		self.zmax_eegcleaner_native = zmax_eegcleaner_native
+		self.zmax_raw_hyp_file = zmax_raw_hyp_file
+		self.zmax_hdrecorder_exe_path = application_path + os.sep + 'HDRecorder.exe' if zmax_hdrecorder_exe_path is None else zmax_hdrecorder_exe_path # in the current working directory
+		self.hdrecorder_SDConvert_folder_path = fileparts(self.zmax_hdrecorder_exe_path)[0] + os.sep + 'SDConvert'
+		self.zmax_hdrecorder_timeout_seconds = zmax_hdrecorder_timeout_seconds
+		self.zmax_raw_hyp_keep_edf = zmax_raw_hyp_keep_edf
+		self.tool_cache = ToolCache(tool_cache_dir, max_bytes=int(tool_cache_max_GB*1024**3)) if tool_cache_dir is not None else None
+		self.output_store = OutputStore(output_store_dir) if output_store_dir is not None else None
+		self.output_store_cleanup = output_store_cleanup
+		self.inventory = inventory
+
+		self.write_name_postfix = write_name_postfix
+		self.temp_file_postfix = temp_file_postfix
+		self.scratch_dir = dir_path_create(scratch_dir) if scratch_dir is not None else None
+		self.fsync = fsync
+		self.resample_Hz = resample_Hz
+		self.crop_start = parse_crop_time(crop_start)
+		self.crop_end = parse_crop_time(crop_end)
+		self.isliteversion = zmax_lite
+		self.read_only_EEG = read_only_EEG
+		self.read_only_EEG_BATT = read_only_EEG_BATT
+		self.no_write = no_write
+		self.no_overwrite = no_overwrite
+		self.no_summary_csv = no_summary_csv
+		self.file_hashing = not no_file_hashing
+		self.file_hash_mode = file_hash_mode
+		self.verify_zip_crc = verify_zip_crc
+		self.signal_hashing = not no_signal_hashing
+		self.exclude_empty_channels = exclude_empty_channels
+		self.write_zip = write_zip
+		self.verify = verify
+		self.quality_csv = quality_csv
+		self.quality_writers = None
+		self.compact = compact
+		self.out_of_core = out_of_core
+		self.block_seconds = block_seconds
+		self.native_rates = native_rates
+		self.write_workers = write_workers
+		self.keep_raw = keep_raw
+
+		self.work_queue = None
+		if work_queue is not None:
+			self.work_queue = WorkQueue(work_queue, node_id=work_queue_node_id, lease_seconds=work_queue_lease_seconds)
+			# the temporary files are per node, so a node that lost the lease of a
+			# recording never writes over the temporary files of the new owner
+			self.temp_file_postfix = temp_file_postfix + self.work_queue.token + '_'
+			if filepath_csv_summary_file is None:
+				# every node writes its own summary shard into the queue
+				filepath_csv_summary_file = self.work_queue.get_summary_shard_filepath()
+
+		if filepath_csv_summary_file is None and not no_summary_csv:
+			filepath_csv_summary_file = application_path + os.sep + 'zmax_edf_merge_converter_summary_' + datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f") + '.csv'
+		self.filepath_csv_summary_file = filepath_csv_summary_file
+		self.csv_summary_file = None
+		self.summary_writer = None
+		self.nFileProcessed = 0
+		self.summary_db = summary_db
+		self.summary_store = None
+		self.skip_duplicate_fingerprints = skip_duplicate_fingerprints
+		self.fingerprints = {}
+
+		self.journal = None
+		if resume is not None:
+			self.journal = RunJournal(resume)
+			if self.journal.summary_csv is not None:
+				# continue writing rows into the summary csv of the interrupted run
+				self.filepath_csv_summary_file = self.journal.summary_csv
+			for record in self.journal.done.values():
+				if record.get('fingerprint_preload', 'not_computed') != 'not_computed':
+					self.fingerprints.setdefault(('fingerprint_preload', record['fingerprint_preload']), record['file_number'])
+
+	@classmethod
+	def from_args(cls, args, **kwargs):
+		# use the defaults of the Converter for all arguments that were not given
+		parameters = inspect.signature(cls.__init__).parameters
+		options = {k: v for k, v in vars(args).items() if (v is not None) and (k in parameters)}
+		options.update(kwargs)
+		return cls(**options)
+
+	def get_drop_channels(self):
+		drop_channels = []
+		if self.isliteversion:
+			drop_channels = ['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength']
+		if self.read_only_EEG:
+			drop_channels = ['BATT', 'BODY TEMP', 'dX', 'dY', 'dZ', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_IR_AC', 'OXY_IR_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_OXY_IR_AC', 'PARSED_NASAL L', 'PARSED_HR_r', 'PARSED_HR_r_strength', 'PARSED_OXY_R_AC', 'PARSED_HR_ir', 'PARSED_HR_ir_strength']
+		if self.read_only_EEG_BATT:
+			drop_channels = ['BODY TEMP', 'dX', 'dY', 'dZ', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_IR_AC', 'OXY_IR_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_OXY_IR_AC', 'PARSED_NASAL L', 'PARSED_HR_r', 'PARSED_HR_r_strength', 'PARSED_OXY_R_AC', 'PARSED_HR_ir', 'PARSED_HR_ir_strength']
+		return drop_channels
+
+	# =========================================================================
+	# discovery: yields per parent path the found files and how to read them
+	# =========================================================================
+	def find_files(self, parent_dir_paths):
+		for parentdirpath in parent_dir_paths:
+			parentdirpath = path_in_dir(parentdirpath, self.cwd)
+			read_zip_temp = self.read_zip
+			zmax_raw_hyp_file_temp = self.zmax_raw_hyp_file
+			filepath_list = []
+			if os.path.isfile(parentdirpath):
+				p, n, e = fileparts(parentdirpath)
+				if e.lower() == ".zip":
+					read_zip_temp = True
+					filepath_list = [parentdirpath]
+				elif e.lower() == ".hyp":
+					read_zip_temp = False
+					zmax_raw_hyp_file_temp = True
+					filepath_list = [parentdirpath]
+				else:
+					continue # do not process
+			else:
+				try:
+					parentdirpath = dir_path(parentdirpath)
+				except NotADirectoryError:
+					print("argument '%s' is not a directory" %parentdirpath)
+					continue
+
+				if parentdirpath is None:
+					print("argument '%s' is not parsable" %parentdirpath)
+					continue
+
+				print("Finding file paths...")
+				filepath_list = find_zmax_files(parentdirpath, readzip=read_zip_temp, zipfile_match_string=self.zipfile_match_string, zipfile_nonmatch_string=self.zipfile_nonmatch_string, find_hyp_files=zmax_raw_hyp_file_temp)
+
+			print("FOUND %d matching file paths " % len(filepath_list))
+			for iFn, fn in enumerate(filepath_list):
+				print("%d: %s" % (iFn, fn))
+
+			if len(filepath_list) < 1:
+				print("no zmax files found")
+
+			yield parentdirpath, filepath_list, read_zip_temp, zmax_raw_hyp_file_temp
+
+	# =========================================================================
+	# converts the .hyp files of filepath_outer (or the ones in the zip file)
+	# with HDRecorder.exe, returns the paths of the converted EEG L.edf files,
+	# their export paths and the directories to remove afterwards
+	# =========================================================================
+	def convert_hyp(self, filepath_outer, parentdirpath, read_zip_temp, temp_dir=None):
+		print('ATTEMPT to convert .hyp file using HDRecorder: ' + filepath_outer)
+		p, n, e = fileparts(filepath_outer)
+		zmax_convert_edf_dir_path = p + os.sep + n
+		filepaths = []
+		export_filepaths = []
+		rm_dir_list = []
+		filepath_list_hyps = []
+		if temp_dir is not None:
+			fileendings = ('*.hyp', '*.HYP')
+			for fileending in fileendings:
+				filepath_list_hyps.extend(glob.glob(temp_dir.name + os.sep + "**" + os.sep + fileending, recursive=True))
+		else:
+			filepath_list_hyps.extend([filepath_outer])
+		for fp in filepath_list_hyps:
+			exec_string =  "\"" + self.zmax_hdrecorder_exe_path + "\"" + " -conv " + "\"" + fp + "\""
+			subprocess.run(exec_string, shell=False, timeout=self.zmax_hdrecorder_timeout_seconds)
+
+			if (fileparts(filepath_outer)[2].lower() == ".zip") and read_zip_temp:
+				pp, nn, ee = fileparts(zmax_convert_edf_dir_path + fp.replace(temp_dir.name,""))
+				zmax_convert_edf_dir_path_temp = pp + os.sep + nn + self.temp_file_postfix
+			else:
+				zmax_convert_edf_dir_path_temp = zmax_convert_edf_dir_path + self.temp_file_postfix
+
+			if self.scratch_dir is not None and not self.zmax_raw_hyp_keep_edf:
+				# the converted files are only read in and removed afterwards
+				scratch_dirpath = tempfile.mkdtemp(dir=self.scratch_dir)
+				zmax_convert_edf_dir_path_temp = scratch_dirpath + os.sep + os.path.basename(zmax_convert_edf_dir_path_temp)
+			else:
+				if self.write_redirection_path is not None:
+					parentdirpath_temp = get_dir_path(parentdirpath)
+					indFound = zmax_convert_edf_dir_path_temp.find(parentdirpath_temp)
+					if indFound >= 0:
+						zmax_convert_edf_dir_path_temp = self.write_redirection_path + zmax_convert_edf_dir_path_temp[(indFound+len(parentdirpath_temp)):]
+						path_create(zmax_convert_edf_dir_path_temp, isFile=False)
+				try:
+					shutil.rmtree(zmax_convert_edf_dir_path_temp)
+				except Exception:
+					print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % zmax_convert_edf_dir_path_temp)
+					print(traceback.format_exc())
+			dirpath_add = shutil.move(self.hdrecorder_SDConvert_folder_path, zmax_convert_edf_dir_path_temp)
+			filepath_add = dirpath_add + os.sep + 'EEG L.edf'
+			if fileparts(filepath_outer)[2].lower() == ".zip" and read_zip_temp:
+				export_filepath_inner_hyp = pp + os.sep + nn + self.write_name_postfix
+			else:
+				export_filepath_inner_hyp = p + os.sep + n + self.write_name_postfix
+			filepaths.append(filepath_add)
+			export_filepaths.append(export_filepath_inner_hyp)
+			rm_dir_list.extend([self.hdrecorder_SDConvert_folder_path, dirpath_add])
+			if self.scratch_dir is not None and not self.zmax_raw_hyp_keep_edf:
+				rm_dir_list.append(scratch_dirpath)
+		return filepaths, export_filepaths, rm_dir_list
+
+	# =========================================================================
+	# lazily yields the (not yet converted) jobs for all found files, the
+	# temporary files of a .hyp conversion are removed once its jobs are done
+	# =========================================================================
+	def iter_jobs(self, parent_dir_paths):
+		for parentdirpath, filepath_list, read_zip_temp, zmax_raw_hyp_file_temp in self.find_files(parent_dir_paths):
+			number_of_conversions = len(filepath_list)
+			for i, filepath_outer in enumerate(filepath_list):
+				rm_dir_list = []
+				temp_dir = None
+				cleanup_tempdir_hyp_convert = False
+
+				print("PROCESSING %d of %d: '%s' " % (i+1, number_of_conversions, filepath_outer))
+
+				conversion_datetime = datetime.datetime.now()
+				read_zip_temp_reset = False
+				filepaths = []
+				export_filepaths = []
+				if zmax_raw_hyp_file_temp and self.zmax_hdrecorder_exe_path is not None:
+					if read_zip_temp:
+						read_zip_temp_reset = True
+						try:
+							temp_dir = safe_zip_dir_extract(filepath_outer, scratch_dir=self.scratch_dir)
+						except Exception:
+							print(traceback.format_exc())
+							print('FAILED to convert the zipped hyp files in ' + filepath_outer)
+							break
+					try:
+						filepaths, export_filepaths, rm_dir_list = self.convert_hyp(filepath_outer, parentdirpath, read_zip_temp, temp_dir=temp_dir)
+						cleanup_tempdir_hyp_convert = len(filepaths) > 0
+					except Exception:
+						print(traceback.format_exc())
+						print('FAILED to convert the hyp file ' + filepath_outer)
+						break
+				else:
+					filepaths.append(filepath_outer)
+
+				for iFilePath, filepath in enumerate(filepaths):
+					self.nFileProcessed += 1
+					export_filepath = export_filepaths[iFilePath] if export_filepaths else None
+					yield ConversionJob(filepath, filepath_outer=filepath_outer, parentdirpath=parentdirpath, read_zip=(read_zip_temp and (not read_zip_temp_reset)), export_filepath=export_filepath, file_number=self.nFileProcessed, conversion_datetime=conversion_datetime, index=i, total=number_of_conversions)
+
+				if cleanup_tempdir_hyp_convert and (not self.zmax_raw_hyp_keep_edf):
+					for dp in rm_dir_list:
+						try:
+							shutil.rmtree(dp)
+						except Exception:
+							print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % dp)
+							print(traceback.format_exc())
+
+				if temp_dir is not None:
+					try:
+						safe_zip_dir_cleanup(temp_dir)
+					except:
+						print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % temp_dir)
+						print(traceback.format_exc())
+
+	# =========================================================================
+	# determines the final (and temporary) export path of a job, returns False
+	# if the job should be skipped because the final file already exists
+	# =========================================================================
+	def prepare_export(self, job):
+		path, name, extension = fileparts(job.filepath)
+		parentfoldername = os.path.basename(path)
+		pathup, nametmp, extensiontmp = fileparts(path)
+		if job.export_filepath is not None:
+			export_filepath = job.export_filepath
+		else:
+			if job.read_zip:
+				export_filepath = path + os.sep + name + self.write_name_postfix
+			else:
+				export_filepath = pathup + os.sep +  parentfoldername + self.write_name_postfix
+
+		if self.write_redirection_path is not None:
+			parentdirpath_temp = get_dir_path(job.parentdirpath)
+			indFound = export_filepath.find(parentdirpath_temp)
+			if indFound >= 0:
+				export_filepath = self.write_redirection_path + export_filepath[(indFound+len(parentdirpath_temp)):]
+				path_create(export_filepath, isFile=True)
+
+		export_filepath_unfinished = export_filepath + self.temp_file_postfix
+
+		if self.write_zip:
+			job.export_filepath_final_to_rename = export_filepath_unfinished + ".zip"
+		else:
+			job.export_filepath_final_to_rename = export_filepath_unfinished + ".edf"
+
+		job.export_filepath_final = job.export_filepath_final_to_rename.replace(self.temp_file_postfix,'')
+
+		if self.no_overwrite:
+			if os.path.exists(job.export_filepath_final):
+				print('skipping file: %s' % job.export_filepath_final)
+				job.skipped = True
+				return False
+		return True
+
+	# =========================================================================
+	# file hash of the whole file, only sampled chunks of it or for zip files
+	# of the central directory entries of the EDFs (--file_hash_mode)
+	# =========================================================================
+	def get_file_hash(self, filepath):
+		if self.file_hash_mode == 'zip_crc' and fileparts(filepath)[2].lower() == '.zip':
+			return get_zip_crc_fingerprint(filepath, hash_function=hashlib.md5)
+		if self.file_hash_mode == 'sampled':
+			return get_file_hash_sampled(filepath, chunk_size_bytes=65536, hash_function=hashlib.md5)
+		return get_file_hash(filepath, chunk_size_bytes=65536, hash_function=hashlib.md5)
+
+	# =========================================================================
+	# pre-load fingerprint, returns False if the job should not be read as it
+	# duplicates a recording of this run (or of the summary database)
+	# =========================================================================
+	def fingerprint(self, job):
+		try:
+			job.fingerprint_preload = get_zmax_fingerprint(job.filepath, read_zip=job.read_zip)
+		except Exception:
+			print(traceback.format_exc())
+			print('FAILED to compute the pre-load fingerprint of ' + job.filepath)
+			return True
+		checks = [('fingerprint_preload', job.fingerprint_preload, 'fingerprint')]
+		if job.read_zip and self.file_hashing and self.file_hash_mode == 'zip_crc':
+			# from the central directory of the zip file, nothing is decompressed
+			job.md5_file_original_hash = self.get_file_hash(job.filepath)
+			checks.append(('hash_zmax_file_path_original_md5', job.md5_file_original_hash, 'zip_crc'))
+		duplicate_kind = None
+		for column, value, kind in checks:
+			duplicate = None
+			if (column, value) in self.fingerprints:
+				duplicate = 'file_number %d of this run' % self.fingerprints[(column, value)]
+			elif self.summary_store is not None:
+				summary_id = self.summary_store.find_duplicate(column, value)
+				if summary_id is not None:
+					duplicate = 'summary_id %d of the summary database' % summary_id
+			if duplicate is None:
+				self.fingerprints[(column, value)] = job.file_number
+				continue
+			print("DUPLICATE %s of %s: '%s'" % (kind.upper().replace('_', ' '), duplicate, job.filepath))
+			if duplicate_kind is None:
+				duplicate_kind = kind
+		if duplicate_kind is not None and self.skip_duplicate_fingerprints:
+			job.conversion_status = 'skipped_duplicate_' + duplicate_kind
+			return False
+		return True
+
+	# =========================================================================
+	# the summary values of a job from the EDF headers and the last BATT
+	# data record only, nothing is read in or written (--inventory)
+	# =========================================================================
+	def take_inventory(self, job):
+		inventory = get_zmax_inventory(job.filepath, read_zip=job.read_zip, crop_start=self.crop_start, crop_end=self.crop_end)
+		job.channels = '|'.join(inventory['channels'])
+		if inventory['start_datetime'] is not None:
+			job.rec_start_datetime = inventory['start_datetime']
+			job.rec_duration_datetime = datetime.timedelta(seconds=max(0, inventory['n_samples'] - 1) / 256.0)
+			job.rec_stop_datetime = job.rec_start_datetime + job.rec_duration_datetime
+			job.rec_duration_seconds = job.rec_duration_datetime.total_seconds()
+			job.rec_n_samples = inventory['n_samples']
+		job.rec_battery_at_end = inventory['battery_at_end']
+		job.conversion_status = 'inventoried'
+		print("INVENTORY " + job.progress())
+
+	def check_reprocessed_channels(self, job, ch_names):
+		# e.g. EDFCleaner.exe or PPGParser.exe failed or was not found
+		if job.eeg_cleaner == 'exe' and not any(ch_name.endswith(' Cleaned') for ch_name in ch_names):
+			job.eeg_cleaner = 'exe_failed'
+		if job.ppg_parser == 'exe' and 'OXY_IR_AC' in ch_names and not any(ch_name.startswith('PARSED_') for ch_name in ch_names):
+			job.ppg_parser = 'exe_failed'
+
+	# =========================================================================
+	# reading (and merging) of the channels, for EDFJoin the joined file is
+	# only moved to the temporary export folder and its path is kept
+	# =========================================================================
+	def read(self, job):
+		if self.zmax_eegcleaner:
+			# the cleaned channels of EDFCleaner.exe and of the native cleaner have the same names
+			job.eeg_cleaner = 'native' if self.zmax_eegcleaner_native else 'exe'
+		if self.zmax_ppgparser:
+			# the same for the PARSED_ channels of PPGParser.exe and of the native parser
+			job.ppg_parser = 'native' if self.zmax_ppgparser_native else 'exe'
+		format = "zmax_edf"
+		no_read = False
+		zmax_edfjoin_move_path_subdir = None
+		if self.zmax_edfjoin:
+			format = "zmax_edf_join"
+			path_temp, name_temp, ext_temp = fileparts(job.export_filepath_final_to_rename)
+			subdir_temp = path_temp + os.sep + self.temp_file_postfix
+			dir_path_create(subdir_temp)
+			zmax_edfjoin_move_path_subdir = subdir_temp + os.sep + name_temp + ".edf"
+			no_read = True
+			if self.no_write:
+				job.skipped = True
+				return False
+
+		if (self.compact or self.out_of_core or self.native_rates) and not self.zmax_edfjoin:
+			compact_kwargs = dict(native_rates=self.native_rates, zmax_ppgparser=self.zmax_ppgparser, zmax_ppgparser_exe_path=self.zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=self.zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=self.zmax_ppgparser_native, zmax_eegcleaner=self.zmax_eegcleaner, zmax_eegcleaner_exe_path=self.zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=self.zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=self.zmax_eegcleaner_native, tool_cache=self.tool_cache, drop_zmax=self.get_drop_channels(), crop_start=self.crop_start, crop_end=self.crop_end)
+			if self.out_of_core:
+				if job.read_zip:
+					job.recording = read_zmax_blockwise_zipped(job.filepath, block_seconds=self.block_seconds, scratch_dir=self.scratch_dir, verify_crc=self.verify_zip_crc, **compact_kwargs)
+				else:
+					job.recording = read_zmax_blockwise(job.filepath, block_seconds=self.block_seconds, **compact_kwargs)
+			elif job.read_zip:
+				job.recording = read_zmax_compact_zipped(job.filepath, scratch_dir=self.scratch_dir, verify_crc=self.verify_zip_crc, **compact_kwargs)
+			else:
+				job.recording = read_zmax_compact(job.filepath, **compact_kwargs)
+			print("READ " + job.progress())
+			job.conversion_status = 'read_in'
+			return True
+
+		read_kwargs = dict(format=format, zmax_ppgparser=self.zmax_ppgparser, zmax_ppgparser_exe_path=self.zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=self.zmax_ppgparser_timeout_seconds, zmax_ppgparser_native=self.zmax_ppgparser_native, zmax_eegcleaner=self.zmax_eegcleaner, zmax_eegcleaner_exe_path=self.zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=self.zmax_eegcleaner_timeout_seconds, zmax_eegcleaner_native=self.zmax_eegcleaner_native, tool_cache=self.tool_cache, zmax_edfjoin_exe_path=self.zmax_edfjoin_exe_path, zmax_edfjoin_timeout_seconds=self.zmax_edfjoin_timeout_seconds, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=zmax_edfjoin_move_path_subdir, zmax_edfjoin_native=self.zmax_edfjoin_native, no_read=no_read, drop_zmax=self.get_drop_channels(), crop_start=self.crop_start, crop_end=self.crop_end)
+		if job.read_zip:
+			raw = read_edf_to_raw_zipped(job.filepath, scratch_dir=self.scratch_dir, verify_crc=self.verify_zip_crc, **read_kwargs)
+		else:
+			raw = read_edf_to_raw(job.filepath, **read_kwargs)
+
+		print("READ " + job.progress())
+		job.conversion_status = 'read_in'
+
+		if self.zmax_edfjoin:
+			if raw is None:
+				job.skipped = True
+				return False
+			job.joined_filepath = raw
+		else:
+			job.raw = raw
+		return True
+
+	# =========================================================================
+	# moves (and zips) the file joined by EDFJoin to the temporary export path
+	# =========================================================================
+	def finalize_join(self, job):
+		if not self.holds_work_queue_lease(job):
+			return False
+		zmax_edfjoin_move_path_subdir = job.joined_filepath
+		joined_filepath_moved_to_rename = zmax_edfjoin_move_path_subdir.replace(self.temp_file_postfix+os.sep,'')
+		try:
+			if not self.write_zip:
+				job.export_filepath_final_to_rename = replace_file(zmax_edfjoin_move_path_subdir, joined_filepath_moved_to_rename)
+			else:
+				path_tmp, name_tmp, ext_tmp = fileparts(zmax_edfjoin_move_path_subdir)
+				name_tmp_final = name_tmp.replace(self.temp_file_postfix,'')
+				joined_filepath_moved_final_subdir_final = path_tmp + os.sep + name_tmp_final + ext_tmp
+				joined_filepath_moved_final_subdir_final = replace_file(zmax_edfjoin_move_path_subdir, joined_filepath_moved_final_subdir_final)
+				path_temp, name_temp, ext_temp = fileparts(joined_filepath_moved_final_subdir_final)
+				joined_filepath_moved_final_subdir_final_zip = path_temp + os.sep + name_temp + self.temp_file_postfix + '.zip'
+				joined_filepath_moved_final_subdir_final_zip = zip_file(joined_filepath_moved_final_subdir_final, joined_filepath_moved_final_subdir_final_zip, deletefile=True, compresslevel=6)
+				job.export_filepath_final_to_rename = joined_filepath_moved_final_subdir_final_zip.replace(self.temp_file_postfix+os.sep,'')
+				replace_file(joined_filepath_moved_final_subdir_final_zip, job.export_filepath_final_to_rename)
+				try:
+					shutil.rmtree(path_tmp, ignore_errors=True)
+				except Exception:
+					job.rm_dir_list.extend([path_tmp])
+					print('FAILED TO remove temporary folder %s for filepath %s but will try again once more later.' % (path_tmp, job.filepath))
+					print(traceback.format_exc())
+		except Exception:
+			print('FAILED TO MOVE or ZIP THE file %s to %s or its zipped form.' % (job.filepath, joined_filepath_moved_to_rename))
+			print(traceback.format_exc())
+
+	# =========================================================================
+	# signal hashing, recording infos, dropping of empty channels, resampling
+	# and file hashing of the original
+	# =========================================================================
+	def process(self, job):
+		import numpy
+		raw = job.raw
+		# data hashing pre
+		if self.signal_hashing:
+			print("HASHING SIGNAL OF FILE " + job.progress())
+			job.md5_signal_hash_before_conversion = get_raw_data_hash(raw, hash_function=hashlib.md5)
+			print("MD5 SIGNAL HASH: " + job.md5_signal_hash_before_conversion)
+
+		job.rec_start_datetime = raw.info['meas_date'] + datetime.timedelta(seconds=raw.first_time)
+		job.channels = '|'.join(raw.ch_names)
+		self.check_reprocessed_channels(job, raw.ch_names)
+		job.rec_stop_datetime = job.rec_start_datetime + datetime.timedelta(seconds=(raw._last_time - raw._first_time))
+		job.rec_duration_datetime = datetime.timedelta(seconds=(raw._last_time - raw._first_time))
+		job.rec_duration_seconds = job.rec_duration_datetime.total_seconds()
+		job.rec_n_samples = raw.n_times
+		job.rec_battery_at_end = raw_zmax_data_quality(raw)
+		if self.quality_csv is not None:
+			job.channel_quality, job.battery_curve = get_zmax_channel_quality(raw, block_seconds=self.block_seconds)
+
+		if self.exclude_empty_channels:
+			flat_channel_names = []
+			for iCh, ch_name in enumerate(raw.info['ch_names']):
+				nNotFlat = numpy.count_nonzero(raw._data[iCh]-numpy.median(raw._data[iCh]))
+				if nNotFlat <= 10:
+					flat_channel_names.append(ch_name)
+			raw.drop_channels(flat_channel_names)
+
+		if self.resample_Hz is not None:
+			raw = raw.resample(self.resample_Hz)
+		job.raw = raw
+
+		# file hashing original
+		if self.file_hashing:
+			print("HASHING FILE " + job.progress())
+			job.md5_file_original_hash = self.get_file_hash(job.filepath)
+			print("MD5 FILE HASH: " + job.md5_file_original_hash)
+
+		# data hashing post
+		if self.signal_hashing:
+			print("HASHING SIGNAL (after conversion) OF FILE " + job.progress())
+			job.md5_signal_hash_after_conversion = get_raw_data_hash(raw, hash_function=hashlib.md5)
+			print("MD5 SIGNAL HASH: " + job.md5_signal_hash_after_conversion)
+
+		job.conversion_status = 'read_in_processed'
+
+	# =========================================================================
+	# the same for a CompactRecording, on the digital int16 (or float32) values
+	# =========================================================================
+	def process_compact(self, job):
+		recording = job.recording
+		# data hashing pre
+		if self.signal_hashing:
+			print("HASHING SIGNAL OF FILE " + job.progress())
+			job.md5_signal_hash_before_conversion = recording.get_hash(hash_function=hashlib.md5)
+			print("MD5 SIGNAL HASH: " + job.md5_signal_hash_before_conversion)
+
+		job.rec_start_datetime = recording.start_datetime
+		job.channels = '|'.join(recording.ch_names)
+		self.check_reprocessed_channels(job, recording.ch_names)
+		job.rec_duration_datetime = datetime.timedelta(seconds=(recording.n_times - 1) / recording.sfreq)
+		job.rec_stop_datetime = job.rec_start_datetime + job.rec_duration_datetime
+		job.rec_duration_seconds = job.rec_duration_datetime.total_seconds()
+		job.rec_n_samples = recording.n_times
+		job.rec_battery_at_end = raw_zmax_data_quality(recording)
+		if self.quality_csv is not None:
+			job.channel_quality, job.battery_curve = get_zmax_channel_quality(recording, block_seconds=self.block_seconds)
+
+		if self.exclude_empty_channels:
+			flat_channel_names = []
+			for iCh, ch_name in enumerate(recording.ch_names):
+				if recording.is_flat(iCh, max_not_flat=10):
+					flat_channel_names.append(ch_name)
+			recording.drop_channels(flat_channel_names)
+
+		if self.resample_Hz is not None:
+			recording.resample(self.resample_Hz)
+
+		# file hashing original
+		if self.file_hashing:
+			print("HASHING FILE " + job.progress())
+			job.md5_file_original_hash = self.get_file_hash(job.filepath)
+			print("MD5 FILE HASH: " + job.md5_file_original_hash)
+
+		# data hashing post
+		if self.signal_hashing:
+			print("HASHING SIGNAL (after conversion) OF FILE " + job.progress())
+			job.md5_signal_hash_after_conversion = recording.get_hash(hash_function=hashlib.md5)
+			print("MD5 SIGNAL HASH: " + job.md5_signal_hash_after_conversion)
+
+		job.conversion_status = 'read_in_processed'
+
+	# =========================================================================
+	# the key of the written file in the --output_store_dir, from the signals
+	# after conversion, the options that change the written file and what else
+	# is written (None if not known)
+	# =========================================================================
+	def get_output_store_key(self, job):
+		if self.output_store is None or job.md5_signal_hash_after_conversion == 'not_computed':
+			return None
+		if job.recording is not None:
+			# the signal hash of a recording covers the channel names, units and rates
+			writer = 'compact'
+			layout = ''
+		else:
+			# the signal hash of a raw covers only its data
+			writer = 'mne'
+			layout = '%s|%g' % (','.join(job.raw.ch_names), job.raw.info['sfreq'])
+		edf_filename = fileparts(job.export_filepath_final)[1] if self.write_zip else ''
+		return self.output_store.get_key(job.md5_signal_hash_after_conversion, job.rec_start_datetime, writer, layout, edf_filename, self.get_output_options_digest())
+
+	def get_output_options_digest(self):
+		options = [self.out_of_core, self.block_seconds if self.out_of_core else None, self.native_rates, self.resample_Hz, self.crop_start, self.crop_end,
+			self.zmax_eegcleaner, self.zmax_eegcleaner_native, self.zmax_ppgparser, self.zmax_ppgparser_native, self.write_zip]
+		return self.output_store.get_key(*options)
+
+	# =========================================================================
+	# False if the work queue item of the job was reclaimed by another node
+	# (e.g. after this node stalled longer than the lease), the job is then
+	# abandoned and left to the other node
+	# =========================================================================
+	def holds_work_queue_lease(self, job):
+		if self.work_queue is None or self.work_queue.holds_lease(self.work_queue.get_key(job)):
+			return True
+		print("abandoning (the lease in the work queue %s was lost) %s" % (self.work_queue.queue_dirpath, job.progress()))
+		job.skipped = True
+		job.conversion_status = 'skipped_work_queue_lease_lost'
+		return False
+
+	# =========================================================================
+	# writes to the temporary file and renames it to the final export path,
+	# with an --output_store_dir a file of the same content is linked instead
+	# =========================================================================
+	def write(self, job):
+		# check again just before writing
+		if self.no_overwrite:
+			if os.path.exists(job.export_filepath_final):
+				print('skipping file: %s' % job.export_filepath_final)
+				job.skipped = True
+				return False
+		if not self.holds_work_queue_lease(job):
+			return False
+		print("Attempting to write %d of %d: '%s' " % (job.index+1, job.total, job.export_filepath_final))
+		store_key = self.get_output_store_key(job)
+		store_extension = fileparts(job.export_filepath_final)[2]
+		store_mode = None
+		if store_key is not None:
+			store_mode = self.output_store.link(store_key, store_extension, job.export_filepath_final_to_rename)
+			if store_mode is not None:
+				print("OUTPUT STORE %s %d of %d: '%s' " % ('linked' if store_mode == 'link' else 'copied', job.index+1, job.total, job.export_filepath_final))
+				job.conversion_status = 'read_in_processed_written_temp'
+		if store_mode is None and job.recording is not None:
+			chunk_records = int(self.block_seconds) if self.out_of_core else 64
+			if self.write_zip:
+				write_compact_to_edf_zipped(job.recording, job.export_filepath_final_to_rename, edf_filename=job.export_filepath_final, chunk_records=chunk_records, scratch_dir=self.scratch_dir, workers=self.write_workers)
+			else:
+				write_compact_to_edf(job.recording, job.export_filepath_final_to_rename, chunk_records=chunk_records, workers=self.write_workers)
+			job.conversion_status = 'read_in_processed_written_temp'
+		elif store_mode is None and not self.zmax_edfjoin:
+			if self.write_zip:
+				write_raw_to_edf_zipped(job.raw, job.export_filepath_final_to_rename, edf_filename=job.export_filepath_final, format="zmax_edf", scratch_dir=self.scratch_dir) # treat as a speacial zmax read EDF for export
+			else:
+				write_raw_to_edf(job.raw, job.export_filepath_final_to_rename, format="zmax_edf")  # treat as a speacial zmax read EDF for export
+			job.conversion_status = 'read_in_processed_written_temp'
+		if store_key is not None and store_mode is None and os.path.isfile(job.export_filepath_final_to_rename):
+			try:
+				self.output_store.store(store_key, store_extension, job.export_filepath_final_to_rename)
+				store_mode = 'link'
+			except Exception:
+				print('FAILED TO add the file %s to the output store' % job.export_filepath_final_to_rename)
+				print(traceback.format_exc())
+		if not self.holds_work_queue_lease(job):
+			# the temporary file is left to the node that reclaimed the item
+			return False
+		try:
+			# check again just before writing
+			# staged next to the final file, so this is an atomic replace on the same filesystem
+			replace_file(job.export_filepath_final_to_rename, job.export_filepath_final, fsync=self.fsync, overwrite=not self.no_overwrite)
+			if store_mode is not None:
+				self.output_store.add_reference(store_key, store_extension, job.export_filepath_final, mode=store_mode)
+			print("WROTE successfully %d of %d: '%s' " % (job.index+1, job.total, job.export_filepath_final))
+			job.conversion_status = 'read_in_processed_written_converted'
+			# file hashing converted
+			if self.file_hashing:
+				print("HASHING FILE after conversion " + job.progress())
+				job.md5_file_converted_hash = self.get_file_hash(job.export_filepath_final)
+				print("MD5 FILE after conversion HASH: " + job.md5_file_converted_hash)
+		except:
+			print('FAILED TO RENAME FINAL FILE %s FROM TEMPORARY FILE' % (job.export_filepath_final))
+			print(traceback.format_exc())
+		#finally remove the temporary file if exists
+		try:
+			try:
+				os.remove(job.export_filepath_final_to_rename)
+			except FileNotFoundError:
+				pass
+		except:
+			print('FAILED TO DELETE THE LEFT TEMPORARY FILE: %s' % job.export_filepath_final_to_rename)
+			print(traceback.format_exc())
+		return True
+
+	# =========================================================================
+	# streams the written file and the source channel EDFs and compares them
+	# =========================================================================
+	def verify_output(self, job):
+		print("VERIFYING " + job.progress())
+		job.verify_results = verify_zmax_conversion(job.export_filepath_final, job.filepath, read_zip=job.read_zip)
+		job.verify_status = 'verified_ok'
+		for ch_name, result in job.verify_results.items():
+			if result['status'] == 'ok':
+				print("VERIFY OK '%s' (%d samples)%s" % (ch_name, result['n_samples'], ', ' + result['note'] if result['note'] else ''))
+			elif result['status'] == 'mismatch':
+				job.verify_status = 'verified_mismatch'
+				mismatch = result['first_mismatch']
+				print("VERIFY MISMATCH '%s' first at sample %d (%s): expected %s found %s" % (ch_name, mismatch['sample'], datetime.timedelta(seconds=mismatch['seconds']), 'end of source' if mismatch['expected'] is None else mismatch['expected'], mismatch['found']))
+			else:
+				print("VERIFY SKIPPED '%s': %s" % (ch_name, result['note']))
+		if job.verify_status == 'verified_mismatch':
+			print("FAILED VERIFICATION " + job.progress())
+
+	# =========================================================================
+	# all steps for one job, failures are reported and kept in the job status
+	# =========================================================================
+	def convert(self, job):
+		if self.journal is not None and self.journal.is_done(job):
+			print("skipping (done according to the journal %s) %s" % (self.journal.filepath, job.progress()))
+			job.skipped = True
+			job.conversion_status = 'skipped_resumed_done'
+			return job
+		if self.work_queue is not None:
+			claim = self.work_queue.claim(self.work_queue.get_key(job))
+			if claim != 'claimed':
+				print("skipping (%s in the work queue %s) %s" % ('done' if claim == 'done' else 'claimed by another node', self.work_queue.queue_dirpath, job.progress()))
+				job.skipped = True
+				job.conversion_status = 'skipped_work_queue_' + claim
+				return job
+		try:
+			if self.inventory:
+				self.take_inventory(job)
+			elif self.prepare_export(job):
+				self.record_stage(job, 'prepared', temp_paths=[job.export_filepath_final_to_rename])
+				if self.fingerprint(job) and self.read(job):
+					self.record_stage(job, 'read', temp_paths=[job.joined_filepath] if self.zmax_edfjoin else None)
+					if self.zmax_edfjoin:
+						self.finalize_join(job)
+					elif job.recording is not None:
+						self.process_compact(job)
+					else:
+						self.process(job)
+					self.record_stage(job, 'processed', temp_paths=[job.export_filepath_final_to_rename] if self.zmax_edfjoin else None)
+					if not self.no_write:
+						self.write(job)
+						self.record_stage(job, 'written')
+						if self.verify and job.conversion_status == 'read_in_processed_written_converted':
+							self.verify_output(job)
+		except Exception:
+			print(traceback.format_exc())
+			print("FAILED " + job.progress())
+
+		for dp in job.rm_dir_list:
+			try:
+				shutil.rmtree(dp)
+			except Exception:
+				print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % dp)
+				print(traceback.format_exc())
+		return job
+
+	def record_stage(self, job, stage, temp_paths=None):
+		if self.journal is not None:
+			self.journal.record_stage(job, stage, temp_paths=temp_paths)
+
+	# =========================================================================
+	# removes the temporary files of recordings that were not finished in an
+	# interrupted run (and the emptied temporary EDFJoin sub folders)
+	# =========================================================================
+	def remove_stale_temp_paths(self):
+		for temp_path in self.journal.get_stale_temp_paths():
+			if os.path.isfile(temp_path):
+				print('REMOVING the left temporary file of an interrupted run: %s' % temp_path)
+				try:
+					os.remove(temp_path)
+				except Exception:
+					print('FAILED TO DELETE THE LEFT TEMPORARY FILE: %s' % temp_path)
+					print(traceback.format_exc())
+			temp_dirpath = fileparts(temp_path)[0]
+			if os.path.basename(temp_dirpath) == self.temp_file_postfix and os.path.isdir(temp_dirpath) and not os.listdir(temp_dirpath):
+				os.rmdir(temp_dirpath)
+
+	def open_summary(self):
+		if self.summary_db is not None and self.summary_store is None:
+			self.summary_store = SummaryStore(self.summary_db)
+		if self.journal is not None and not self.journal.is_open():
+			self.journal.open(self.filepath_csv_summary_file)
+			self.remove_stale_temp_paths()
+		if self.no_summary_csv or self.csv_summary_file is not None:
+			return
+		# a resumed run appends to the summary csv of the interrupted run
+		append = self.journal is not None and os.path.isfile(self.filepath_csv_summary_file) and os.path.getsize(self.filepath_csv_summary_file) > 0
+		self.csv_summary_file = open(self.filepath_csv_summary_file, 'a' if append else 'w', newline='')
+		self.summary_writer = csv.writer(self.csv_summary_file, delimiter=',', quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+		if not append:
+			self.summary_writer.writerow(get_summary_header())
+
+	def write_summary_row(self, job):
+		if self.summary_store is not None:
+			job.summary_id, job.duplicates = self.summary_store.insert(job.get_metadata(), summary_csv=self.filepath_csv_summary_file)
+			for duplicate_column, duplicate in job.duplicates.items():
+				if duplicate is not None:
+					print("DUPLICATE (%s) of summary_id %d in the summary database: '%s'" % (duplicate_column, duplicate, job.filepath))
+		if self.summary_writer is None:
+			return
+		self.summary_writer.writerow(job.summary_row())
+		self.csv_summary_file.flush()
+
+	def open_quality(self):
+		# the channel quality and battery curve sidecar csv files, appended to if they exist
+		if self.quality_csv is None or self.quality_writers is not None:
+			return
+		self.quality_writers = []
+		for filepath, header in [(self.quality_csv, get_quality_header()), (get_battery_curve_filepath(self.quality_csv), get_battery_curve_header())]:
+			append = os.path.isfile(filepath) and os.path.getsize(filepath) > 0
+			f = open(filepath, 'a' if append else 'w', newline='')
+			writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+			if not append:
+				writer.writerow(header)
+			self.quality_writers.append((f, writer))
+
+	def write_quality_rows(self, job):
+		if self.quality_writers is None:
+			return
+		job_columns = [job.file_number, job.filepath, job.export_filepath_final]
+		(quality_file, quality_writer), (battery_file, battery_writer) = self.quality_writers
+		for row in job.channel_quality:
+			quality_writer.writerow(job_columns + [row.get(column) for column in get_quality_header()[len(job_columns):]])
+		for rec_seconds, battery_voltage in job.battery_curve:
+			battery_writer.writerow(job_columns + [rec_seconds, battery_voltage])
+		quality_file.flush()
+		battery_file.flush()
+
+	def close_summary(self):
+		if self.quality_writers is not None:
+			for f, writer in self.quality_writers:
+				f.close()
+			self.quality_writers = None
+		if self.journal is not None:
+			self.journal.close()
+		if self.work_queue is not None:
+			self.work_queue.close()
+		if self.summary_store is not None:
+			self.summary_store.close()
+			self.summary_store = None
+		if self.csv_summary_file is not None:
+			self.csv_summary_file.close()
+			self.csv_summary_file = None
+			self.summary_writer = None
+
+	# =========================================================================
+	# generator that lazily converts and yields one recording (job) at a time,
+	# the merged data is only kept in job.raw if keep_raw is set
+	# =========================================================================
+	def iter_convert(self, parent_dir_paths):
+		for job in self.iter_jobs(parent_dir_paths):
+			self.open_summary()
+			self.open_quality()
+			self.convert(job)
+			if not job.skipped:
+				self.write_summary_row(job)
+				self.write_quality_rows(job)
+			if not (self.journal is None or self.journal.is_done(job)):
+				self.record_stage(job, 'done')
+			if self.work_queue is not None and self.work_queue.is_claimed(self.work_queue.get_key(job)):
+				self.work_queue.complete(self.work_queue.get_key(job), job.conversion_status)
+			if not self.keep_raw:
+				job.raw = None
+				if job.recording is not None:
+					job.recording.close()
+				job.recording = None
+			yield job
+
+	# =========================================================================
+	# the complete batch conversion as run from the command line, returns the
+	# summary values of all converted recordings
+	# =========================================================================
+	def run(self, parent_dir_paths=None):
+		if parent_dir_paths is None:
+			parent_dir_paths = [str(pathlib.Path(self.cwd if self.cwd is not None else '').resolve())] # the current working directory
+		parent_dir_paths = [path_in_dir(parentdirpath, self.cwd) for parentdirpath in parent_dir_paths]
+
+		# only post process a summary csv (e.g. if the program was terminated earlier)
+		if (len(parent_dir_paths) == 1) and os.path.isfile(parent_dir_paths[0]) and (fileparts(parent_dir_paths[0])[2].lower() == ".csv"):
+			summary_csv_add_duplicates(parent_dir_paths[0])
+			print('finished')
+			return []
+
+		if self.output_store is not None and self.output_store_cleanup:
+			n_removed, bytes_removed = self.output_store.cleanup()
+			print('OUTPUT STORE cleanup removed %d unreferenced files (%.1f MB)' % (n_removed, bytes_removed/1024**2))
+
+		summary_rows = []
+		try:
+			for job in self.iter_convert(parent_dir_paths):
+				if not job.skipped:
+					summary_rows.append(job.get_metadata())
+		finally:
+			# close summary csv file again
+			self.close_summary()
+		if (not self.no_summary_csv) and os.path.isfile(self.filepath_csv_summary_file):
+			summary_csv_add_duplicates(self.filepath_csv_summary_file)
+
+		print('finished')
+		return summary_rows
+
+# =============================================================================
+# import the heavy dependencies once, e.g. for a long running server process
+# =============================================================================
+def warm_up():
+	import mne
+	import numpy
+	import pyedflib
+	import pandas
+
+# =============================================================================
+# the options a client may not use in a server job: the paths to the external
+# programs (which the server would run) and the options of the server itself
+# =============================================================================
+def get_server_job_rejected_options(args, parser):
+	rejected_options = []
+	for dest, value in sorted(vars(args).items()):
+		if (dest.endswith('_exe_path') or dest.startswith('serve') or dest == 'submit_to_server') and value != parser.get_default(dest):
+			rejected_options.append('--' + dest)
+	return rejected_options
+
+# =============================================================================
+# runs one conversion job given as command line arguments (relative paths are
+# taken in the directory cwd of the client), returns a response with one
+# summary row per converted recording
+# =============================================================================
+def run_server_job(argv, cwd=None):
+	try:
+		parser = get_argument_parser(cwd=cwd)
+		try:
+			args = parser.parse_args(argv)
+		except SystemExit:
+			return {'status': 'error', 'error': 'invalid arguments: %s' % ' '.join(argv)}
+		rejected_options = get_server_job_rejected_options(args, parser)
+		if rejected_options:
+			print('REJECTED job with %s' % ' '.join(rejected_options))
+			return {'status': 'error', 'error': 'options not allowed in a server job: %s' % ' '.join(rejected_options)}
+		converter = Converter.from_args(args, cwd=cwd)
+		summary_rows = converter.run(args.parent_dir_paths if args.parent_dir_paths else None)
+		return {'status': 'ok', 'summary_csv': converter.filepath_csv_summary_file, 'rows': summary_rows}
+	except Exception:
+		print(traceback.format_exc())
+		return {'status': 'error', 'error': traceback.format_exc()}
+
+# =============================================================================
+# handles newline separated json requests of a client connection, e.g.
+# {"argv": ["C:\\zmax\\data", "--write_zip"], "cwd": "C:\\zmax"} or
+# {"command": "ping"} or {"command": "shutdown"}
+# =============================================================================
+class ConverterRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				request = json.loads(line.decode('utf-8'))
+			except ValueError:
+				response = {'status': 'error', 'error': 'request is not valid json'}
+			else:
+				command = request.get('command', 'convert')
+				if command == 'ping':
+					response = {'status': 'ok', 'pid': os.getpid()}
+				elif command == 'shutdown':
+					response = {'status': 'ok'}
+					threading.Thread(target=self.server.shutdown, daemon=True).start()
+				elif command == 'convert':
+					response = self.server.submit(request.get('argv', []), request.get('cwd'))
+				else:
+					response = {'status': 'error', 'error': 'unknown command %s' % command}
+			self.wfile.write((json.dumps(response, default=str) + '\n').encode('utf-8'))
+			self.wfile.flush()
+
+# =============================================================================
+# if all addresses of the host are loopback addresses (only reachable from
+# the same machine)
+# =============================================================================
+def is_loopback_host(host):
+	try:
+		addresses = [info[4][0] for info in socket.getaddrinfo(host, None)]
+	except (socket.gaierror, UnicodeError):
+		return False
+	return len(addresses) > 0 and all(ipaddress.ip_address(address.split('%')[0]).is_loopback for address in addresses)
+
+# =============================================================================
+# keeps one warm process (or a warm pool of worker processes) alive to accept
+# conversion jobs over a local socket, jobs are run one at a time per process.
+# There is no authentication (a job reads and writes any files the server
+# user can), so only loopback hosts are accepted
+# =============================================================================
+class ConverterServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, host='127.0.0.1', port=47823, workers=1):
+		if not is_loopback_host(host):
+			raise ValueError("the server only accepts jobs on a loopback host (e.g. 127.0.0.1 or localhost), not %s" % host)
+		socketserver.ThreadingTCPServer.__init__(self, (host, port), ConverterRequestHandler)
+		self.workers = workers
+		self.lock = threading.Lock()
+		self.executor = None
+		if workers > 1:
+			self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+		else:
+			warm_up()
+
+	def submit(self, argv, cwd=None):
+		print('RECEIVED job: %s' % ' '.join(argv))
+		if self.executor is not None:
+			return self.executor.submit(run_server_job, argv, cwd).result()
+		with self.lock:
+			return run_server_job(argv, cwd)
+
+	def server_close(self):
+		socketserver.ThreadingTCPServer.server_close(self)
+		if self.executor is not None:
+			self.executor.shutdown(wait=True)
+
+def serve(host='127.0.0.1', port=47823, workers=1):
+	with ConverterServer(host, port, workers) as server:
+		print('SERVING conversion jobs on %s:%d with %d worker(s)' % (server.server_address[0], server.server_address[1], workers))
+		server.serve_forever()
+
+# =============================================================================
+# client side, sends one job (or command) to a running server and returns the
+# response of the server
+# =============================================================================
+def submit_job(argv=None, host='127.0.0.1', port=47823, cwd=None, command='convert', timeout=None):
+	request = {'command': command}
+	if command == 'convert':
+		request['argv'] = list(argv)
+		request['cwd'] = os.getcwd() if cwd is None else cwd
+	with socket.create_connection((host, port), timeout=timeout) as sock:
+		sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+		with sock.makefile('rb') as f:
+			return json.loads(f.readline().decode('utf-8'))
+
+# =============================================================================
+# the command line arguments of a job for the server, without the options to
+# reach the server
+# =============================================================================
+def get_server_job_argv(argv):
+	argv_job = []
+	skip_value = False
+	for arg in argv:
+		if skip_value:
+			skip_value = False
+		elif arg == '--submit_to_server':
+			continue
+		elif arg in ('--serve_host', '--serve_port'):
+			skip_value = True
+		elif not arg.startswith(('--serve_host=', '--serve_port=')):
+			argv_job.append(arg)
+	return argv_job
+
+def get_argument_parser(cwd=None):
 	# Instantiate the argument parser
 	parser = argparse.ArgumentParser(prog='zmax_edf_merge_converter.exe', description='This is useful software to reuse EDF from zmax to repackage the original exported EDFs and reparse them if necessary or zip them. Copyright 2022, Frederik D. Weber')
 
 	# Required positional argument
-	parser.add_argument('parent_dir_paths', type=dir_path_or_file,
-					help='A path or multiple paths to the parent folder where the data is stored and converted from (and by default also converted to)', nargs='+')
+	parser.add_argument('parent_dir_paths', type=path_type_in_dir(dir_path_or_file, cwd),
+					help='A path or multiple paths to the parent folder where the data is stored and converted from (and by default also converted to)', nargs='*')
 
 	# Optional argument
-	parser.add_argument('--write_redirection_path', type=dir_path_new,
+	parser.add_argument('--write_redirection_path', type=path_type_in_dir(dir_path_new, cwd),
 					help='An optional path to redirect writing to a different parent folder (so to not accidentally overwrite other files). Original folder structure is keept in the subfolders.')
 
 	# Switch
@@ -635,43 +3983,71 @@ if __name__ == "__main__":
 					help='Switch to indicate if ZMax PPGParser.exe is used to reparse some heart rate related channels. you also need to specify zmax_ppgparser_exe_path if it is not already in the current directory. This will take time to reprocess each data.')
 
 	# Optional argument
-	parser.add_argument('--zmax_ppgparser_exe_path', type=file_path,
+	parser.add_argument('--zmax_ppgparser_exe_path', type=path_type_in_dir(file_path, cwd),
 					help='direct and full path to the ZMax PPGParser.exe in the Hypnodyne ZMax software folder')
 
 	# Optional argument
 	parser.add_argument('--zmax_ppgparser_timeout_seconds', type=float,
 					help='An optional timeout to run the ZMax PPGParser.exe in seconds. If empty no timeout is used')
 
+	# Switch
+	parser.add_argument('--zmax_ppgparser_native', action='store_true',
+					help='Switch to indicate if --zmax_ppgparser should parse the heart rate in process instead of with PPGParser.exe (e.g. on Linux or to run several conversions in parallel, see --work_queue): the OXY_IR_AC and OXY_R_AC channels are band-pass filtered (0.5 to 4 Hz) and the beats are detected in chunks of a minute, giving the PARSED_OXY_IR_AC, PARSED_HR_ir and PARSED_HR_ir_strength channels (and the ones of OXY_R_AC). The channels are computed when reading in and no files are written next to the original data, the PARSED_NASAL channels are not parsed. Only used if given (not if PPGParser.exe is not found), the parser used is listed in the ppg_parser column of the summary (exe, exe_failed or native)')
+
 	# Switch
 	parser.add_argument('--zmax_edfjoin', action='store_true',
 					help='Switch to indicate if ZMax EDFJoin.exe is used to merge the converted ZMax EDF files. you also need to specify zmax_edfjoin_exe_path if it is not already in the current directory. This will take time to reprocess each data. Note that this will disable resampling or cleaning of empty channels or some skip some values in an entry of the summary csv')
 
 	# Optional argument
-	parser.add_argument('--zmax_edfjoin_exe_path', type=file_path,
+	parser.add_argument('--zmax_edfjoin_exe_path', type=path_type_in_dir(file_path, cwd),
 					help='direct and full path to the ZMax EDFJoin.exe in the Hypnodyne ZMax software folder')
 
 	# Optional argument
 	parser.add_argument('--zmax_edfjoin_timeout_seconds', type=float,
 					help='An optional timeout to run the ZMax EDFJoin.exe in seconds. If empty no timeout is used')
 
+	# Switch
+	parser.add_argument('--zmax_edfjoin_native', action='store_true',
+					help='Switch to indicate if --zmax_edfjoin should join the ZMax EDF files in process instead of with EDFJoin.exe (e.g. on Linux or to run several conversions in parallel): the raw data records of the channel files are interleaved into one EDF+ file without decoding them and directly written to the temporary export path, cropping is applied. Used automatically if EDFJoin.exe is not found')
+
 	# Switch
 	parser.add_argument('--zmax_eegcleaner', action='store_true',
 					help='Switch to indicate if ZMax EDFCleaner.exe is used to clean the EEG channels from SD-card writing noise in 85.33 Hz and higher and lower harmonics (e.g. 42.66, 21.33, 10.66, 5.33 Hz...) you also need to specify zmax_eegcleaner_exe_path if it is not already in the current directory. This will take time to reprocess each data.')
 
 	# Optional argument
-	parser.add_argument('--zmax_eegcleaner_exe_path', type=file_path,
+	parser.add_argument('--zmax_eegcleaner_exe_path', type=path_type_in_dir(file_path, cwd),
 					help='direct and full path to the ZMax EDFCleaner.exe in the Hypnodyne ZMax software folder')
 
 	# Optional argument
 	parser.add_argument('--zmax_eegcleaner_timeout_seconds', type=float,
 					help='An optional timeout to run the ZMax EDFCleaner.exe in seconds. If empty no timeout is used')
 
+	# Optional argument
+	parser.add_argument('--tool_cache_dir', type=str,
+					help='An optional path to a cache directory (created if it does not exist yet) for the output files of PPGParser.exe and EDFCleaner.exe: the outputs are cached by the content of the input channel files and of the tool, and are copied from the cache (instead of running the tool again) when the same recording is reprocessed, e.g. with other output options. The cache can be shared by several runs and nodes')
+
+	# Optional argument
+	parser.add_argument('--tool_cache_max_GB', type=float, default=10.0,
+					help='The maximum size of the --tool_cache_dir in GB, the least recently used outputs are removed when it is larger. Default is 10.0')
+
+	# Optional argument
+	parser.add_argument('--output_store_dir', type=str,
+					help='An optional path to a content-addressed store (created if it does not exist yet, best on the same drive as the written files) of the written files: each file is kept in the store under the key of its signals after conversion (and start time, writer and name in the zip) and the written file is a hard link to it. A duplicate recording (e.g. offloaded several times) is then linked instead of written and zipped again. The written paths are recorded as references of the stored files. Needs the signal hashing (not with --no_signal_hashing or --zmax_edfjoin). Note that the linked files share their content, i.e. they should not be changed in place')
+
+	# Switch
+	parser.add_argument('--output_store_cleanup', action='store_true',
+					help='Switch to indicate if the files of the --output_store_dir that are not referenced anymore (all their written files were removed or replaced) should be removed before converting. Run it when no other conversion writes into the same store')
+
+	# Switch
+	parser.add_argument('--zmax_eegcleaner_native', action='store_true',
+					help='Switch to indicate if --zmax_eegcleaner should clean the EEG channels in process instead of with EDFCleaner.exe (e.g. on Linux or to run several conversions in parallel): the SD-card writing noise (85.33 Hz and its harmonics, repeating every 48 samples) is averaged per minute of EEG and subtracted, on all cores. The EEG L Cleaned and EEG R Cleaned channels are computed when reading in and no files are written next to the original data. Only used if given (not if EDFCleaner.exe is not found), the cleaner used is listed in the eeg_cleaner column of the summary (exe, exe_failed or native)')
+
 	# Switch
 	parser.add_argument('--zmax_raw_hyp_file', action='store_true',
 					help='Switch to indicate if ZMax HDRecorder.exe is used to convert from .hyp files moved from the SD card. you need to specify zmax_hdrecorder_exe_path if it is not already in the current directory. This will take time to reprocess each data.')
 
 	# Optional argument
-	parser.add_argument('--zmax_hdrecorder_exe_path', type=file_path,
+	parser.add_argument('--zmax_hdrecorder_exe_path', type=path_type_in_dir(file_path, cwd),
 					help='direct and full path to the ZMax HDRecorder.exe in the Hypnodyne ZMax software folder')
 
 	# Optional argument
@@ -690,10 +4066,26 @@ if __name__ == "__main__":
 	parser.add_argument('--temp_file_postfix', type=str,
 					help='file name post fix for the written files or directories that are not completely written yet. Default is \"_TEMP_\"')
 
+	# Optional argument
+	parser.add_argument('--scratch_dir', type=str,
+					help='An optional path to a directory (created if it does not exist yet, e.g. on a RAM disk or tmpfs) for the intermediate files that are removed after the conversion: the extracted zip files, the .hyp files converted by HDRecorder.exe (unless --zmax_raw_hyp_keep_edf) and the EDF before it is zipped with --write_zip. The exported files are always staged next to their final path and atomically replaced. Default is the temporary directory of the system')
+
+	# Optional argument
+	parser.add_argument('--fsync', type=str, default='none', choices=['none', 'file', 'all'],
+					help='When to flush the exported files to the disk before they are atomically replaced by their final name: \"none\" leaves it to the operating system, \"file\" flushes each exported file and \"all\" also its directory entry, so that a final file is complete even after a power loss. Default is \"none\"')
+
 	# Optional argument
 	parser.add_argument('--resample_Hz', type=float,
 					help='An optional resample frequency for the written EDF data.')
 
+	# Optional argument
+	parser.add_argument('--crop_start', type=str,
+					help='An optional start of the time window to convert, either in seconds relative to the start of the recording (meas_date) or as an absolute date time, e.g. --crop_start=\"2022-05-01 22:00:00\". Only the EDF data records that cover the window are read from each channel file (also from the zipped ones).')
+
+	# Optional argument
+	parser.add_argument('--crop_end', type=str,
+					help='An optional end of the time window to convert, either in seconds relative to the start of the recording (meas_date) or as an absolute date time, e.g. --crop_end=\"2022-05-02 08:00:00\". See also --crop_start')
+
 	# Switch
 	parser.add_argument('--zmax_lite', action='store_true',
 					help='Switch to indicate if the device is a ZMax lite version and not all channels have to be included')
@@ -710,6 +4102,10 @@ if __name__ == "__main__":
 	parser.add_argument('--no_write', action='store_true',
 					help='Switch to indicate if files should be written out or not.')
 
+	# Switch
+	parser.add_argument('--inventory', action='store_true',
+					help='Switch to indicate if only an inventory of the recordings should be taken for the summary (e.g. to audit a large archive), much faster than --no_write: only the EDF headers (and the central directory of zip files) are read, and the last data record of BATT.edf. The start and stop time, duration, number of samples, the channels and the battery voltage at the end are filled in the summary, nothing is read in, hashed or written')
+
 	# Switch
 	parser.add_argument('--no_overwrite', action='store_true',
 					help='Switch to indicate if files should be overwritten if existent')
@@ -722,6 +4118,14 @@ if __name__ == "__main__":
 	parser.add_argument('--no_file_hashing', action='store_true',
 					help='Switch to indicate if the file hash (i.e. MD5 sum) should be calculated (to compare if data is the same for same hash)')
 
+	# Optional argument
+	parser.add_argument('--file_hash_mode', type=str, default='full', choices=['full', 'sampled', 'zip_crc'],
+					help='How the file hash is calculated, full reads the whole file, sampled only hashes the file size and the first 4, the last 4 and 8 evenly spaced 64 KiB chunks of it, which takes the same short time regardless of the file size (for quick integrity and duplicate scans of large archives, but the hash then differs from the MD5 sum of the file). zip_crc hashes zip files from the names, uncompressed sizes and CRC32 of their EDF members in the central directory without decompressing anything (the same recording zipped twice, with another compression or other time stamps, gets the same hash), with --read_zip duplicate zip files are then found (and skipped with --skip_duplicate_fingerprints) before they are extracted, other files are hashed as with full. Default is full')
+
+	# Switch
+	parser.add_argument('--verify_zip_crc', action='store_true',
+					help='Switch to also check the CRC32 of the EDF members that are cropped (with --crop_start or --crop_end) during the extraction with --read_zip, these are then decompressed to their end. Completely extracted members are always checked')
+
 	# Switch
 	parser.add_argument('--no_signal_hashing', action='store_true',
 					help='Switch to indicate if the signal data hash should be calculated (to compare if data is the same for same hash)')
@@ -734,648 +4138,141 @@ if __name__ == "__main__":
 	parser.add_argument('--write_zip', action='store_true',
 					help='Switch to indicate if the output edfs should be zipped in one .zip file')
 
-	args = parser.parse_args()
-
-	parent_dir_paths = [pathlib.Path().resolve()] # the current working directory
-	if args.parent_dir_paths is not None:
-		parent_dir_paths = args.parent_dir_paths
-
-	write_redirection_path = None
-	if args.write_redirection_path is not None:
-		write_redirection_path = args.write_redirection_path
-
-	exclude_empty_channels = False
-	if args.exclude_empty_channels is not None:
-		exclude_empty_channels = args.exclude_empty_channels
-
-	isliteversion = False
-	if args.zmax_lite is not None:
-		isliteversion = args.zmax_lite
-
-	read_only_EEG = False
-	if args.read_only_EEG is not None:
-		read_only_EEG = args.read_only_EEG
-
-	read_only_EEG_BATT = False
-	if args.read_only_EEG_BATT is not None:
-		read_only_EEG_BATT = args.read_only_EEG_BATT
-	
-	write_zip = False
-	if args.write_zip is not None:
-		write_zip = args.write_zip
-
-	read_zip = False
-	if args.read_zip is not None:
-		read_zip = args.read_zip
-
-	zipfile_match_string = ''
-	if args.zipfile_match_string is not None:
-		zipfile_match_string = args.zipfile_match_string
-
-	zipfile_nonmatch_string = ''
-	if args.zipfile_nonmatch_string is not None:
-		zipfile_nonmatch_string = args.zipfile_nonmatch_string
-
-	no_write = False
-	if args.no_write is not None:
-		no_write = args.no_write
-
-	no_overwrite = False
-	if args.no_overwrite is not None:
-		no_overwrite = args.no_overwrite
-
-	no_summary_csv = False
-	if args.no_summary_csv is not None:
-		no_summary_csv = args.no_summary_csv
-
-	no_file_hashing = False
-	if args.no_file_hashing is not None:
-		no_file_hashing = args.no_file_hashing
-
-	no_signal_hashing = False
-	if args.no_signal_hashing is not None:
-		no_signal_hashing = args.no_signal_hashing
-
-	file_hashing = not no_file_hashing
-	signal_hashing = not no_signal_hashing
-
-	zmax_ppgparser = False
-	if args.zmax_ppgparser is not None:
-		zmax_ppgparser = args.zmax_ppgparser
-
-	zmax_ppgparser_exe_path = application_path + os.sep + 'PPGParser.exe' # in the current working directory
-	if args.zmax_ppgparser_exe_path is not None:
-		zmax_ppgparser_exe_path = args.zmax_ppgparser_exe_path
-
-	zmax_ppgparser_timeout_seconds = None # in seconds
-	if args.zmax_ppgparser_timeout_seconds is not None:
-		zmax_ppgparser_timeout_seconds = args.zmax_ppgparser_timeout_seconds
-
-	zmax_eegcleaner = False
-	if args.zmax_eegcleaner is not None:
-		zmax_eegcleaner = args.zmax_eegcleaner
-
-	zmax_eegcleaner_exe_path = application_path + os.sep + 'EDFCleaner.exe' # in the current working directory
-	if args.zmax_eegcleaner_exe_path is not None:
-		zmax_eegcleaner_exe_path = args.zmax_eegcleaner_exe_path
-
-	zmax_eegcleaner_timeout_seconds = None # in seconds
-	if args.zmax_eegcleaner_timeout_seconds is not None:
-		zmax_eegcleaner_timeout_seconds = args.zmax_eegcleaner_timeout_seconds
-
-	zmax_edfjoin = False
-	if args.zmax_edfjoin is not None:
-		zmax_edfjoin = args.zmax_edfjoin
-
-	zmax_edfjoin_exe_path = application_path + os.sep + 'EDFJoin.exe' # in the current working directory
-	if args.zmax_edfjoin_exe_path is not None:
-		zmax_edfjoin_exe_path = args.zmax_edfjoin_exe_path
-
-	zmax_edfjoin_timeout_seconds = None # in seconds
-	if args.zmax_edfjoin_timeout_seconds is not None:
-		zmax_edfjoin_timeout_seconds = args.zmax_edfjoin_timeout_seconds
-
-	zmax_raw_hyp_file = False
-	if args.zmax_raw_hyp_file is not None:
-		zmax_raw_hyp_file = args.zmax_raw_hyp_file
-
-	zmax_hdrecorder_exe_path = application_path + os.sep + 'HDRecorder.exe' # in the current working directory
-	if args.zmax_hdrecorder_exe_path is not None:
-		zmax_hdrecorder_exe_path = args.zmax_hdrecorder_exe_path
-
-	hdrecorder_SDConvert_folder_path = fileparts(zmax_hdrecorder_exe_path)[0] + os.sep + 'SDConvert'
-
-	zmax_hdrecorder_timeout_seconds = None # in seconds
-	if args.zmax_hdrecorder_timeout_seconds is not None:
-		zmax_hdrecorder_timeout_seconds = args.zmax_hdrecorder_timeout_seconds
-
-	zmax_raw_hyp_keep_edf = False
-	if args.zmax_raw_hyp_keep_edf is not None:
-		zmax_raw_hyp_keep_edf = args.zmax_raw_hyp_keep_edf
-
-	resample_Hz = None
-	if args.resample_Hz is not None:
-		resample_Hz = args.resample_Hz
-
-	write_name_postfix = "_merged"
-	if args.write_name_postfix is not None:
-		write_name_postfix = args.write_name_postfix
-
-	temp_file_postfix = "_TEMP_"
-	if args.temp_file_postfix is not None:
-		temp_file_postfix = args.temp_file_postfix
-
-	#if len(sys.argv) != 3:
-	#	print('expecting path to a parent folders with zmax edfs converted from HDrecorder as the only argument')
-	#	exit(0)
-
-	only_post_process_csv_summary_file = False
-	if not no_summary_csv:
-		filepath_csv_summary_file =  application_path + os.sep + 'zmax_edf_merge_converter_summary_' + datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f") + '.csv'
-
-	#parentdirpath = sys.argv[1]
-	nFileProcessed = 0
-	processing_started = False
-	for parentdirpath in parent_dir_paths:
-		read_zip_temp = read_zip
-		zmax_raw_hyp_file_temp = zmax_raw_hyp_file
-		do_find = True
-		filepath_list = []
-		if os.path.isfile(parentdirpath):
-			p, n, e = fileparts(parentdirpath)
-			if e.lower() == ".zip":
-				read_zip_temp = True
-				filepath_list = [parentdirpath]
-				do_find = False
-			elif e.lower() == ".hyp":
-				read_zip_temp = False
-				zmax_raw_hyp_file_temp = True
-				filepath_list = [parentdirpath]
-				do_find = False
-			elif (e.lower() == ".csv") and (len(parent_dir_paths) == 1):
-				filepath_csv_summary_file = parentdirpath
-				only_post_process_csv_summary_file = True
-				do_find = False
-				break
-			else:
-				#filepath_list = [] # do not process
-				continue
-				#parentdirpath = p
-			#if e.lower() != ".edf":
-			#	read_zip_temp = False
-			#	parentdirpath = p
-		else:
-			try:
-				parentdirpath = dir_path(parentdirpath)
-			except NotADirectoryError:
-				print("argument '%s' is not a directory" %parentdirpath)
-				continue #exit(0)
-
-			if parentdirpath is None:
-				print("argument '%s' is not parsable" %parentdirpath)
-				continue #exit(0)
-
-			if do_find:
-				print("Finding file paths...")
-				filepath_list = find_zmax_files(parentdirpath, readzip=read_zip_temp, zipfile_match_string=zipfile_match_string, zipfile_nonmatch_string=zipfile_nonmatch_string, find_hyp_files=zmax_raw_hyp_file_temp)
-
-		print("FOUND %d matching file paths " % len(filepath_list))
-		for iFn, fn in enumerate(filepath_list):
-			print("%d: %s" % (iFn, fn))
-
-		if len(filepath_list) < 1:
-			print("no zmax files found")
-			#exit(0)
-
-		number_of_conversions = len(filepath_list)
-		for i, filepath_outer in enumerate(filepath_list):
-			rm_dir_list = []
-			temp_dir_needs_removal = False
-			filepath_ori = filepath_outer
-			cleanup_tempdir_hyp_convert = False
-
-			if not no_summary_csv:
-				if not processing_started:
-					csv_summary_file =  open(filepath_csv_summary_file, 'w', newline='')
-					writer = csv.writer(csv_summary_file, delimiter=',', quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
-					header_new = ['file_number', 'conversion_status', 'conversion_datetime', 'zmax_file_path_original_outer', 'zmax_file_path_original', 'hash_zmax_file_path_original_md5', 'converted_file_path', 'hash_converted_file_path_md5', 'rec_start_datetime', 'rec_stop_datetime', 'rec_duration_datetime', 'rec_duration_seconds', 'rec_duration_original_samples', 'rec_battery_at_end_voltage', 'hash_signals_before_conversion', 'hash_signals_after_conversion']
-					writer.writerow(header_new)
-					processing_started = True
-
-			print("PROCESSING %d of %d: '%s' " % (i+1, number_of_conversions, filepath_outer))
-
-			conversion_datetime = datetime.datetime.now()#.strftime("%Y-%m-%d %H:%M:%S:%f")
-			read_zip_temp_reset = False
-			filepaths = []
-			export_filepaths = []
-			if zmax_raw_hyp_file_temp and zmax_hdrecorder_exe_path is not None:
-				print('ATTEMPT to convert .hyp file using HDRecorder: ' + filepath_outer)
-				p, n, e = fileparts(filepath_outer)
-				zmax_convert_edf_dir_path = p + os.sep + n
-				filepath_list_hyps = []
-				if read_zip_temp:
-					read_zip_temp_reset = True
-					try:
-						temp_dir = safe_zip_dir_extract(filepath_outer)
-						temp_dir_needs_removal = True
-						fileendings = ('*.hyp', '*.HYP')
-						for fileending in fileendings:
-							filepath_list_hyps.extend(glob.glob(temp_dir.name + os.sep + "**" + os.sep + fileending, recursive=True))
-						#safe_zip_dir_cleanup(temp_dir)
-					except Exception:
-						print(traceback.format_exc())
-						print('FAILED to convert the zipped hyp files in ' + filepath_outer)
-						break
-				else:
-					filepath_list_hyps.extend([filepath_outer])
-				try:
-					for fp in filepath_list_hyps:
-						exec_string =  "\"" + zmax_hdrecorder_exe_path + "\"" + " -conv " + "\"" + fp + "\""
-						subprocess.run(exec_string, shell=False, timeout=zmax_hdrecorder_timeout_seconds)
+	# Switch
+	parser.add_argument('--compact', action='store_true',
+					help='Switch to indicate if the recordings should be read, processed and written in a compact form without mne: the samples are kept as the 16 bit (digital) values of the EDFs (or 32 bit floats when resampled, with scipy.signal.resample_poly) instead of 64 bit floats, which needs 4 to 8 times less memory. The signal hashes are then computed per channel on these values (and so differ from the ones without --compact)')
 
-						if (fileparts(filepath_outer)[2].lower() == ".zip") and read_zip_temp:
-							pp, nn, ee = fileparts(zmax_convert_edf_dir_path + fp.replace(temp_dir.name,""))
-							zmax_convert_edf_dir_path_temp = pp + os.sep + nn + temp_file_postfix
-						else:
-							zmax_convert_edf_dir_path_temp = zmax_convert_edf_dir_path + temp_file_postfix
-						#os.makedirs(zmax_convert_edf_dir_path_temp, exist_ok=True)
-
-						if write_redirection_path is not None:
-							parentdirpath_temp = get_dir_path(parentdirpath)
-							indFound = zmax_convert_edf_dir_path_temp.find(parentdirpath_temp)
-							if indFound >= 0:
-								zmax_convert_edf_dir_path_temp = write_redirection_path + zmax_convert_edf_dir_path_temp[(indFound+len(parentdirpath_temp)):]
-								path_create(zmax_convert_edf_dir_path_temp, isFile=False)
-						try:
-							shutil.rmtree(zmax_convert_edf_dir_path_temp)
-						except Exception:
-							print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % zmax_convert_edf_dir_path_temp)
-							print(traceback.format_exc())
-						dirpath_add = shutil.move(hdrecorder_SDConvert_folder_path, zmax_convert_edf_dir_path_temp)
-						filepath_add = dirpath_add + os.sep + 'EEG L.edf'
-						fnp, fnn, fne = fileparts(fp)
-						if fileparts(filepath_outer)[2].lower() == ".zip" and read_zip_temp:
-							export_filepath_inner_hyp = pp + os.sep + nn + write_name_postfix
-						else:
-							export_filepath_inner_hyp = p + os.sep + n + write_name_postfix
-						filepaths.append(filepath_add)
-						export_filepaths.append(export_filepath_inner_hyp)
-						cleanup_tempdir_hyp_convert = True
-						rm_dir_list.extend([hdrecorder_SDConvert_folder_path, dirpath_add])
-				except Exception:
-					print(traceback.format_exc())
-					print('FAILED to convert the hyp file ' + filepath_outer)
-					break
-			else:
-				filepaths.append(filepath_outer)
-
-			for iFilePath, filepath in enumerate(filepaths):
-				md5_signal_hash_before_conversion = 'not_computed'
-				md5_file_original_hash = 'not_computed'
-				md5_signal_hash_after_conversion = 'not_computed'
-				md5_file_converted_hash = 'not_computed'
-				rec_start_datetime = 'not_retrieved'
-				rec_stop_datetime = 'not_retrieved'
-				rec_duration_datetime = 'not_retrieved'
-				rec_battery_at_end = 'not_retrieved'
-				conversion_status = 'not_converted'
-				export_filepath_final = ''
-				rec_duration_seconds = None
-				rec_n_samples = None
-				nFileProcessed += 1
-				path, name, extension = fileparts(filepath)
-				parentfoldername = os.path.basename(path)
-				pathup, nametmp, extensiontmp = fileparts(path)
-
-				format = "zmax_edf"
-				zmax_edfjoin_move_path_subdir = None
-
-				rm_dir_list_inner = []
-
-				drop_channels = []
-				if isliteversion:
-					drop_channels = ['BODY TEMP', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_NASAL L', 'PARSED_OXY_R_AC', 'PARSED_HR_r', 'PARSED_HR_r_strength']
-				if read_only_EEG:
-					drop_channels = ['BATT', 'BODY TEMP', 'dX', 'dY', 'dZ', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_IR_AC', 'OXY_IR_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_OXY_IR_AC', 'PARSED_NASAL L', 'PARSED_HR_r', 'PARSED_HR_r_strength', 'PARSED_OXY_R_AC', 'PARSED_HR_ir', 'PARSED_HR_ir_strength']
-				if read_only_EEG_BATT:
-					drop_channels = ['BODY TEMP', 'dX', 'dY', 'dZ', 'LIGHT', 'NASAL L', 'NASAL R', 'NOISE', 'OXY_DARK_AC', 'OXY_DARK_DC', 'OXY_IR_AC', 'OXY_IR_DC', 'OXY_R_AC', 'OXY_R_DC', 'RSSI', 'PARSED_NASAL R', 'PARSED_OXY_IR_AC', 'PARSED_NASAL L', 'PARSED_HR_r', 'PARSED_HR_r_strength', 'PARSED_OXY_R_AC', 'PARSED_HR_ir', 'PARSED_HR_ir_strength']
-				try:
-					if export_filepaths:
-						export_filepath = export_filepaths[iFilePath]
-					else:
-						if read_zip_temp:
-							export_filepath = path + os.sep + name + write_name_postfix
-						else:
-							export_filepath = pathup + os.sep +  parentfoldername + write_name_postfix
-
-					if write_redirection_path is not None:
-						parentdirpath_temp = get_dir_path(parentdirpath)
-						indFound = export_filepath.find(parentdirpath_temp)
-						if indFound >= 0:
-							export_filepath = write_redirection_path + export_filepath[(indFound+len(parentdirpath_temp)):]
-							#if write_zip:
-							path_create(export_filepath, isFile=True)
-							#else:
-							#	path_create(export_filepath,isFile=True)
-
-					export_filepath_unfinished = export_filepath + temp_file_postfix
-
-					if write_zip:
-						export_filepath_final_to_rename = export_filepath_unfinished + ".zip"
-					else:
-						export_filepath_final_to_rename = export_filepath_unfinished + ".edf"
+	# Switch
+	parser.add_argument('--out_of_core', action='store_true',
+					help='Switch to indicate if the recordings should be converted out of core (implies --compact), e.g. for multi-day recordings that do not fit into memory: the channel EDFs are read, aligned, resampled, hashed, checked for flat channels and written in time blocks of --block_seconds, so the memory used is bounded by the block size and not by the recording length. The output and the signal hashes are the same as with --compact')
 
-					export_filepath_final = export_filepath_final_to_rename.replace(temp_file_postfix,'')
+	# Optional argument
+	parser.add_argument('--block_seconds', type=int, default=600,
+					help='The length in seconds of the time blocks of --out_of_core. Default is 600')
 
-					if no_overwrite:
-						if os.path.exists(export_filepath_final):
-							print('skipping file: %s' % export_filepath_final)
-							continue
+	# Switch
+	parser.add_argument('--native_rates', action='store_true',
+					help='Switch to indicate if the channels should be written at their own sampling rate (implies --compact) instead of resampling all of them to 256 Hz, e.g. a BATT channel of 32 Hz stays at 32 Hz in the merged EDF (EDF data records can hold a different number of samples for each channel), which saves the resampling and makes the output smaller. Only channels with whole samples per second keep their rate. With --resample_Hz all channels are still resampled')
 
-					#reading
-					no_read = False
-					if zmax_edfjoin:
-						format = "zmax_edf_join"
-						path_temp, name_temp, ext_temp = fileparts(export_filepath_final_to_rename)
-						subdir_temp = path_temp + os.sep + temp_file_postfix
-						finaldir_temp = path_temp + os.sep
-						dir_path_create(subdir_temp)
-						zmax_edfjoin_move_path_subdir = subdir_temp + os.sep + name_temp + ".edf"
-						no_read = True
-						if no_write:
-							continue
+	# Optional argument
+	parser.add_argument('--write_workers', type=int, default=1,
+					help='Number of threads that write the data records of a --compact recording (-1 for all cores). With other than 1 the merged EDF is preallocated from its header and memory-mapped, and the threads copy the samples of different data records into their slots in parallel (the file is the same). For many channels on fast storage and several cores. Out-of-core recordings (--out_of_core) are always written by one thread. Default is 1')
 
-					if read_zip_temp and (not read_zip_temp_reset):
-						raw = read_edf_to_raw_zipped(filepath, format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_edfjoin_exe_path=zmax_edfjoin_exe_path, zmax_edfjoin_timeout_seconds=zmax_edfjoin_timeout_seconds, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=zmax_edfjoin_move_path_subdir, no_read=no_read, drop_zmax=drop_channels)
-					else:
-						raw = read_edf_to_raw(filepath, format=format, zmax_ppgparser=zmax_ppgparser, zmax_ppgparser_exe_path=zmax_ppgparser_exe_path, zmax_ppgparser_timeout_seconds=zmax_ppgparser_timeout_seconds, zmax_eegcleaner=zmax_eegcleaner, zmax_eegcleaner_exe_path=zmax_eegcleaner_exe_path, zmax_eegcleaner_timeout_seconds=zmax_eegcleaner_timeout_seconds, zmax_edfjoin_exe_path=zmax_edfjoin_exe_path, zmax_edfjoin_timeout_seconds=zmax_edfjoin_timeout_seconds, zmax_edfjoin_keep=False, zmax_edfjoin_move_path=zmax_edfjoin_move_path_subdir, no_read=no_read, drop_zmax = drop_channels)
+	# Switch
+	parser.add_argument('--verify', action='store_true',
+					help='Switch to indicate if the written EDF (or zip) should be verified against the source channel EDFs after the conversion. Both are streamed record by record and compared on the digital values (1 digital step tolerance), the first mismatch of every channel is reported and the result is listed in the verify_status column of the summary. Resampled channels are not verified')
 
+	# Optional argument
+	parser.add_argument('--quality_csv', type=str,
+					help='An optional path to a csv file to write the signal quality of every channel of every recording into (appended to if it exists): minimum, maximum, clipped part (at the digital minimum or maximum, only with --compact or --out_of_core), flat part, rms and the part of the power at 50 Hz and 60 Hz (line noise), all computed in one pass over the merged data before resampling. The battery discharge curve (mean BATT voltage of every minute) is written to a second csv file next to it with the postfix _battery')
 
+	# Optional argument
+	parser.add_argument('--summary_db', type=str,
+					help='An optional path to a persistent summary database (sqlite, created if not existent) where the summary rows of all runs are collected. Each new row is checked with an index lookup for duplicates (file hashes, signal hashes and duration) in all previous runs. The summary csv is still written unless --no_summary_csv')
 
-					print("READ %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
-					conversion_status = 'read_in'
+	# Switch
+	parser.add_argument('--skip_duplicate_fingerprints', action='store_true',
+					help='Switch to indicate if recordings should be skipped (before reading them) whose pre-load fingerprint (start time, number of records and channel set and a few sampled data records of EEG L.edf) duplicates the one of a recording earlier in this run or in the --summary_db of earlier runs. Skipped recordings are listed in the summary with the status skipped_duplicate_fingerprint')
 
+	# Optional argument
+	parser.add_argument('--resume', type=str,
+					help='An optional path to a run journal (created if it does not exist yet) that records the completed stages of every recording. Running again with the same --resume journal after an interruption (e.g. a crash or reboot) skips the finished recordings, removes the left temporary files of unfinished ones and appends the rows to the summary csv file of the first run')
 
-					if zmax_edfjoin:
-						zmax_edfjoin_move_path_subdir = raw
-						if raw is None:
-							continue
-						joined_filepath_moved_to_rename = zmax_edfjoin_move_path_subdir.replace(temp_file_postfix+os.sep,'')
-						#joined_filepath_moved_final = joined_filepath_moved_final.replace(temp_file_postfix,'')
-						try:
-							if not write_zip:
-								export_filepath_final_to_rename = shutil.move(zmax_edfjoin_move_path_subdir, joined_filepath_moved_to_rename)
-							else:
-								path_tmp, name_tmp, ext_tmp = fileparts(zmax_edfjoin_move_path_subdir)
-								name_tmp_final = name_tmp.replace(temp_file_postfix,'')
-								joined_filepath_moved_final_subdir_final = path_tmp + os.sep + name_tmp_final + ext_tmp
-								joined_filepath_moved_final_subdir_final = shutil.move(zmax_edfjoin_move_path_subdir, joined_filepath_moved_final_subdir_final)
-								path_temp, name_temp, ext_temp = fileparts(joined_filepath_moved_final_subdir_final)
-								joined_filepath_moved_final_subdir_final_zip = path_temp + os.sep + name_temp + temp_file_postfix + '.zip'
-								joined_filepath_moved_final_subdir_final_zip = zip_file(joined_filepath_moved_final_subdir_final, joined_filepath_moved_final_subdir_final_zip, deletefile=True, compresslevel=6)
-								#os.remove(joined_filepath_moved_final_subdir_final)
-								export_filepath_final_to_rename = joined_filepath_moved_final_subdir_final_zip.replace(temp_file_postfix+os.sep,'')
-								shutil.move(joined_filepath_moved_final_subdir_final_zip, export_filepath_final_to_rename)
-								try:
-									shutil.rmtree(path_tmp, ignore_errors=True)
-								except Exception:
-									rm_dir_list_inner.extend([path_tmp])
-									print('FAILED TO remove temporary folder %s for filepath %s but will try again once more later.' % (path_tmp, filepath))
-									print(traceback.format_exc())
-						except Exception:
-							print('FAILED TO MOVE or ZIP THE file %s to %s or its zipped form.' % (filepath, joined_filepath_moved_to_rename))
-							print(traceback.format_exc())
-					else:
-						# data hashing pre
-						if signal_hashing:
-							print("HASHING SIGNAL OF FILE %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
-							md5_signal_hash_before_conversion = get_raw_data_hash(raw, hash_function=hashlib.md5)
-							print("MD5 SIGNAL HASH: " + md5_signal_hash_before_conversion)
-							#raw_short_ori = raw.copy()
-							#raw_short_ori.crop(tmin=0, tmax=60*4)
-							#md5_signal_hash_before_conversion_short_ori = get_raw_data_hash(raw_short_ori, hash_function=hashlib.md5)
-							#raw_short_crop = raw.copy()
-							#raw_short_crop.crop(tmin=2.671875, tmax=60*4)
-							#md5_signal_hash_before_conversion_short_crop = get_raw_data_hash(raw_short_crop, hash_function=hashlib.md5)
-
-						rec_start_datetime = raw.info['meas_date']
-						rec_stop_datetime = rec_start_datetime + datetime.timedelta(seconds=(raw._last_time - raw._first_time))
-						rec_duration_datetime = datetime.timedelta(seconds=(raw._last_time - raw._first_time))
-						rec_duration_seconds = rec_duration_datetime.total_seconds()
-						rec_n_samples = raw.n_times
-						rec_battery_at_end = raw_zmax_data_quality(raw)
-
-						if exclude_empty_channels:
-							flat_channel_names = []
-							for iCh, ch_name in enumerate(raw.info['ch_names']):
-								ch_name = raw.info['ch_names'][iCh]
-								nNotFlat = numpy.count_nonzero(raw._data[iCh]-statistics.median(raw._data[iCh])) # this is fastest so far
-								if nNotFlat <= 10:
-									flat_channel_names.append(ch_name)
-							raw.drop_channels(flat_channel_names)
-
-						if resample_Hz is not None:
-							raw = raw.resample(resample_Hz)
-
-						sampling_rate_final_Hz = raw.info['sfreq']
-
-						# file hashing original
-						if file_hashing:
-							print("HASHING FILE %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
-							md5_file_original_hash = get_file_hash(filepath, chunk_size_bytes=65536, hash_function=hashlib.md5)
-							print("MD5 FILE HASH: " + md5_file_original_hash)
-
-						# data hashing post
-						if signal_hashing:
-							print("HASHING SIGNAL (after conversion) OF FILE %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
-							md5_signal_hash_after_conversion = get_raw_data_hash(raw, hash_function=hashlib.md5)
-							print("MD5 SIGNAL HASH: " + md5_signal_hash_after_conversion)
-
-						conversion_status = 'read_in_processed'
-
-					#writing
-					if not no_write:
-						# check again just before writing
-						if no_overwrite:
-							if os.path.exists(export_filepath_final):
-								print('skipping file: %s' % export_filepath_final)
-								continue
-						print("Attempting to write %d of %d: '%s' " % (i+1, number_of_conversions, export_filepath_final))
-						if not zmax_edfjoin:
-							if write_zip:
-								export_filepath_final_to_rename_2 = write_raw_to_edf_zipped(raw, export_filepath_final_to_rename, edf_filename=export_filepath_final, format="zmax_edf") # treat as a speacial zmax read EDF for export
-							else:
-								export_filepath_final_to_rename_2 = write_raw_to_edf(raw, export_filepath_final_to_rename, format="zmax_edf")  # treat as a speacial zmax read EDF for export
-							conversion_status = 'read_in_processed_written_temp'
-						try:
-							# check again just before writing
-							if no_overwrite:
-								os.rename(export_filepath_final_to_rename, export_filepath_final)
-							else:
-								if os.path.exists(export_filepath_final):
-									try:
-										os.remove(export_filepath_final)
-									except FileNotFoundError:
-										pass
-								shutil.move(export_filepath_final_to_rename, export_filepath_final)
-							print("WROTE successfully %d of %d: '%s' " % (i+1, number_of_conversions, export_filepath_final))
-							conversion_status = 'read_in_processed_written_converted'
-							# file hashing converted
-							if file_hashing:
-								print("HASHING FILE after conversion %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
-								md5_file_converted_hash = get_file_hash(export_filepath_final, chunk_size_bytes=65536, hash_function=hashlib.md5)
-								print("MD5 FILE after conversion HASH: " + md5_file_converted_hash)
-						except:
-							print('FAILED TO RENAME FINAL FILE %s FROM TEMPORARY FILE' % (export_filepath_final))
-							print(traceback.format_exc())
-							#finally remove the temporary file if exists
-						try:
-							try:
-								os.remove(export_filepath_final_to_rename)
-							except FileNotFoundError:
-								pass
-						except:
-							print('FAILED TO DELETE THE LEFT TEMPORARY FILE: %s' % export_filepath_final_to_rename)
-							print(traceback.format_exc())
+	# Optional argument
+	parser.add_argument('--summary_db_export_csv', type=str,
+					help='An optional path to export the whole summary database of --summary_db as a csv file (after the conversion). No parent_dir_paths are needed just for the export.')
 
-				except Exception as e:
-					print(traceback.format_exc())
-					print("FAILED %d of %d: '%s' " % (i+1, number_of_conversions, filepath))
+	# Switch
+	parser.add_argument('--serve', action='store_true',
+					help='Switch to start a long running server that keeps the process (or --serve_workers processes) warm and accepts conversion jobs over a local socket at --serve_host and --serve_port. A job uses the same options as the command line, see --submit_to_server, except the *_exe_path and the --serve* options, which are rejected (the server only runs the external programs next to itself). Relative paths of a job are taken in the working directory of the client. The server has no authentication and a job reads and writes files as the user of the server, so it only listens on a loopback host (--serve_host), other hosts are refused. No parent_dir_paths are needed.')
 
-				for dp in rm_dir_list_inner:
-					try:
-						shutil.rmtree(dp)
-					except Exception:
-						print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % dp)
-						print(traceback.format_exc())
+	# Optional argument
+	parser.add_argument('--work_queue', type=str,
+					help='An optional path to a work queue directory on a shared file system (created if it does not exist yet) to convert one archive with several nodes (or processes) at the same time: each node runs with the same parent_dir_paths and --work_queue, claims the recordings one by one with lock files, so that every recording is converted only once, and writes its own summary shard into the queue. Recordings of a crashed node are reclaimed once their lease expired (see --work_queue_lease_seconds). Merge the shards with --work_queue_merge in the end')
 
-				# write to summary
-				if (not no_summary_csv) and processing_started:
-					row_new = [nFileProcessed, conversion_status, conversion_datetime, filepath_outer, filepath, md5_file_original_hash, export_filepath_final, md5_file_converted_hash, rec_start_datetime, rec_stop_datetime, rec_duration_datetime, rec_duration_seconds, rec_n_samples, rec_battery_at_end, md5_signal_hash_before_conversion, md5_signal_hash_after_conversion]
-					writer.writerow(row_new)
-					csv_summary_file.flush()
+	# Optional argument
+	parser.add_argument('--work_queue_node_id', type=str,
+					help='An optional name of this node in the --work_queue. Default is the host name and the process id')
 
-			if cleanup_tempdir_hyp_convert and (not zmax_raw_hyp_keep_edf):
-				for dp in rm_dir_list:
-					try:
-						shutil.rmtree(dp)
-					except Exception:
-						print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % dp)
-						print(traceback.format_exc())
+	# Optional argument
+	parser.add_argument('--work_queue_lease_seconds', type=int, default=600,
+					help='The seconds after which a claimed recording of the --work_queue is reclaimed by another node if its node stopped its heartbeat (touches the lock file every quarter of this time), should be far longer than the clock differences of the nodes. Default is 600')
 
-			if temp_dir_needs_removal:
-				try:
-					safe_zip_dir_cleanup(temp_dir)
-				except:
-					print('FAILED TO DELETE THE LEFT TEMPORARY DIRECTORY: %s' % temp_dir)
-					print(traceback.format_exc())
+	# Optional argument
+	parser.add_argument('--work_queue_merge', type=str,
+					help='An optional path to a csv file to merge the summary shards of all nodes of the --work_queue into (after the conversion). No parent_dir_paths are needed just for the merge.')
 
-	# close summary csv file again
-	if (not no_summary_csv) and (not only_post_process_csv_summary_file) and processing_started:
-		csv_summary_file.close()
-	if (not no_summary_csv) or only_post_process_csv_summary_file:
-		df_csv_in = pandas.read_csv(filepath_csv_summary_file, quoting=csv.QUOTE_NONNUMERIC)
-		df_csv_in.reset_index()  # make sure indexes pair with number of rows
-
-		df_csv_in_by_n_samples = df_csv_in.sort_values(by=['rec_duration_original_samples'],ascending=True)
-		df_csv_in_by_n_samples["duplicates_in_duration"] = numpy.nan
-		df_len = len(df_csv_in_by_n_samples.index)
-		df_csv_in_by_n_samples.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_n_samples.iloc[iRow, :]
-			ns = row['rec_duration_original_samples']
-			if (ns is None) or ns is numpy.nan:
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_n_samples.iloc[iRow2, :]
-				ns2 = row2['rec_duration_original_samples']
-				if ns2 > (ns + 5*256):
-					break
-				elif ns2 == ns:
-					#print(row.zmax_file_path_original)
-					#print(row2.zmax_file_path_original)
-					df_csv_in_by_n_samples.iloc[iRow, df_csv_in_by_n_samples.columns.get_loc("duplicates_in_duration")] = row2["file_number"]
-					df_csv_in_by_n_samples.iloc[iRow2, df_csv_in_by_n_samples.columns.get_loc("duplicates_in_duration")] = row["file_number"]
-					break
+	# Switch
+	parser.add_argument('--submit_to_server', action='store_true',
+					help='Switch to send this conversion (i.e. all the other given options) as a job to a server started with --serve instead of running it in this process. The summary rows of the job are returned by the server.')
 
-		df_csv_in = df_csv_in_by_n_samples.sort_values(by=['file_number'],ascending=True)
+	# Optional argument
+	parser.add_argument('--serve_host', type=str, default='127.0.0.1',
+					help='The host of the server for --serve and --submit_to_server, --serve only accepts loopback hosts (e.g. 127.0.0.1 or localhost). Default is \"127.0.0.1\"')
 
+	# Optional argument
+	parser.add_argument('--serve_port', type=int, default=47823,
+					help='The port of the server for --serve and --submit_to_server. Default is 47823')
 
-		df_csv_in_by_n_samples = df_csv_in.sort_values(by=['rec_duration_original_samples'],ascending=True)
-		df_csv_in_by_n_samples["duplicates_in_duration_different_conversion"] = numpy.nan
-		df_len = len(df_csv_in_by_n_samples.index)
-		df_csv_in_by_n_samples.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_n_samples.iloc[iRow, :]
-			ns = row['rec_duration_original_samples']
-			if (ns is None) or ns is numpy.nan:
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_n_samples.iloc[iRow2, :]
-				ns2 = row2['rec_duration_original_samples']
-				if ns2 > (ns + 5*256):
-					break
-				elif ns2 == (ns + 5*256):
-					#print(row.zmax_file_path_original)
-					#print(row2.zmax_file_path_original)
-					df_csv_in_by_n_samples.iloc[iRow, df_csv_in_by_n_samples.columns.get_loc("duplicates_in_duration_different_conversion")] = row2["file_number"]
-					df_csv_in_by_n_samples.iloc[iRow2, df_csv_in_by_n_samples.columns.get_loc("duplicates_in_duration_different_conversion")] = row["file_number"]
-					break
-		df_csv_in = df_csv_in_by_n_samples.sort_values(by=['file_number'],ascending=True)
-
-		df_csv_in_by_hash = df_csv_in.sort_values(by=['hash_zmax_file_path_original_md5'],ascending=True)
-		df_csv_in_by_hash["duplicates_in_hash_zmax_file_path_original_md5"] = numpy.nan
-		df_len = len(df_csv_in_by_hash.index)
-		df_csv_in_by_hash.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_hash.iloc[iRow, :]
-			hash_string = row['hash_zmax_file_path_original_md5']
-			if (hash_string is None) or (hash_string == 'not_computed'):
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_hash.iloc[iRow2, :]
-				hash_string2 = row2['hash_zmax_file_path_original_md5']
-				if hash_string2 == hash_string:
-					df_csv_in_by_hash.iloc[iRow, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_zmax_file_path_original_md5")] = row2["file_number"]
-					df_csv_in_by_hash.iloc[iRow2, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_zmax_file_path_original_md5")] = row["file_number"]
-					break
-		df_csv_in = df_csv_in_by_hash.sort_values(by=['file_number'],ascending=True)
-
-		df_csv_in_by_hash = df_csv_in.sort_values(by=['hash_converted_file_path_md5'],ascending=True)
-		df_csv_in_by_hash["duplicates_in_hash_converted_file_path_md5"] = numpy.nan
-		df_len = len(df_csv_in_by_hash.index)
-		df_csv_in_by_hash.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_hash.iloc[iRow, :]
-			hash_string = row['hash_converted_file_path_md5']
-			if (hash_string is None) or (hash_string == 'not_computed'):
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_hash.iloc[iRow2, :]
-				hash_string2 = row2['hash_converted_file_path_md5']
-				if hash_string2 == hash_string:
-					df_csv_in_by_hash.iloc[iRow, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_converted_file_path_md5")] = row2["file_number"]
-					df_csv_in_by_hash.iloc[iRow2, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_converted_file_path_md5")] = row["file_number"]
-					break
-		df_csv_in = df_csv_in_by_hash.sort_values(by=['file_number'],ascending=True)
+	# Optional argument
+	parser.add_argument('--serve_workers', type=int, default=1,
+					help='The number of warm worker processes of the server to run jobs in parallel. Default is 1 (jobs run one after another in the server process)')
 
+	return parser
 
-		df_csv_in_by_hash = df_csv_in.sort_values(by=['hash_signals_before_conversion'],ascending=True)
-		df_csv_in_by_hash["duplicates_in_hash_signals_before_conversion"] = numpy.nan
-		df_len = len(df_csv_in_by_hash.index)
-		df_csv_in_by_hash.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_hash.iloc[iRow, :]
-			hash_string = row['hash_signals_before_conversion']
-			if (hash_string is None) or (hash_string == 'not_computed'):
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_hash.iloc[iRow2, :]
-				hash_string2 = row2['hash_signals_before_conversion']
-				if hash_string2 == hash_string:
-					df_csv_in_by_hash.iloc[iRow, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_signals_before_conversion")] = row2["file_number"]
-					df_csv_in_by_hash.iloc[iRow2, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_signals_before_conversion")] = row["file_number"]
-					break
-		df_csv_in = df_csv_in_by_hash.sort_values(by=['file_number'],ascending=True)
-
-		df_csv_in_by_hash = df_csv_in.sort_values(by=['hash_signals_after_conversion'],ascending=True)
-		df_csv_in_by_hash["duplicates_in_hash_signals_after_conversion"] = numpy.nan
-		df_len = len(df_csv_in_by_hash.index)
-		df_csv_in_by_hash.reset_index()
-		for iRow in range(0,df_len,1):
-			row = df_csv_in_by_hash.iloc[iRow, :]
-			hash_string = row['hash_signals_after_conversion']
-			if (hash_string is None) or (hash_string == 'not_computed'):
-				break
-			for iRow2 in range(iRow+1,df_len,1):
-				row2 = df_csv_in_by_hash.iloc[iRow2, :]
-				hash_string2 = row2['hash_signals_after_conversion']
-				if hash_string2 == hash_string:
-					df_csv_in_by_hash.iloc[iRow, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_signals_after_conversion")] = row2["file_number"]
-					df_csv_in_by_hash.iloc[iRow2, df_csv_in_by_hash.columns.get_loc("duplicates_in_hash_signals_after_conversion")] = row["file_number"]
-					break
-		df_csv_in = df_csv_in_by_hash.sort_values(by=['file_number'],ascending=True)
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[1:]
+	parser = get_argument_parser()
+	args = parser.parse_args(argv)
 
-		df_csv_in.to_csv(filepath_csv_summary_file, mode='w', index=False, header=True, quoting=csv.QUOTE_NONNUMERIC)
+	if args.serve:
+		if not is_loopback_host(args.serve_host):
+			parser.error('--serve_host must be a loopback host (e.g. 127.0.0.1 or localhost), the server has no authentication')
+		serve(host=args.serve_host, port=args.serve_port, workers=args.serve_workers)
+		return None
 
+	if args.summary_db_export_csv is not None and args.summary_db is None:
+		parser.error('--summary_db_export_csv requires --summary_db')
+
+	if args.work_queue_merge is not None and args.work_queue is None:
+		parser.error('--work_queue_merge requires --work_queue')
+
+	if args.write_workers == 0 or args.write_workers < -1:
+		parser.error('--write_workers must be a positive number of threads or -1 for all cores')
+
+	if not args.parent_dir_paths:
+		if args.summary_db_export_csv is not None or args.work_queue_merge is not None:
+			if args.summary_db_export_csv is not None:
+				summary_store = SummaryStore(args.summary_db)
+				summary_store.export_csv(args.summary_db_export_csv)
+				summary_store.close()
+			if args.work_queue_merge is not None:
+				WorkQueue(args.work_queue, node_id=args.work_queue_node_id).merge_summaries(args.work_queue_merge)
+			print('finished')
+			return None
+		parser.error('the following arguments are required: parent_dir_paths')
+
+	if args.submit_to_server:
+		argv_job = get_server_job_argv(argv)
+		response = submit_job(argv_job, host=args.serve_host, port=args.serve_port)
+		for row in response.get('rows', []):
+			print("%s: %s" % (row['conversion_status'], row['zmax_file_path_original']))
+		if response['status'] != 'ok':
+			print(response.get('error'))
+			sys.exit(1)
 		print('finished')
+		return response
+
+	converter = Converter.from_args(args)
+	converter.run(args.parent_dir_paths)
+	if args.summary_db_export_csv is not None:
+		summary_store = SummaryStore(args.summary_db)
+		summary_store.export_csv(args.summary_db_export_csv)
+		summary_store.close()
+	if args.work_queue_merge is not None:
+		converter.work_queue.merge_summaries(args.work_queue_merge)
+	return converter
+
+if __name__ == "__main__":
+	main()